@@ -5,6 +5,11 @@ mkdir -p "$(dirname $PATH_HISTORY)"
 LOGFILE=~/log/pyjoplin-fzf/$(date '+%Y_%m_%d-%H_%M_%S')
 mkdir -p "$(dirname "$LOGFILE")"
 
+# Keep a search daemon warm for per-keystroke queries, unless already running
+[[ -S "$HOME/tmp/pyjoplin/pyjoplin.sock" ]] || (nohup pyjoplin serve >/dev/null 2>&1 &)
+# Each new query of this launcher session cancels the previous one in the daemon
+export PYJOPLIN_CLIENT="fzf-$$"
+
 ######################
 # Battery of actions
 path_parent_dir="$(dirname $(realpath "${BASH_SOURCE[0]}"))"
@@ -17,7 +22,7 @@ function print_startup_entries ()(
 
 function print_query_results ()(
   local query="$1:?"
-  pyjoplin search "$query*" 2>> "$LOGFILE"
+  pyjoplin search --limit 200 "$query*" 2>> "$LOGFILE"
   # NOTE: Appending * for incomplete word search in query for pyjoplin
   # NOTE2: `*` should not be relevant with space-triggered search?
   # TODO: Debug why not always working?
@@ -6,16 +6,28 @@ __version__ = "0.1dev"
 __author__ = "jbriales"
 __license__ = "MIT"
 
-# Import main commands to make them available at package level
-from .commands import (
-    rebuild_fts_index,
-    search,
-    setup,
-    new,
-    edit,
-    delete,
-    new_and_edit,
-    imfeelinglucky,
-    get_notes_by_id,
-    find_title,
+# Make main commands available at package level
+# NOTE:
+#   Imported lazily, so that light entry points (e.g. the daemon client)
+#   do not pay for importing peewee, notifications, etc.
+_commands = (
+    "rebuild_fts_index",
+    "sync_fts_index",
+    "search",
+    "setup",
+    "new",
+    "edit",
+    "delete",
+    "new_and_edit",
+    "imfeelinglucky",
+    "get_notes_by_id",
+    "find_title",
 )
+
+
+def __getattr__(name):
+    if name in _commands:
+        from pyjoplin import commands
+
+        return getattr(commands, name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
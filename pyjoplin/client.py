@@ -0,0 +1,94 @@
+# coding=utf-8
+"""
+Entry point for the pyjoplin CLI
+
+Commands run on every keystroke of a launcher (search, get, find-title, ...)
+are forwarded to a running `pyjoplin serve` daemon, if any,
+so that they skip process startup (imports, database, synonyms, ...).
+Everything else, or any command without daemon, runs in-process as usual.
+
+NOTE: Keep imports light here, this module is loaded on every CLI call.
+"""
+
+import json
+import os
+import socket
+import sys
+
+from pyjoplin.configuration import config
+
+# NOTE:
+#   These only read the database once `serve` has built the link and heading
+#   tables, but may write cache snapshots under config.PATH_CONFIG
+#   (titles, vocabulary, related notes), as they do without daemon
+SERVED_COMMANDS = (
+    "search",
+    "get",
+    "find-title",
+    "complete-title",
+    "related",
+    "backlinks",
+    "links",
+    "outline",
+    "tags",
+)
+
+
+def request(argv, stdout=None, stderr=None):
+    """
+    Run CLI arguments in the `pyjoplin serve` daemon
+    :param argv: CLI arguments, e.g. ['search', 'foo*']
+    :param stdout: stream for the command output
+    :param stderr: stream for the command errors
+    :return: returncode of the command, or None if no daemon is running
+    Set env var PYJOPLIN_CLIENT (e.g. per launcher session) so that
+    each request cancels the previous one from the same client.
+    """
+    stdout = stdout or sys.stdout
+    stderr = stderr or sys.stderr
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(config.PATH_SOCKET)
+    except OSError:
+        # No daemon listening (or stale socket file)
+        return None
+
+    with sock, sock.makefile("rw", encoding="utf-8") as stream:
+        # NOTE: A new request with the same client id cancels the previous one
+        message = {"argv": argv, "client": os.environ.get("PYJOPLIN_CLIENT")}
+        stream.write(json.dumps(message) + "\n")
+        stream.flush()
+        # Relay messages as they arrive until the command finishes
+        for line in stream:
+            message = json.loads(line)
+            if "stdout" in message:
+                stdout.write(message["stdout"])
+                stdout.flush()
+            elif "stderr" in message:
+                stderr.write(message["stderr"])
+            elif "returncode" in message:
+                return message["returncode"]
+    stderr.write("pyjoplin serve daemon closed the connection mid-request\n")
+    return 1
+
+
+def main():
+    argv = sys.argv[1:]
+    # NOTE: Batch mode reads stdin, which is not forwarded to the daemon
+    if (
+        argv
+        and argv[0] in SERVED_COMMANDS
+        and "--batch" not in argv
+        and "_ARGCOMPLETE" not in os.environ
+    ):
+        returncode = request(argv)
+        if returncode is not None:
+            sys.exit(returncode)
+
+    from pyjoplin.main import main as main_in_process
+
+    main_in_process()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,49 +1,361 @@
 # coding=utf-8
 
+import contextlib
 import inspect
+from concurrent.futures import ThreadPoolExecutor
+import json
 import os
 import subprocess
-
-from peewee import Entity, fn
-from pkg_resources import resource_filename
-from pyjoplin import notification
+import time
+import uuid
+
+from peewee import JOIN, SQL, Entity, Value, chunked, fn
+from playhouse.sqlite_ext import match
+from pyjoplin import (
+    duplicates,
+    folders,
+    notification,
+    related,
+    synonyms,
+    tags,
+    titles,
+    vocabulary,
+)
 from pyjoplin.configuration import config
-from pyjoplin.models import Folder, Note, NoteIndex, database as db
-from pyjoplin.utils import time_joplin
+from pyjoplin.models import (
+    Folder,
+    IndexMeta,
+    Note,
+    NoteHeading,
+    NoteHits,
+    NoteIndex,
+    NoteIndexShadow,
+    NoteLink,
+    NotePassageIndex,
+    NotePassageIndexShadow,
+    NoteRowid,
+    NoteTrigramIndex,
+    NoteTrigramIndexShadow,
+    database as db,
+    write_optimized_pragmas,
+)
+from pyjoplin.query import compile_query, plain_words, replace_words
+from pyjoplin.utils import LRUCache, time_joplin
+
+
+def rebuild_fts_index(
+    triggers=None,
+    shadow=False,
+    prefix=None,
+    trigram=None,
+    passages=None,
+    batch_size=200,
+):
+    """
+    Rebuild virtual table for FTS (fulltext search)
+    populating with all existing notes
 
+    :param triggers:
+        If True, keep the index up to date via SQLite triggers on notes,
+        so that writes from any Joplin client stay searchable.
+        If False, pyjoplin updates the index when saving notes.
+        If None, keep the current mode.
+    :param shadow:
+        If True, build the new index in a side table while the current one
+        keeps serving searches, then swap them in a single short transaction.
+    :param prefix:
+        Lengths of prefix indexes to speed up prefix queries (e.g. `foo*`),
+        as a list or a comma-separated string like '1,2,3,4'.
+        An empty value disables them. If None, keep the current ones.
+    :param trigram:
+        If True, also build a trigram index for substring search,
+        see `search` modes. If None, keep the current setting.
+    :param passages:
+        If True, also build a passage index splitting notes at headings
+        (see NotePassageIndex), for the 'passages' search mode.
+        If None, keep the current setting.
+    :param batch_size:
+        Notes per INSERT statement
+        NOTE: 4 columns x 200 rows stays below the 999 variables limit of older SQLite
+    :return:
+    """
+    if triggers is None:
+        triggers = NoteIndex.is_trigger_maintained()
+    if prefix is None:
+        prefix = NoteIndex.get_prefix_lengths()
+    elif isinstance(prefix, str):
+        prefix = [int(length) for length in prefix.split(",") if length.strip()]
+    if trigram is None:
+        trigram = NoteIndex.has_trigram_index()
+    if passages is None:
+        passages = NoteIndex.has_passage_index()
+
+    # Notes changed while rebuilding are caught by the next sync
+    sync_time = time_joplin()
+
+    # NOTE: Searches with the 'weighted' ranking join hits, but never create tables
+    NoteHits.create_table(safe=True)
+    # Create empty FTS tables from scratch
+    index_models = [NoteIndexShadow if shadow else NoteIndex]
+    if trigram:
+        index_models.append(NoteTrigramIndexShadow if shadow else NoteTrigramIndex)
+    for index_model in index_models:
+        try:
+            # Remove table in case it existed
+            index_model.drop_index_table()
+        except Exception:
+            pass
+        # NOTE: Prefix indexes are pointless for trigrams, which match substrings anyway
+        index_model.create_index_table(
+            triggers=triggers,
+            prefix=prefix if index_model is index_models[0] else None,
+            batched=shadow,
+        )
+    passage_model = NotePassageIndexShadow if shadow else NotePassageIndex
+    if passages:
+        passage_model.drop_index_table()
+        # NOTE: Never external content nor triggers, passages are split by pyjoplin
+        passage_model.create_index_table()
 
-PATH_SYNONYMS = resource_filename("pyjoplin", "synonyms.txt")
+    # Add all entries into virtual FTS tables
+    # NOTE:
+    #   A shadow build commits batch by batch instead of in one transaction,
+    #   so it never holds the database write lock for long
+    start_time = time.time()
+    with write_optimized_pragmas():
+        with contextlib.nullcontext() if shadow else db.atomic():
+            if triggers and shadow:
+                # Index external content from notes table, batch by batch
+                # while triggers keep indexed notes up to date
+                for index_model in index_models:
+                    num_notes = 0
+                    while True:
+                        num_batch_notes = index_model.fill_batch(batch_size)
+                        if not num_batch_notes:
+                            break
+                        num_notes += num_batch_notes
+            elif triggers:
+                # Index external content straight from notes table
+                for index_model in index_models:
+                    index_model.rebuild()
+                num_notes = Note.select().count()
+            else:
+                # Stream plain tuples and insert them in batches
+                notes = (
+                    Note.select(SQL("rowid"), Note.id, Note.title, Note.body)
+                    .tuples()
+                    .iterator()
+                )
+                num_notes = 0
+                for batch in chunked(notes, batch_size):
+                    with db.atomic():
+                        for index_model in index_models:
+                            index_model.insert_many(
+                                batch,
+                                fields=[
+                                    index_model.rowid,
+                                    index_model.uid,
+                                    index_model.title,
+                                    index_model.body,
+                                ],
+                            ).execute()
+                    num_notes += len(batch)
+            if passages:
+                notes = (
+                    Note.select(SQL("rowid"), Note.id, Note.title, Note.body)
+                    .tuples()
+                    .iterator()
+                )
+                for batch in chunked(notes, batch_size):
+                    with db.atomic():
+                        passage_model.insert_passages(batch)
+        # Merge all index b-trees into one so queries do not visit several
+        for index_model in index_models + ([passage_model] if passages else []):
+            index_model.optimize()
+    elapsed_sec = time.time() - start_time
+    # NOTE: Settings change along with the tables, so readers never see them mismatch
+    with db.atomic():
+        if shadow:
+            if triggers:
+                # Notes added since the last batch, then batches are done
+                for index_model in index_models:
+                    index_model.fill_batch()
+                IndexMeta.delete().where(
+                    IndexMeta.key << [model.get_fill_key() for model in index_models]
+                ).execute()
+            NoteIndex.replace_with(NoteIndexShadow, triggers=triggers)
+            if trigram:
+                NoteTrigramIndex.replace_with(NoteTrigramIndexShadow, triggers=triggers)
+            if passages:
+                NotePassageIndex.replace_with(NotePassageIndexShadow)
+        if not trigram:
+            NoteTrigramIndex.drop_index_table()
+        if not passages:
+            NotePassageIndex.drop_index_table()
+        IndexMeta.set_value("fts_mode", "triggers" if triggers else "python")
+        IndexMeta.set_value("fts_prefix", " ".join(str(length) for length in prefix))
+        IndexMeta.set_value("fts_trigram", "1" if trigram else "")
+        IndexMeta.set_value("fts_passages", "1" if passages else "")
+        IndexMeta.set_value("fts_sync_time", sync_time)
+        # NOTE: Tells caches apart from those of other builds or restored databases
+        IndexMeta.set_value("fts_id", uuid.uuid4().hex)
+        IndexMeta.bump_generation()
+    if shadow and not triggers:
+        # Catch up with notes saved into the previous index during the build
+        sync_fts_index()
+
+    rebuild_link_index()
+    rebuild_heading_index()
+
+    rate_message = "%d notes in %.2fs (%.0f rows/sec)" % (
+        num_notes,
+        elapsed_sec,
+        num_notes / max(elapsed_sec, 1e-6),
+    )
+    print("Rebuilt FTS index: %s" % rate_message)
+    if config.DO_NOTIFY:
+        notification.show(
+            "Rebuilt index", message="FTS index populated from scratch\n" + rate_message
+        )
 
 
-def rebuild_fts_index():
+def sync_fts_index():
     """
-    Rebuild virtual table for FTS (fulltext search)
-    populating with all existing notes
+    Update virtual table for FTS (fulltext search)
+    re-indexing only notes changed since the last sync or rebuild
+
+    Changes are found as in Note.changed_since.
+    Falls back to a full rebuild if the index was never built.
 
     :return:
     """
-    # Create empty FTS table from scratch
-    try:
-        # Remove table in case it existed
-        NoteIndex.drop_table()
-    except Exception:
-        pass
-    NoteIndex.create_table()
+    watermark = IndexMeta.get_value("fts_sync_time")
+    if watermark is None or not NoteIndex.table_exists():
+        rebuild_fts_index()
+        return
+    watermark = int(watermark)
+    sync_time = time_joplin()
+    # Tables added since the index was built
+    NoteHits.create_table(safe=True)
+
+    touched_uids = list(Note.changed_since(watermark))
+    # NOTE: Links are extracted by pyjoplin, whoever maintains the FTS index
+    sync_link_index(touched_uids)
+    sync_heading_index(touched_uids)
+    sync_passage_index(touched_uids)
+
+    if NoteIndex.is_trigger_maintained():
+        # Nothing to catch up, triggers index every change on notes
+        # NOTE: But they invalidated cached searches before headings and passages
+        # were updated, e.g. for `h:` filters
+        if touched_uids:
+            IndexMeta.bump_generation()
+        IndexMeta.set_value("fts_sync_time", sync_time)
+        print("Synced FTS index: maintained by triggers")
+        return
 
-    # Add all entries into virtual FTS table
-    notes = Note.select()
+    # Drop stale entries, then re-insert those notes that still exist
     with db.atomic():
-        for note in notes:
-            NoteIndex.insert(
-                {
-                    NoteIndex.uid: note.id,
-                    NoteIndex.title: note.title,
-                    NoteIndex.body: note.body,
-                }
+        NoteIndex.remove_notes(touched_uids)
+        for index_model in NoteIndex.get_index_models():
+            for batch in chunked(touched_uids, 100):
+                index_model.insert_notes(Note.id << batch)
+        IndexMeta.set_value("fts_sync_time", sync_time)
+
+    print("Synced FTS index: %d notes re-indexed" % len(touched_uids))
+
+
+def rebuild_link_index(batch_size=500):
+    """
+    Rebuild table of links between notes (see NoteLink) from all note bodies
+    :return:
+    """
+    start_time = time.time()
+    with db.atomic():
+        NoteLink.drop_table(safe=True)
+        NoteLink.create_table()
+        notes = Note.select(Note.id, Note.body).tuples().iterator()
+        num_links = 0
+        for batch in chunked(notes, batch_size):
+            num_links += NoteLink.insert_links(batch)
+    print(
+        "Rebuilt link index: %d links in %.2fs" % (num_links, time.time() - start_time)
+    )
+
+
+def sync_link_index(uids):
+    """
+    Extract again links of these notes, e.g. changed outside pyjoplin
+    :param uids: uids of changed or deleted notes
+    :return:
+    """
+    if not NoteLink.table_exists():
+        rebuild_link_index()
+        return
+    with db.atomic():
+        NoteLink.remove_links(uids)
+        for batch in chunked(uids, 500):
+            NoteLink.insert_links(
+                Note.select(Note.id, Note.body).where(Note.id << batch).tuples()
+            )
+
+
+def rebuild_heading_index(batch_size=500):
+    """
+    Rebuild table of note headings (see NoteHeading) from all note bodies
+    :return:
+    """
+    start_time = time.time()
+    with db.atomic():
+        NoteHeading.drop_table(safe=True)
+        NoteHeading.create_table()
+        notes = Note.select(SQL("rowid"), Note.body).tuples().iterator()
+        num_headings = 0
+        for batch in chunked(notes, batch_size):
+            num_headings += NoteHeading.insert_headings(batch)
+    print(
+        "Rebuilt heading index: %d headings in %.2fs"
+        % (num_headings, time.time() - start_time)
+    )
+
+
+def sync_heading_index(uids):
+    """
+    Extract again headings of these notes, e.g. changed outside pyjoplin
+    :param uids: uids of changed or deleted notes
+    :return:
+    """
+    if not NoteHeading.table_exists():
+        rebuild_heading_index()
+        return
+    with db.atomic():
+        num_notes = 0
+        for batch in chunked(uids, 500):
+            notes = (
+                Note.select(SQL("rowid"), Note.body).where(Note.id << batch).tuples()[:]
+            )
+            NoteHeading.remove_headings([rowid for rowid, _ in notes])
+            NoteHeading.insert_headings(notes)
+            num_notes += len(notes)
+        if num_notes < len(uids):
+            # Some notes were deleted, and their rowids with them
+            NoteHeading.delete().where(
+                NoteHeading.note_rowid.not_in(Note.select(SQL("rowid")))
             ).execute()
 
-    if config.DO_NOTIFY:
-        notification.show("Rebuilt index", message="FTS index populated from scratch")
+
+def sync_passage_index(uids):
+    """
+    Split again passages of these notes, e.g. changed outside pyjoplin
+    :param uids: uids of changed or deleted notes
+    :return:
+    """
+    if not uids or not NoteIndex.has_passage_index():
+        return
+    with db.atomic():
+        NotePassageIndex.delete_entries(uids)
+        for batch in chunked(uids, 100):
+            NotePassageIndex.insert_notes(Note.id << batch)
 
 
 def find_empty_notes(delete=False):
@@ -91,65 +403,635 @@ def list_conflicts():
             print("%s %s" % (note.id, note.title))
 
 
-def substitute_search_column_aliases(search_str):
-    import re
-
-    # Substitute 't:' (after beginning of string or space) by 'title:'
-    search_str = re.sub(r"(^| )t:", r"\1title:", search_str)
-    # Substitute 'b:' (after beginning of string or space) by 'body:'
-    search_str = re.sub(r"(^| )b:", r"\1body:", search_str)
-    return search_str
-
-
 def replace_synonyms(search_str):
-    # Define list of sets of synonyms
+    # Replace registered synonyms with OR-sets of all their alternatives
     # These synonyms help ensuring I get all relevant results
     # even if I may often switch between several close alternatives
     # This avoids having to write down certain kw just for search once and again
-    with open(PATH_SYNONYMS, "r") as f:
-        sets_of_synonyms = [the_line.strip()[1:-1].split(r"' '") for the_line in f]
-    # NOTE: These are not sets but lists, but anyway keeping some name
+    return synonyms.replace_synonyms(search_str)
+
+
+# Cache of search results, e.g. for repeated queries while typing into a launcher
+# NOTE: Mostly useful within long-running processes, see `pyjoplin serve`
+search_cache = LRUCache(maxsize=256, maxweight=100000)
+
+
+# Fields that searches can return, see `search_columns`
+SEARCH_FIELDS = ("rowid", "uid", "title", "body", "snippet", "highlight", "offset")
+DEFAULT_SEARCH_FIELDS = ("rowid", "uid", "title", "body", "snippet")
+
+
+def search_columns(
+    index_model, fields, highlight_markers, highlight_tokens, matching=True
+):
+    """
+    Build the SQL columns for the requested fields only
+    so that unused bodies are not read nor snippets computed
+    :param index_model: NoteIndex, NoteTrigramIndex or NotePassageIndex
+    :param fields: names in SEARCH_FIELDS
+    :param highlight_markers: (open, close) marks around matches in `highlight`
+    :param highlight_tokens: tokens around matches in `highlight`, None for whole body
+    :param matching: False if the query has no MATCH, e.g. filters only
+    :return:
+    """
+    table = Entity(index_model._meta.table_name)
+    # NOTE: Trigram tokens are about one character long, so widen their windows
+    token_scale = 4 if index_model is NoteTrigramIndex else 1
+    columns = list()
+    for field in fields:
+        if field in ("snippet", "highlight") and not matching:
+            # Nothing to highlight, so the beginning of the body
+            # NOTE: About 6 characters per word token
+            num_tokens = 15 if field == "snippet" else highlight_tokens
+            if num_tokens is None:
+                column = index_model.body
+            else:
+                column = fn.substr(index_model.body, 1, 6 * num_tokens)
+        elif field == "snippet":
+            column = fn.snippet(
+                table, -1, "<b>", "</b>", "<b>...</b>", 15 * token_scale
+            )
+        elif field == "highlight":
+            if highlight_tokens is None:
+                # Whole body, e.g. for a preview pane
+                column = fn.highlight(table, 2, *highlight_markers)
+            else:
+                column = fn.snippet(
+                    table, 2, *highlight_markers, "...", highlight_tokens * token_scale
+                )
+        elif field == "rowid" and index_model is NotePassageIndex:
+            column = index_model.note_rowid
+        elif field == "offset":
+            # Beginning of the body, unless searching passages
+            column = index_model.offset if index_model is NotePassageIndex else Value(0)
+        elif field in ("rowid", "uid", "title", "body"):
+            columns.append(getattr(index_model, field))
+            continue
+        else:
+            raise ValueError(
+                "Unknown search field %s, choose from %s" % (field, SEARCH_FIELDS)
+            )
+        columns.append(column.alias(field))
+    return columns
+
+
+SEARCH_RANKINGS = ("bm25", "weighted")
+
+
+def rank_expression(index_model, ranking):
+    """
+    Build the SQL expression ordering search results, lower is better
+    :param index_model: NoteIndex or NoteTrigramIndex
+    :param ranking:
+        'bm25' scores text relevance with all columns weighted the same,
+        'weighted' scores title matches above body matches (see
+        config.RANK_COLUMN_WEIGHTS) and boosts notes updated recently
+        or often opened from pyjoplin (see NoteHits).
+    :return: expression on index_model, NoteRowid and NoteHits
+    """
+    if ranking == "bm25":
+        return index_model.bm25()
+    if ranking != "weighted":
+        raise ValueError("Unknown search ranking %s" % ranking)
+    # NOTE: bm25 is negative, more so for better matches, so boosts are subtracted
+    return index_model.bm25(*config.RANK_COLUMN_WEIGHTS) - rank_boosts()
+
+
+def rank_boosts():
+    """
+    Build the SQL expression of the 'weighted' ranking boosts
+    for notes updated recently or often opened from pyjoplin (see NoteHits)
+    :return: expression on NoteRowid and NoteHits, higher is better
+    """
+    now = time_joplin()
+    half_life_msec = config.RANK_HALF_LIFE_DAYS * 24 * 3600 * 1000.0
+
+    def decay(timestamp):
+        # 1 for now, 0.5 after a half-life, then slowly towards 0
+        return 1.0 / (1.0 + (now - timestamp) / half_life_msec)
 
-    # Preprocess into dictionary for faster query
-    dict_of_synonyms = {
-        the_word: the_set for the_set in sets_of_synonyms for the_word in the_set
-    }
+    recency = decay(NoteRowid.updated_time)
+    # Saturates with the number of hits, fading since the last one
+    # NOTE: Unconverted float, or peewee casts it to int as the field is an integer
+    frequency = NoteHits.num_hits / (NoteHits.num_hits + Value(3.0, converter=False))
+    hits = fn.COALESCE(frequency * decay(NoteHits.last_hit_time), 0.0)
+    return config.RANK_RECENCY_WEIGHT * recency + config.RANK_HITS_WEIGHT * hits
 
-    pattern: str = r"(?P<pre>^|\s)(?P<word>%s)(?=\s|$)" % "|".join(
-        dict_of_synonyms.keys()
+
+def rowid_set_sql(rowids):
+    # Whole set as a single JSON parameter, expanded inside SQLite
+    # NOTE: Unlike one parameter per rowid, no limit on the number of variables
+    return SQL("(SELECT value FROM json_each(?))", [json.dumps(sorted(rowids))])
+
+
+def restrict_rowids(
+    query, index_model, rowids=None, excluded_rowids=None, lookup=False
+):
+    """
+    Restrict an index query to some notes, e.g. those with a tag
+    :param rowids: set of note rowids to keep, None for all
+    :param excluded_rowids: set of note rowids to skip, None for none
+    :param lookup:
+        If True, read allowed rowids straight from the index, e.g. without MATCH.
+        Otherwise filter full-text matches by rowid.
+        NOTE: FTS5 would run the whole MATCH once per allowed rowid instead,
+        so the rowid is hidden from it in an expression
+    :return: query
+    """
+    rowid = index_model.rowid if lookup else index_model.rowid + 0
+    if index_model is NotePassageIndex:
+        # Passages have rowids of their own, and FTS5 ignores their note's one
+        rowid = index_model.note_rowid
+    if rowids is not None:
+        query = query.where(rowid.in_(rowid_set_sql(rowids)))
+    if excluded_rowids:
+        query = query.where(rowid.not_in(rowid_set_sql(excluded_rowids)))
+    return query
+
+
+def search_index(
+    index_model,
+    search_str,
+    limit=None,
+    offset=0,
+    fields=DEFAULT_SEARCH_FIELDS,
+    highlight_markers=("<b>", "</b>"),
+    highlight_tokens=32,
+    ranking="bm25",
+    rowids=None,
+    excluded_rowids=None,
+    conditions=(),
+):
+    """
+    Query one index table, best matches first
+    :param index_model: NoteIndex or NoteTrigramIndex
+    :param search_str:
+        query in FTS5 syntax, or None to list all (allowed) notes
+        most recently updated first, e.g. for filters only
+    :param limit: max number of matches, or None for all
+    :param offset: number of best matches to skip, e.g. for pagination
+    :param fields: names of the fields to return, see `search_columns`
+    :param ranking: see `rank_expression`
+    :param rowids: set of note rowids to search in, None for all
+    :param excluded_rowids: set of note rowids to skip
+    :param conditions: SQL conditions on NoteRowid columns, e.g. dates
+    :return: lazy iterator over dicts with the requested fields
+    """
+    query = index_model.select(
+        *search_columns(
+            index_model,
+            fields,
+            highlight_markers,
+            highlight_tokens,
+            matching=search_str is not None,
+        )
+    )
+    if search_str is None or ranking != "bm25" or conditions:
+        # Look up note columns by rowid of each match, all in one statement
+        query = query.join_from(
+            index_model, NoteRowid, on=(NoteRowid.rowid == index_model.rowid)
+        )
+    if search_str is None:
+        order = NoteRowid.updated_time.desc()
+    else:
+        if ranking != "bm25":
+            query = query.join_from(
+                index_model,
+                NoteHits,
+                JOIN.LEFT_OUTER,
+                on=(NoteHits.note_rowid == index_model.rowid),
+            )
+        query = query.where(index_model.match(search_str))
+        order = rank_expression(index_model, ranking)
+    query = restrict_rowids(
+        query, index_model, rowids, excluded_rowids, lookup=search_str is None
+    )
+    if conditions:
+        query = query.where(*conditions)
+    query = query.order_by(order)
+    if limit is not None or offset:
+        # NOTE: With a LIMIT, SQLite computes snippets for returned rows only
+        query = query.limit(limit).offset(offset)
+    return query.dicts().iterator()
+
+
+def search_passages(
+    search_str,
+    limit=None,
+    offset=0,
+    fields=DEFAULT_SEARCH_FIELDS,
+    highlight_markers=("<b>", "</b>"),
+    highlight_tokens=32,
+    ranking="bm25",
+    rowids=None,
+    excluded_rowids=None,
+    conditions=(),
+):
+    """
+    Query the passage index, ranking each note by its best matching passage
+    Options as in `search_index`, but fields come from the best passage,
+    i.e. `body` is the passage text and `offset` its position in the note body
+    :return: lazy iterator over dicts with the requested fields
+    """
+    passage = NotePassageIndex
+    # NOTE:
+    #   FTS5 functions like bm25() are unavailable in aggregates, but not its rank
+    #   column. As the only aggregate, min() also picks the bare rowid of that row.
+    score = fn.MIN(passage.rank())
+    best = passage.select(passage.rowid.alias("passage_rowid"))
+    if ranking != "bm25" or conditions:
+        best = best.join_from(
+            passage, NoteRowid, on=(NoteRowid.rowid == passage.note_rowid)
+        )
+    if ranking == "weighted":
+        best = best.join_from(
+            passage,
+            NoteHits,
+            JOIN.LEFT_OUTER,
+            on=(NoteHits.note_rowid == passage.note_rowid),
+        )
+        # Same column weights as rank_expression, for this query only
+        weights = ", ".join(str(weight) for weight in config.RANK_COLUMN_WEIGHTS)
+        best = best.where(match(passage.rank(), "bm25(%s)" % weights))
+        # NOTE: Boosts are the same for all passages of a note
+        score = score - rank_boosts()
+    elif ranking != "bm25":
+        raise ValueError("Unknown search ranking %s" % ranking)
+    best = best.select_extend(score.alias("score")).where(passage.match(search_str))
+    best = restrict_rowids(best, passage, rowids, excluded_rowids)
+    if conditions:
+        best = best.where(*conditions)
+    best = best.group_by(passage.note_rowid).order_by(score)
+    if limit is not None or offset:
+        best = best.limit(limit).offset(offset)
+    best = best.cte("best", materialized=True)
+
+    # Fields of the best passages only, e.g. snippets
+    # NOTE: Same MATCH again, as FTS5 functions need it, with the rowid hidden
+    # from FTS5 so that it runs once instead of once per passage
+    query = (
+        passage.select(
+            *search_columns(passage, fields, highlight_markers, highlight_tokens)
+        )
+        .join(best, on=(passage.rowid + 0 == best.c.passage_rowid))
+        .where(passage.match(search_str))
+        .order_by(best.c.score)
+        .with_cte(best)
     )
+    return query.dicts().iterator()
+
+
+# Statuses of `is:` filters
+SEARCH_STATUSES = ("todo", "done", "conflict")
+
 
+def parse_search_date(value):
+    """
+    Parse dates in search filters, in local time
+    :param value:
+        a period like 2024, 2024-01 or 2024-01-31,
+        or a time ago like 3d, 2w, 6m or 1y (days, weeks, months, years)
+    :return: (start, end) of the period in Joplin timestamps (msec)
+        where start == end for times ago
+    """
     import re
+    from datetime import datetime, timedelta
+
+    match = re.fullmatch(r"(\d+)([dwmy])", value)
+    if match:
+        days_per_unit = dict(d=1, w=7, m=30, y=365)
+        ago = timedelta(days=int(match.group(1)) * days_per_unit[match.group(2)])
+        timestamp = int((datetime.now() - ago).timestamp() * 1000)
+        # Whole minutes, so that repeated queries share cache entries
+        timestamp -= timestamp % 60000
+        return timestamp, timestamp
+
+    match = re.fullmatch(r"(\d{4})(?:-(\d{1,2})(?:-(\d{1,2}))?)?", value)
+    if not match:
+        raise ValueError(
+            "Bad date %s in search filter, use e.g. 2024, 2024-01, 2024-01-31 or 3d"
+            % value
+        )
+    year, month, day = [int(part) if part else None for part in match.groups()]
+    if day is not None:
+        start = datetime(year, month, day)
+        end = start + timedelta(days=1)
+    elif month is not None:
+        start = datetime(year, month, 1)
+        end = datetime(year + month // 12, month % 12 + 1, 1)
+    else:
+        start = datetime(year, 1, 1)
+        end = datetime(year + 1, 1, 1)
+    return int(start.timestamp() * 1000), int(end.timestamp() * 1000)
 
-    # Replace any registered synonym into OR-set for SQLite query
-    # e.g. py turns into ( py OR python )
-    return re.sub(
-        pattern,
-        lambda m: m.group("pre")
-        + r"(%s)" % (r" OR ".join(dict_of_synonyms[m.group("word")])),
-        search_str,
+
+def note_condition(operator, value):
+    """
+    Build the SQL condition on note columns for a date or status filter
+    :param operator: e.g. 'mdate>', 'cdate' or 'is'
+    :return: expression on NoteRowid
+    """
+    if operator == "is":
+        if value == "todo":
+            return NoteRowid.is_todo == 1
+        if value == "done":
+            return (NoteRowid.is_todo == 1) & (NoteRowid.todo_completed > 0)
+        if value == "conflict":
+            return NoteRowid.is_conflict == 1
+        raise ValueError(
+            "Unknown status is:%s, choose from %s" % (value, SEARCH_STATUSES)
+        )
+
+    column = NoteRowid.updated_time if operator[0] == "m" else NoteRowid.created_time
+    comparison = operator[len("mdate") :]
+    start, end = parse_search_date(value)
+    if comparison == ">":
+        return column >= end
+    if comparison == ">=":
+        return column >= start
+    if comparison == "<":
+        return column < start
+    if comparison == "<=":
+        return column < end
+    # Within the period
+    return (column >= start) & (column < end)
+
+
+def resolve_search_filters(search_filters):
+    """
+    Turn filter operators into restrictions of the searched notes
+    Positive filters must all hold, negated ones must all fail
+    :return: (restriction, signature)
+        where restriction holds keyword arguments for `search_index`:
+        the rowids of allowed (or None for all) and excluded notes,
+        e.g. for tags and notebooks, and SQL conditions on note columns,
+        e.g. for dates and statuses,
+        and signature changes whenever the restriction may
+    """
+    rowids, excluded_rowids, conditions = None, set(), list()
+    signatures = list()
+    for negated, operator, value in search_filters:
+        if operator in ("tag", "nb", "nb="):
+            if operator == "tag":
+                signature, tag_map = tags.get_tag_map()
+                filter_rowids = tag_map.rowids(value)
+            else:
+                folders_signature, folder_tree = folders.get_folder_tree()
+                folder_ids = folder_tree.match(value, recursive=operator == "nb")
+                # NOTE: Notes moved by other clients change no indexed column,
+                # only the notes table and Joplin's change tables
+                signature = (folders_signature, Note.changes_signature())
+                filter_rowids = {
+                    rowid
+                    for (rowid,) in Note.select(SQL("rowid"))
+                    .where(Note.parent << list(folder_ids))
+                    .tuples()
+                }
+            if negated:
+                excluded_rowids |= filter_rowids
+            elif rowids is None:
+                rowids = filter_rowids
+            else:
+                rowids &= filter_rowids
+        elif operator == "h":
+            filter_rowids = {
+                rowid
+                for (rowid,) in get_heading_index()
+                .select(NoteHeading.note_rowid)
+                .where(NoteHeading.text.contains(value))
+                .distinct()
+                .tuples()
+            }
+            # NOTE: Headings change along with the index generation
+            signature = None
+            if negated:
+                excluded_rowids |= filter_rowids
+            elif rowids is None:
+                rowids = filter_rowids
+            else:
+                rowids &= filter_rowids
+        elif operator == "is" or operator[1:].startswith("date"):
+            condition = note_condition(operator, value)
+            conditions.append(~condition if negated else condition)
+            # NOTE: Relative dates resolve differently over time, and statuses
+            # changed by other clients change no indexed column, only the
+            # notes table and Joplin's change tables
+            bounds = None if operator == "is" else parse_search_date(value)
+            signature = (bounds, Note.changes_signature())
+        else:
+            raise ValueError("Unknown search filter %s" % operator)
+        signatures.append(signature)
+    restriction = dict(
+        rowids=rowids, excluded_rowids=excluded_rowids, conditions=conditions
     )
-    # return search_str
+    return restriction, tuple(signatures)
 
 
-def search(search_str):
-    search_str = substitute_search_column_aliases(search_str)
+SEARCH_MODES = ("auto", "words", "substring", "passages")
 
-    # Replace synonyms with all their equivalents in OR search
-    search_str = replace_synonyms(search_str)
 
-    # Search query in the FTS table
-    with db.atomic():
-        found_index_notes = (
-            NoteIndex.select(
-                NoteIndex,
-                fn.snippet(Entity(NoteIndex._meta.table_name)).alias("snippet"),
+def iter_search(
+    search_str,
+    mode="auto",
+    limit=None,
+    offset=0,
+    fields=DEFAULT_SEARCH_FIELDS,
+    highlight_markers=("<b>", "</b>"),
+    highlight_tokens=32,
+    ranking=None,
+):
+    """
+    Search notes in the FTS index, yielding matches as SQLite finds them
+    so that callers can show the first ones before the query completes
+    :param search_str:
+        query in FTS5-like syntax, plus aliases, synonyms and filters like
+        `tag:python`, `-tag:archive`, `nb:work` (with sub-notebooks),
+        `nb=:work` (`*` wildcards allowed), `mdate>2024-01`, `cdate<=2023`,
+        `mdate>2w` (see `parse_search_date`), `is:todo`, `is:done`,
+        `is:conflict` or `h:install` (notes with a heading containing it)
+        (see pyjoplin.query)
+    :param mode:
+        'words' matches (stemmed) words only,
+        'substring' matches any part of words via the trigram index,
+        e.g. `Timeout` in `ResourceTimeout` (terms need 3+ characters),
+        'auto' searches words and falls back to substrings if nothing matched
+        and the trigram index was built (see `rebuild_fts_index --trigram`),
+        'passages' matches words and ranks notes by their best passage
+        via the passage index (see `rebuild_fts_index --passages`),
+        returning that passage as `body`, `snippet` and `offset`.
+    :param limit: max number of matches, or None for all
+    :param offset: number of best matches to skip, e.g. for pagination
+    :param fields:
+        names of the fields to return, from SEARCH_FIELDS
+        'snippet' is a short excerpt around matches in any column,
+        'highlight' an excerpt of the body with configurable markers,
+        'offset' the position in the body to open the note at, see `edit`
+    :param highlight_markers: (open, close) marks around matches in `highlight`
+    :param highlight_tokens: tokens around matches in `highlight`, None for whole body
+    :param ranking: see `rank_expression`, None for config.SEARCH_RANKING
+    :return: generator of dicts with the requested fields
+    """
+    ranking = ranking or config.SEARCH_RANKING
+    if mode not in SEARCH_MODES:
+        raise ValueError("Unknown search mode %s" % mode)
+    if mode == "substring" and not NoteIndex.has_trigram_index():
+        raise RuntimeError(
+            "No trigram index for substring search\n"
+            "Sol: Run pyjoplin rebuild_fts_index --trigram"
+        )
+    if mode == "passages" and not NoteIndex.has_passage_index():
+        raise RuntimeError(
+            "No passage index for passage search\n"
+            "Sol: Run pyjoplin rebuild_fts_index --passages"
+        )
+    compiled_query = compile_query(search_str, synonyms.get_synonym_table())
+    restriction, filters_signature = resolve_search_filters(compiled_query.filters)
+    search_str = compiled_query.match
+    if search_str is None and not compiled_query.filters:
+        # Nothing to match, e.g. `NOT foo` or `*`, rather than all notes
+        return
+    # NOTE: Filters alone list all allowed notes, but those matching negations
+    if search_str is None and mode in ("substring", "passages"):
+        mode = "words"
+
+    # Cached results stay valid until the index changes
+    # NOTE:
+    #   Generation is read before querying, so cached results are never older
+    #   than their key, and no transaction stays open while the caller consumes
+    fields = tuple(fields)
+    highlight_markers = tuple(highlight_markers)
+    cache_key = (
+        search_str,
+        compiled_query.filters,
+        compiled_query.excluded,
+        filters_signature,
+        mode,
+        limit,
+        offset,
+        fields,
+        highlight_markers,
+        highlight_tokens,
+        ranking,
+        IndexMeta.get_generation(),
+    )
+    found_index_notes = search_cache.get(cache_key)
+    if found_index_notes is not None:
+        yield from found_index_notes
+        return
+
+    # Search query in the FTS tables
+    found_index_notes = list()
+    if compiled_query.excluded is not None:
+        restriction["excluded_rowids"] = restriction["excluded_rowids"] | {
+            rowid
+            for (rowid,) in NoteIndex.select(NoteIndex.rowid)
+            .where(NoteIndex.match(compiled_query.excluded))
+            .tuples()
+        }
+    index_model = NoteTrigramIndex if mode == "substring" else NoteIndex
+    projection = dict(
+        fields=fields,
+        highlight_markers=highlight_markers,
+        highlight_tokens=highlight_tokens,
+        ranking=ranking,
+    )
+    if mode == "passages":
+        index_notes = search_passages(
+            search_str, limit, offset, **projection, **restriction
+        )
+    else:
+        index_notes = search_index(
+            index_model, search_str, limit, offset, **projection, **restriction
+        )
+    for index_note in index_notes:
+        found_index_notes.append(index_note)
+        yield index_note
+    if (
+        not found_index_notes
+        and mode == "auto"
+        and search_str is not None
+        and NoteIndex.has_trigram_index()
+        # A page past the last word match must not fall back
+        and not (
+            offset
+            and any(
+                search_index(
+                    NoteIndex, search_str, limit=1, fields=("rowid",), **restriction
+                )
             )
-            .where(NoteIndex.match(search_str))
-            .order_by(NoteIndex.bm25())
-            .dicts()
         )
-    return found_index_notes
+    ):
+        for index_note in search_index(
+            NoteTrigramIndex, search_str, limit, offset, **projection, **restriction
+        ):
+            found_index_notes.append(index_note)
+            yield index_note
+    # NOTE: Only reached if the caller consumed all results
+    search_cache.put(cache_key, found_index_notes)
+
+
+def search(search_str, **kwargs):
+    """
+    Search notes in the FTS index, see `iter_search` for options
+    :return: list of dicts with the requested fields
+    """
+    return list(iter_search(search_str, **kwargs))
+
+
+def suggest_query(search_str):
+    """
+    Correct words of a query missing from the index, e.g. typos
+    as in `pyhton logigng` into `python logging`
+    :return: corrected query, or None if no word was corrected
+    """
+    words = plain_words(search_str)
+    if not words:
+        return None
+    index = vocabulary.get_vocabulary_index()
+    corrections = dict()
+    for word, stem in zip(words, NoteIndex.stem_words(words)):
+        if stem is None or stem in index or word in corrections:
+            continue
+        corrected_stem = index.correct(stem)
+        if corrected_stem is not None:
+            # Keep the ending the stemmer dropped, e.g. `configur` + `ations`
+            # NOTE: Stems of a few words are not prefixes, e.g. `happi` of `happy`
+            ending = word.lower()[len(stem) :] if word.lower().startswith(stem) else ""
+            corrections[word] = corrected_stem + ending
+    return replace_words(search_str, corrections) if corrections else None
+
+
+def batch_search(queries, jobs=1, **kwargs):
+    """
+    Run many searches in this process, e.g. for bulk jobs over hundreds of queries,
+    sharing compiled synonyms, caches and database connections
+    :param queries: list of query strings
+    :param jobs:
+        number of threads running queries concurrently,
+        each with its own read connection (see peewee thread-local connections)
+    :param kwargs: options for `search`, e.g. fields
+    :return:
+        generator of dicts, in the same order as queries, with the query index
+        and either the found `notes` or the `error` of that query
+    """
+
+    def run_query(idx_query):
+        idx, query = idx_query
+        record = dict(index=idx, query=query)
+        try:
+            record["notes"] = search(query, **kwargs) if query.strip() else []
+        except Exception as err:
+            # e.g. bad filter value, should not stop the other queries
+            record["error"] = str(err)
+        return record
+
+    # Compile synonyms once upfront rather than racing to do it in every thread
+    replace_synonyms("")
+    if jobs <= 1:
+        yield from map(run_query, enumerate(queries))
+        return
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        yield from executor.map(run_query, enumerate(queries))
 
 
 def get_notes_by_id(ids, ordered=False):
@@ -209,9 +1091,8 @@ def new(title, notebook_name="personal", body=""):
         pass
 
     # Retrieve notebook id
-    try:
-        notebook = Folder.get(Folder.title == notebook_name)
-    except Folder.DoesNotExist:
+    notebook_id = folders.notebook_id(notebook_name)
+    if notebook_id is None:
         notification.show_error("Notebook not found", notebook_name)
         raise Folder.DoesNotExist
 
@@ -227,7 +1108,7 @@ def new(title, notebook_name="personal", body=""):
         body=body,
         created_time=uint_current_timestamp_msec,
         id=uid,
-        parent=notebook.id,
+        parent=notebook_id,
         source="pyjoplin",
         source_application="pyjoplin",
         title=title,
@@ -239,16 +1120,25 @@ def new(title, notebook_name="personal", body=""):
     if num_saved_notes != 1:
         notification.show_error_and_raise("Creating note", new_note.title)
     if config.DO_NOTIFY:
-        notification.show("New note created in nb %s" % notebook.title, title)
+        notification.show("New note created in nb %s" % notebook_name, title)
 
     return new_note.id
 
 
-def edit(uid):
+def edit(uid, offset=None):
+    """
+    Edit note in a text editor, saving changes as they are written
+    :param uid:
+    :param offset:
+        character offset in the note body to open the editor at,
+        e.g. the best passage of a search (see `iter_search` fields)
+    :return:
+    """
     subprocess.Popen(
         "increase_hit_history_for pyjoplin %s" % inspect.currentframe().f_code.co_name,
         shell=True,
     )
+    NoteHits.record_hit(uid)
 
     # Find note entry by uid
     note = Note.get(Note.id == uid)
@@ -281,6 +1171,11 @@ def edit(uid):
         raise Exception(f"Temp file named {note.title} already exists")
 
     note.to_file(path_tempfile)
+    # Line of the offset in the file, below the header lines of `to_string`
+    line = 1
+    if offset:
+        content = note.to_string()
+        line += content.count("\n", 0, len(content) - len(note.body) + offset)
 
     # Open file with editor
     # NOTE: Stop using template, this command gets too complicated for a single string
@@ -302,7 +1197,7 @@ def edit(uid):
             "-c",
             # NOTE: `stty -ixon` to disable "flow control characters" for vim-shell
             # NOTE: `unset PYTHONPATH` seems necessary for this to work when called through ulauncher extension
-            f"stty -ixon && unset PYTHONPATH && vim -u ~/Code/python/pyjoplin/vim/vimrc '{path_tempfile}'"
+            f"stty -ixon && unset PYTHONPATH && vim -u ~/Code/python/pyjoplin/vim/vimrc +{line} '{path_tempfile}'",
             # NOTE: Version below works when called from terminal,
             # e.g. `pyjoplin edit 170b3c8de5034f7c8023a6a39f02219c`
             # but it immediately exits when called via ulauncher
@@ -414,21 +1309,187 @@ def print_for_uid(uid):
 
 # Basic function to abstract peewee
 # Gets UID from given title by exact match, if any
-def find_title(title):
-    try:
-        note = Note.get(Note.title == title)
-        return note.id
-    except Note.DoesNotExist:
-        return None
+def find_title(title, fuzzy=False):
+    """
+    Find note by title, via the in-memory title index (see pyjoplin.titles)
+    :param title: exact title
+    :param fuzzy: if True and no title is exact, take the best completion instead
+    :return: uid or None
+    """
+    title_index = titles.get_title_index()
+    uid = title_index.find(title)
+    if uid is None and fuzzy:
+        completions = title_index.complete(title, limit=1)
+        if completions:
+            _, uid, _ = completions[0]
+    return uid
+
+
+def complete_title(query, limit=20, fuzzy=True):
+    """
+    Find notes whose title starts with or (if fuzzy) contains the query characters in order
+    :return: list of dicts with uid, title and score, best first
+    """
+    return [
+        dict(uid=uid, title=title, score=score)
+        for score, uid, title in titles.get_title_index().complete(
+            query, limit=limit, fuzzy=fuzzy
+        )
+    ]
+
+
+def get_link_index():
+    # Table of links between notes, built on first use
+    if not NoteLink.table_exists():
+        rebuild_link_index()
+    return NoteLink
+
+
+def backlinks(uid):
+    """
+    Find notes linking to a note, from the link index (see NoteLink)
+    :return: list of dicts with uid and title, most recently updated first
+    """
+    return list(
+        Note.select(Note.id.alias("uid"), Note.title)
+        .join(get_link_index(), on=(NoteLink.source == Note.id))
+        .where(NoteLink.target == uid)
+        .order_by(Note.updated_time.desc())
+        .dicts()
+    )
+
+
+def links(uid):
+    """
+    Find notes linked from a note, from the link index (see NoteLink)
+    :return: list of dicts with uid and title, None for missing notes
+    """
+    return list(
+        get_link_index()
+        .select(NoteLink.target.alias("uid"), Note.title)
+        .join(Note, JOIN.LEFT_OUTER, on=(NoteLink.target == Note.id))
+        .where(NoteLink.source == uid)
+        .order_by(Note.title)
+        .dicts()
+    )
+
+
+def get_heading_index():
+    # Table of note headings, built on first use
+    if not NoteHeading.table_exists():
+        rebuild_heading_index()
+    return NoteHeading
+
+
+def outline(uid):
+    """
+    List headings of a note, from the heading index (see NoteHeading)
+    :return: list of dicts with level, text and offset in the body, in order
+    """
+    return list(
+        get_heading_index()
+        .select(NoteHeading.level, NoteHeading.text, NoteHeading.offset)
+        .where(
+            NoteHeading.note_rowid == Note.select(SQL("rowid")).where(Note.id == uid)
+        )
+        .order_by(NoteHeading.offset)
+        .dicts()
+    )
+
+
+def orphan_notes():
+    """
+    Find notes no other note links to
+    :return: list of dicts with uid and title, most recently updated first
+    """
+    return list(
+        Note.select(Note.id.alias("uid"), Note.title)
+        .where(Note.id.not_in(get_link_index().select(NoteLink.target)))
+        .order_by(Note.updated_time.desc())
+        .dicts()
+    )
+
+
+def broken_links():
+    """
+    Find links to notes that do not exist (anymore)
+    :return: list of dicts with uid and title of the linking note, and target uid
+    """
+    Target = Note.alias()
+    return list(
+        get_link_index()
+        .select(NoteLink.source.alias("uid"), Note.title, NoteLink.target)
+        .join(Note, on=(NoteLink.source == Note.id))
+        .switch(NoteLink)
+        .join(Target, JOIN.LEFT_OUTER, on=(NoteLink.target == Target.id))
+        .where(Target.id.is_null())
+        .order_by(Note.title)
+        .dicts()
+    )
+
+
+def tag_counts():
+    """
+    Count notes per tag, from the cached tag map (see pyjoplin.tags)
+    :return: list of dicts with title and count, most used first
+    """
+    _, tag_map = tags.get_tag_map()
+    return [dict(title=title, count=count) for title, count in tag_map.counts()]
+
+
+def related_notes(uid, limit=10):
+    """
+    Find notes most similar to a given one, by TF-IDF of title and body
+    (see pyjoplin.related)
+    :return: list of dicts with uid, title and score, most similar first
+    """
+    matches = related.get_related_index().related(uid, limit=limit)
+    titles_by_uid = dict(
+        Note.select(Note.id, Note.title)
+        .where(Note.id << [match_uid for _, match_uid in matches])
+        .tuples()
+    )
+    # NOTE: Notes deleted since the index was refreshed are skipped
+    return [
+        dict(uid=match_uid, title=titles_by_uid[match_uid], score=score)
+        for score, match_uid in matches
+        if match_uid in titles_by_uid
+    ]
+
+
+def find_duplicates(threshold=0.5):
+    """
+    Find clusters of near-duplicate notes, by MinHash of title and body
+    (see pyjoplin.duplicates)
+    :param threshold: min estimated Jaccard similarity of linked notes
+    :return: list of clusters, each a list of dicts with uid, title and similarity
+    """
+    clusters = duplicates.get_minhash_index().clusters(threshold=threshold)
+    titles_by_uid = dict()
+    for batch in chunked([uid for cluster in clusters for _, uid in cluster], 500):
+        titles_by_uid.update(
+            Note.select(Note.id, Note.title).where(Note.id << batch).tuples()
+        )
+    # NOTE: Notes deleted since the index was refreshed are skipped,
+    # and so are clusters left without duplicates
+    clusters = [
+        [
+            dict(uid=uid, title=titles_by_uid[uid], similarity=similarity)
+            for similarity, uid in cluster
+            if uid in titles_by_uid
+        ]
+        for cluster in clusters
+    ]
+    return [cluster for cluster in clusters if len(cluster) > 1]
 
 
 # Util for CLI
-def print_for_title(title):
+def print_for_title(title, fuzzy=False):
     if isinstance(title, list):
         # For case coming from CLI
         title = " ".join(title)
 
-    uid = find_title(title)
+    uid = find_title(title, fuzzy=fuzzy)
     if uid:
         print_for_uid(uid)
         return 0
@@ -437,23 +1498,23 @@ def print_for_title(title):
         return 2
 
 
-def edit_by_title(title):
+def edit_by_title(title, fuzzy=False):
     if isinstance(title, list):
         # For case coming from CLI
         title = " ".join(title)
-    try:
-        note = Note.get(Note.title == title.rstrip())
-        edit(note.id)
-    except Note.DoesNotExist:
+    uid = find_title(title.rstrip(), fuzzy=fuzzy)
+    if uid:
+        edit(uid)
+    else:
         print("No exact match found for title query " + title)
 
 
 def find_notebook(name):
-    try:
-        notebook = Folder.get(Folder.title == name)
-        print(notebook.id)
-        print(notebook.title)
-    except Note.DoesNotExist:
+    notebook_id = folders.notebook_id(name)
+    if notebook_id is not None:
+        print(notebook_id)
+        print(name)
+    else:
         print("No exact match found for query")
 
 
@@ -468,6 +1529,7 @@ def imfeelinglucky(uid):
         "increase_hit_history_for pyjoplin %s" % inspect.currentframe().f_code.co_name,
         shell=True,
     )
+    NoteHits.record_hit(uid)
 
     # NOTE: For now only implements searching first code stub in Solution:
     # In other cases it could open url for "link-type" notes
@@ -479,6 +1541,17 @@ def imfeelinglucky(uid):
     import re
 
     stub = ""
+    # Look the section up by its heading, e.g. `# Solution: (working or not)`
+    # then take its first code block, or else its first inline code
+    note_rowid = Note.select(SQL("rowid")).where(Note.id == uid).scalar()
+    section = get_heading_index().get_section(note_rowid, note.body, "solution")
+    if section is not None:
+        m = re.search(r"```.*?\n(.*?)```", section, re.DOTALL) or re.search(
+            r"`(.*?)`", section, re.DOTALL
+        )
+        if m:
+            stub = m.group(1)
+    # NOTE: Otherwise scan the whole body, e.g. for a `Solution:` line without heading
     if not stub:
         # Typical example:
         # # Solution...
@@ -545,7 +1618,7 @@ def toy(search_terms):
     search_str = " ".join(search_terms)
     found_index_notes = search(search_str)
     # NOTE: This should be enough to show found entries in jlauncher
-    print("FTS: %d notes found" % found_index_notes.count())
+    print("FTS: %d notes found" % len(found_index_notes))
     for idx_note in found_index_notes:
         # print("Note: {title}\n{body}\n".format(**idx_note))
         print("Note: {title}\n{snippet}\n".format(**idx_note))
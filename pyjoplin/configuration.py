@@ -4,7 +4,6 @@ Define global configuration variables
 - Paths
 """
 import os
-from pkg_resources import resource_filename
 
 
 class Config:
@@ -12,7 +11,10 @@ class Config:
     PATH_CONFIG = os.path.expanduser("~/.config/pyjoplin/")
     PATH_TEMP = os.path.expanduser("~/tmp/pyjoplin/")
     # Files
-    PATH_ICON = resource_filename("pyjoplin", "images/pyjoplin-64.png")
+    # NOTE: Resolved relative to the package instead of via pkg_resources, which is slow to import
+    PATH_ICON = os.path.join(os.path.dirname(__file__), "images", "pyjoplin-64.png")
+    # Unix socket of the `pyjoplin serve` daemon
+    PATH_SOCKET = os.path.join(PATH_TEMP, "pyjoplin.sock")
 
     # Define template for inputs PATH and TITLE (optional)
     # EDITOR_CALL_TEMPLATE = 'xfce4-terminal --disable-server --title="note - {title}" -e "bash -c \"source ~/.bashrc && vim \'{path}\'\""'
@@ -27,6 +29,20 @@ class Config:
 
     DEFAULT_NOTEBOOK_NAME = "personal"
 
+    # Search ranking, 'bm25' or 'weighted' (see commands.rank_expression)
+    # NOTE: 'weighted' needs the index rebuilt or synced once since pyjoplin upgrades
+    SEARCH_RANKING = "bm25"
+    # bm25 weights of the index columns (id, title, body)
+    RANK_COLUMN_WEIGHTS = (0.0, 10.0, 1.0)
+    # Boosts for recently updated notes and for notes often opened from pyjoplin
+    RANK_RECENCY_WEIGHT = 1.0
+    RANK_HITS_WEIGHT = 2.0
+    # Age at which recency (or a past hit) counts half
+    RANK_HALF_LIFE_DAYS = 90
+
+    # Max characters per passage of the passage index (see models.NotePassageIndex)
+    PASSAGE_MAX_LENGTH = 2000
+
     # TODO: Use path to load/save config in file
     # Example: https://github.com/adamchainz/lifelogger/blob/master/lifelogger/config.py
     def __init__(self):
@@ -48,4 +64,4 @@ class Config:
 config = Config()
 
 # Ensure tmp folder exists
-os.makedirs(config.PATH_TEMP, exist_ok=True)
\ No newline at end of file
+os.makedirs(config.PATH_TEMP, exist_ok=True)
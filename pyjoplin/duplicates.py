@@ -0,0 +1,281 @@
+# coding=utf-8
+"""
+Near-duplicate notes by MinHash signatures and locality-sensitive hashing
+
+Each note gets a MinHash signature over the word shingles of its title
+and body, whose agreement estimates the Jaccard similarity of notes.
+Signatures are split in bands, and only notes sharing some band bucket
+are compared, instead of all pairs of notes.
+Signatures are kept in a .npz snapshot under config.PATH_CONFIG and
+computed again only for notes added or changed since, see pyjoplin.related.
+
+NOTE: Needs numpy (`pip install pyjoplin[related]`), imported lazily.
+"""
+
+import collections
+import os
+import zlib
+
+from pyjoplin.configuration import config
+from pyjoplin.related import PATTERN_TOKEN, read_changed_notes
+from pyjoplin.utils import save_snapshot
+
+PATH_DUPLICATES_CACHE = os.path.join(config.PATH_CONFIG, "minhash.npz")
+
+# Words per shingle
+SHINGLE_SIZE = 3
+# Shingles permuted at once when computing a signature
+SHINGLE_CHUNK_SIZE = 1024
+# Signature length, split in NUM_BANDS bands of NUM_PERMUTATIONS / NUM_BANDS rows
+# NOTE: 32 bands of 4 rows make pairs above ~0.4 Jaccard similarity likely candidates
+NUM_PERMUTATIONS = 128
+NUM_BANDS = 32
+# Largest prime below 2^32, for random permutations (a * x + b) % p of shingle hashes
+PRIME = (1 << 32) - 5
+# NOTE: Fixed seed, so that signatures stay comparable across runs
+SEED = 42
+
+
+def import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("Finding duplicates needs numpy\nSol: pip install numpy")
+    return numpy
+
+
+def shingle_hashes(title, body):
+    """
+    Hash consecutive words of a note, so notes sharing text share hashes
+    :return: set of 32-bit hashes, empty for notes without words
+    """
+    words = PATTERN_TOKEN.findall(("%s %s" % (title, body)).lower())
+    if not words:
+        return set()
+    # NOTE: Notes shorter than a shingle make a single one
+    size = min(SHINGLE_SIZE, len(words))
+    # NOTE: crc32 rather than hash(), which is salted per process
+    return {
+        zlib.crc32(" ".join(words[start : start + size]).encode("utf-8"))
+        for start in range(len(words) - size + 1)
+    }
+
+
+class MinHashIndex:
+    """
+    MinHash signatures of all notes, one row per note
+    """
+
+    def __init__(self, signatures, rowids, uids, updated_times, unsigned_times=None):
+        """
+        :param signatures: numpy array of notes x NUM_PERMUTATIONS
+        :param rowids: rowids of notes, i.e. signature rows
+        :param uids: uids of notes
+        :param updated_times: updated_time of notes when hashed
+        :param unsigned_times: dict of rowid to updated_time of notes without words
+        """
+        numpy = import_numpy()
+        self.signatures = signatures
+        self.rowids = list(rowids)
+        self.uids = list(uids)
+        self.updated_times = list(updated_times)
+        # NOTE: Remembered too, not to hash them again on every refresh
+        self.unsigned_times = dict(unsigned_times or dict())
+        random_state = numpy.random.RandomState(SEED)
+        self.a = random_state.randint(1, PRIME, NUM_PERMUTATIONS, dtype=numpy.uint64)
+        self.b = random_state.randint(0, PRIME, NUM_PERMUTATIONS, dtype=numpy.uint64)
+
+    @classmethod
+    def empty(cls):
+        numpy = import_numpy()
+        return cls(numpy.zeros((0, NUM_PERMUTATIONS), dtype=numpy.uint32), [], [], [])
+
+    def signature(self, title, body):
+        # Min of each random permutation of shingle hashes, None if no shingles
+        numpy = import_numpy()
+        hashes = numpy.fromiter(shingle_hashes(title, body), dtype=numpy.uint64)
+        if not len(hashes):
+            return None
+        hashes %= numpy.uint64(PRIME)
+        # NOTE: Shingles are permuted in chunks, so that long notes never take
+        # more than NUM_PERMUTATIONS x SHINGLE_CHUNK_SIZE permuted hashes
+        signature = numpy.full(NUM_PERMUTATIONS, PRIME, dtype=numpy.uint64)
+        for start in range(0, len(hashes), SHINGLE_CHUNK_SIZE):
+            chunk = hashes[None, start : start + SHINGLE_CHUNK_SIZE]
+            # NOTE: a and hashes below 2^32, so their product fits in uint64
+            permuted = (self.a[:, None] * chunk) % PRIME
+            permuted = (permuted + self.b[:, None]) % PRIME
+            numpy.minimum(signature, permuted.min(axis=1), out=signature)
+        return signature.astype(numpy.uint32)
+
+    def update(self, notes, deleted_rowids=()):
+        """
+        Replace signatures of changed notes, append new ones and drop deleted ones
+        Notes without words get no signature, as they are all alike
+        :param notes: iterable of (rowid, uid, title, body, updated_time) to (re)hash
+        :param deleted_rowids: rowids of notes to drop
+        :return:
+        """
+        numpy = import_numpy()
+        notes = list(notes)
+        dropped_rowids = set(deleted_rowids) | {note[0] for note in notes}
+        kept_rows = [
+            row for row, rowid in enumerate(self.rowids) if rowid not in dropped_rowids
+        ]
+        for rowid in dropped_rowids:
+            self.unsigned_times.pop(rowid, None)
+        new_signatures, new_notes = list(), list()
+        for note in notes:
+            signature = self.signature(note[2], note[3])
+            if signature is None:
+                self.unsigned_times[note[0]] = note[4]
+            else:
+                new_signatures.append(signature)
+                new_notes.append(note)
+        new_signatures = numpy.array(new_signatures, dtype=numpy.uint32)
+        self.signatures = numpy.vstack(
+            [self.signatures[kept_rows], new_signatures.reshape(-1, NUM_PERMUTATIONS)]
+        )
+        self.rowids = [self.rowids[row] for row in kept_rows] + [
+            n[0] for n in new_notes
+        ]
+        self.uids = [self.uids[row] for row in kept_rows] + [n[1] for n in new_notes]
+        self.updated_times = [self.updated_times[row] for row in kept_rows] + [
+            n[4] for n in new_notes
+        ]
+
+    def refresh(self):
+        """
+        Hash notes added or changed since last refresh, drop deleted ones
+        :return: True if anything changed
+        """
+        changed_notes, deleted_rowids = read_changed_notes(
+            self.rowids + list(self.unsigned_times),
+            self.updated_times + list(self.unsigned_times.values()),
+        )
+        if not changed_notes and not deleted_rowids:
+            return False
+        self.update(changed_notes, deleted_rowids)
+        return True
+
+    def candidate_pairs(self):
+        """
+        Pairs of notes sharing all signature values in at least one band
+        :return: arrays of rows and other rows, with row < other row
+        """
+        numpy = import_numpy()
+        num_notes = len(self.signatures)
+        rows_per_band = NUM_PERMUTATIONS // NUM_BANDS
+        pair_keys = [numpy.zeros(0, dtype=numpy.int64)]
+        for band in range(NUM_BANDS):
+            band_values = self.signatures[
+                :, band * rows_per_band : (band + 1) * rows_per_band
+            ]
+            # One key per band, by mixing its values (wrapping around in uint64)
+            # NOTE: Colliding keys just add candidates, checked for similarity later
+            keys = band_values.astype(numpy.uint64) @ self.a[:rows_per_band]
+            _, buckets, sizes = numpy.unique(
+                keys, return_inverse=True, return_counts=True
+            )
+            # Only rows sharing a bucket, grouped by bucket in row order
+            shared_rows = numpy.flatnonzero(sizes[buckets] > 1)
+            shared_rows = shared_rows[
+                numpy.argsort(buckets[shared_rows], kind="stable")
+            ]
+            bounds = numpy.flatnonzero(numpy.diff(buckets[shared_rows])) + 1
+            for rows in numpy.split(shared_rows, bounds):
+                first, second = numpy.triu_indices(len(rows), k=1)
+                pair_keys.append(rows[first] * num_notes + rows[second])
+        pair_keys = numpy.unique(numpy.concatenate(pair_keys))
+        return pair_keys // num_notes, pair_keys % num_notes
+
+    def similarity(self, rows, other_rows):
+        # Estimated Jaccard similarity, i.e. fraction of agreeing signature values
+        return (self.signatures[rows] == self.signatures[other_rows]).mean(axis=1)
+
+    def clusters(self, threshold=0.5):
+        """
+        Group notes linked by estimated Jaccard similarity above threshold
+        :return: list of clusters, each a list of (similarity, uid) where
+            similarity is the strongest link of that note within its cluster,
+            most similar clusters first
+        """
+        rows, other_rows = self.candidate_pairs()
+        similarities = self.similarity(rows, other_rows)
+        linked = similarities >= threshold
+
+        parents = dict()
+
+        def find(row):
+            while parents.get(row, row) != row:
+                # Path halving, keeps trees shallow
+                parents[row] = parents.get(parents[row], parents[row])
+                row = parents[row]
+            return row
+
+        best_similarity = collections.defaultdict(float)
+        for row, other_row, similarity in zip(
+            rows[linked].tolist(),
+            other_rows[linked].tolist(),
+            similarities[linked].tolist(),
+        ):
+            for r in (row, other_row):
+                best_similarity[r] = max(best_similarity[r], similarity)
+            root, other_root = find(row), find(other_row)
+            if root != other_root:
+                parents[root] = other_root
+
+        clusters = collections.defaultdict(list)
+        for row in best_similarity:
+            clusters[find(row)].append((best_similarity[row], self.uids[row]))
+        return sorted(
+            (sorted(cluster, reverse=True) for cluster in clusters.values()),
+            key=lambda cluster: -cluster[0][0],
+        )
+
+    def save(self, path):
+        numpy = import_numpy()
+        arrays = dict(
+            signatures=self.signatures,
+            rowids=numpy.array(self.rowids, dtype=numpy.int64),
+            uids=numpy.array(self.uids, dtype=str),
+            updated_times=numpy.array(self.updated_times, dtype=numpy.int64),
+            unsigned_rowids=numpy.array(list(self.unsigned_times), dtype=numpy.int64),
+            unsigned_times=numpy.array(
+                list(self.unsigned_times.values()), dtype=numpy.int64
+            ),
+        )
+        save_snapshot(path, arrays, dump=lambda arrays, f: numpy.savez(f, **arrays))
+
+    @classmethod
+    def load(cls, path):
+        numpy = import_numpy()
+        with numpy.load(path) as arrays:
+            if arrays["signatures"].shape[1] != NUM_PERMUTATIONS:
+                raise ValueError("Signatures of another length")
+            return cls(
+                arrays["signatures"],
+                arrays["rowids"].tolist(),
+                arrays["uids"].tolist(),
+                arrays["updated_times"].tolist(),
+                zip(
+                    arrays["unsigned_rowids"].tolist(),
+                    arrays["unsigned_times"].tolist(),
+                ),
+            )
+
+
+def get_minhash_index():
+    """
+    Get MinHash signatures of all notes, from the snapshot on disk
+    refreshed with changes in the notes table
+    :return: MinHashIndex
+    """
+    try:
+        index = MinHashIndex.load(PATH_DUPLICATES_CACHE)
+    except (OSError, KeyError, ValueError):
+        # Missing or unreadable snapshot, hash all notes
+        index = MinHashIndex.empty()
+    if index.refresh():
+        index.save(PATH_DUPLICATES_CACHE)
+    return index
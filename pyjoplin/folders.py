@@ -0,0 +1,137 @@
+# coding=utf-8
+"""
+In-memory tree of notebooks (folders), with the subtree of each one
+
+Serves notebook titles of notes and notebook filters in search
+(e.g. `nb:work` for work and its sub-notebooks, `nb=:work` for work only)
+without a Folder query per note. Notebooks are few, so the whole tree is
+read at once, and read again whenever the folders table changes.
+"""
+
+import fnmatch
+import threading
+import time
+
+
+class FolderTree:
+    """
+    Notebooks by id and by title, with the closure of the parent relation
+    """
+
+    def __init__(self, rows):
+        """
+        :param rows: iterable of (id, title, parent id)
+        """
+        self.titles = dict()
+        self.parents = dict()
+        self.ids_by_title = dict()
+        for folder_id, title, parent_id in rows:
+            self.titles[folder_id] = title
+            self.parents[folder_id] = parent_id
+            self.ids_by_title.setdefault(title, folder_id)
+        # Subtree of each notebook, itself included
+        self.subtrees = {folder_id: {folder_id} for folder_id in self.titles}
+        for folder_id in self.titles:
+            ancestor_id = self.parents[folder_id]
+            visited = {folder_id}
+            # NOTE: Stop at missing parents, and at cycles in case of corrupt data
+            while ancestor_id in self.titles and ancestor_id not in visited:
+                self.subtrees[ancestor_id].add(folder_id)
+                visited.add(ancestor_id)
+                ancestor_id = self.parents[ancestor_id]
+
+    def __len__(self):
+        return len(self.titles)
+
+    def title(self, folder_id):
+        """
+        :return: notebook title, or None if not found
+        """
+        return self.titles.get(folder_id)
+
+    def find(self, title):
+        """
+        Find notebook with exactly this title
+        :return: id or None
+        """
+        return self.ids_by_title.get(title)
+
+    def match(self, pattern, recursive=True):
+        """
+        Find notebooks by title
+        :param pattern: title, case-insensitive, with optional * wildcards
+        :param recursive: if True, include sub-notebooks of matching ones
+        :return: set of folder ids
+        """
+        key = pattern.lower()
+        folder_ids = set()
+        for folder_id, title in self.titles.items():
+            if fnmatch.fnmatchcase(title.lower(), key):
+                if recursive:
+                    folder_ids |= self.subtrees[folder_id]
+                else:
+                    folder_ids.add(folder_id)
+        return folder_ids
+
+
+def folders_signature():
+    """
+    Cheap summary of the folders table that changes whenever notebooks may have
+    e.g. on new, deleted (count) or renamed or moved (max updated_time) notebooks
+    """
+    from pyjoplin.models import database
+
+    return tuple(
+        database.execute_sql(
+            "SELECT count(*), max(updated_time) FROM folders"
+        ).fetchone()
+    )
+
+
+def read_folders():
+    from pyjoplin.models import Folder
+
+    return Folder.select(Folder.id, Folder.title, Folder.parent).tuples()
+
+
+# In-process cache, e.g. for the lifetime of a search daemon
+_cached_signature = None
+_cached_tree = None
+_checked_time = 0.0
+_lock = threading.Lock()
+
+
+def get_folder_tree(max_age=1.0):
+    """
+    Get tree of all notebooks, cached in-process
+    Cache is invalidated by any change in the folders table
+    :param max_age:
+        seconds to trust the cache without checking the folders table,
+        so that e.g. printing many notes costs a single query
+    :return: (signature, FolderTree)
+    """
+    global _cached_signature, _cached_tree, _checked_time
+
+    if _cached_tree is not None and time.time() - _checked_time < max_age:
+        return _cached_signature, _cached_tree
+    with _lock:
+        signature = folders_signature()
+        if signature != _cached_signature:
+            _cached_tree = FolderTree(read_folders())
+            _cached_signature = signature
+        _checked_time = time.time()
+        return _cached_signature, _cached_tree
+
+
+def notebook_title(folder_id):
+    """
+    :return: title of notebook, or None if not found
+    """
+    return get_folder_tree()[1].title(folder_id)
+
+
+def notebook_id(title):
+    """
+    :return: id of notebook with exactly this title, or None if not found
+    """
+    return get_folder_tree()[1].find(title)
@@ -7,11 +7,12 @@ Interface Joplin via python
 from __future__ import print_function
 
 import argcomplete, argparse
+import json
 import six
 import sys
 
 from pyjoplin.commands import *
-
+from pyjoplin.server import serve
 
 parser = argparse.ArgumentParser(description=__doc__, epilog="By Jesus Briales")
 subparsers = parser.add_subparsers()
@@ -23,6 +24,62 @@ rebuild_fts_index.parser = subparsers.add_parser(
     "rebuild_fts_index", description=rebuild_fts_index.__doc__
 )
 rebuild_fts_index.parser.set_defaults(func=rebuild_fts_index)
+rebuild_fts_index.parser.add_argument(
+    "--triggers",
+    dest="triggers",
+    action="store_true",
+    default=None,
+    help="Keep the index up to date via SQLite triggers on notes (any Joplin client)",
+)
+rebuild_fts_index.parser.add_argument(
+    "--no-triggers",
+    dest="triggers",
+    action="store_false",
+    help="Keep the index up to date only from pyjoplin saves",
+)
+rebuild_fts_index.parser.add_argument(
+    "--shadow",
+    action="store_true",
+    help="Build the new index alongside the current one, which keeps serving searches",
+)
+rebuild_fts_index.parser.add_argument(
+    "--prefix",
+    type=six.text_type,
+    default=None,
+    help="Comma-separated lengths of prefix indexes for `foo*` queries, e.g. 1,2,3,4"
+    " (empty to disable, kept from previous rebuild if omitted)",
+)
+rebuild_fts_index.parser.add_argument(
+    "--trigram",
+    dest="trigram",
+    action="store_true",
+    default=None,
+    help="Also build a trigram index for substring search (see search --mode)",
+)
+rebuild_fts_index.parser.add_argument(
+    "--no-trigram",
+    dest="trigram",
+    action="store_false",
+    help="Drop the trigram index",
+)
+rebuild_fts_index.parser.add_argument(
+    "--passages",
+    dest="passages",
+    action="store_true",
+    default=None,
+    help="Also build a passage index of notes split at headings (see search --mode)",
+)
+rebuild_fts_index.parser.add_argument(
+    "--no-passages",
+    dest="passages",
+    action="store_false",
+    help="Drop the passage index",
+)
+
+sync_fts_index.parser = subparsers.add_parser(
+    "sync_fts_index", description=sync_fts_index.__doc__
+)
+sync_fts_index.parser.set_defaults(func=sync_fts_index)
 
 new.parser = subparsers.add_parser("new", description=new.__doc__)
 new.parser.set_defaults(func=new)
@@ -32,6 +89,12 @@ new.parser.add_argument("--notebook", default="search", help="Destination notebo
 edit.parser = subparsers.add_parser("edit", description=edit.__doc__)
 edit.parser.set_defaults(func=edit)
 edit.parser.add_argument("uid", help="Note uid (docid)")
+edit.parser.add_argument(
+    "--offset",
+    type=int,
+    default=None,
+    help="Open at this character offset of the body, e.g. from search --fields offset",
+)
 
 
 edit_by_title.parser = subparsers.add_parser(
@@ -44,6 +107,11 @@ edit_by_title.parser.add_argument(
     nargs="+",
     help="Note's title to search (by exact match)",
 )
+edit_by_title.parser.add_argument(
+    "--fuzzy",
+    action="store_true",
+    help="Take the best completion of the title if none matches exactly",
+)
 
 print_for_uid.parser = subparsers.add_parser("print", description=print_for_uid.__doc__)
 print_for_uid.parser.set_defaults(func=print_for_uid)
@@ -61,6 +129,238 @@ print_for_title.parser.add_argument(
     nargs="+",
     help="Note's title to search (by exact match)",
 )
+print_for_title.parser.add_argument(
+    "--fuzzy",
+    action="store_true",
+    help="Take the best completion of the title if none matches exactly",
+)
+
+
+def cli_complete_title(query, limit, fuzzy, fields, delimiter):
+    """
+    Complete a partial note title from the in-memory title index
+    Prints best matching notes first, e.g. for shell or launcher completion
+    """
+    if isinstance(query, list):
+        # For case coming from CLI
+        query = " ".join(query)
+    for note in complete_title(query, limit=limit, fuzzy=fuzzy):
+        print(delimiter.join([str(note[field]) for field in fields.split(",")]))
+
+
+cli_complete_title.parser = subparsers.add_parser(
+    "complete-title", description=cli_complete_title.__doc__
+)
+cli_complete_title.parser.set_defaults(func=cli_complete_title)
+cli_complete_title.parser.add_argument(
+    "query", type=six.text_type, nargs="+", help="Beginning or characters of the title"
+)
+cli_complete_title.parser.add_argument(
+    "--limit", type=int, default=20, help="Max number of notes to print"
+)
+cli_complete_title.parser.add_argument(
+    "--no-fuzzy",
+    dest="fuzzy",
+    action="store_false",
+    help="Only complete titles starting with the query",
+)
+cli_complete_title.parser.add_argument(
+    "--fields",
+    type=six.text_type,
+    default="title",
+    help="The (comma-separated) fields to include in the output line, from:"
+    " uid, title, score.",
+)
+cli_complete_title.parser.add_argument(
+    "--delimiter",
+    type=six.text_type,
+    default="\x1f",
+    help="The delimiter between fields in the output line.",
+)
+
+
+def cli_related(uid, limit, fields, delimiter):
+    """
+    List notes most similar to a given one, by TF-IDF of title and body
+    Prints most similar notes first
+    """
+    try:
+        notes = related_notes(uid, limit=limit)
+    except KeyError:
+        print("No note found for uid " + uid)
+        return 2
+    for note in notes:
+        print(delimiter.join([str(note[field]) for field in fields.split(",")]))
+
+
+cli_related.parser = subparsers.add_parser("related", description=cli_related.__doc__)
+cli_related.parser.set_defaults(func=cli_related)
+cli_related.parser.add_argument("uid", help="Note uid (docid)")
+cli_related.parser.add_argument(
+    "--limit", type=int, default=10, help="Max number of notes to print"
+)
+cli_related.parser.add_argument(
+    "--fields",
+    type=six.text_type,
+    default="uid,title",
+    help="The (comma-separated) fields to include in the output line, from:"
+    " uid, title, score.",
+)
+cli_related.parser.add_argument(
+    "--delimiter",
+    type=six.text_type,
+    default="\x1f",
+    help="The delimiter between fields in the output line.",
+)
+
+
+def cli_find_duplicates(threshold, fields, delimiter):
+    """
+    Report clusters of near-duplicate notes, e.g. conflict copies or re-imports
+    Prints one note per line, with an empty line between clusters
+    Similarity is the estimated Jaccard similarity of word shingles
+    """
+    for idx, cluster in enumerate(find_duplicates(threshold=threshold)):
+        if idx:
+            print("")
+        for note in cluster:
+            values = dict(note, similarity="%.2f" % note["similarity"])
+            print(delimiter.join([values[field] for field in fields.split(",")]))
+
+
+cli_find_duplicates.parser = subparsers.add_parser(
+    "find-duplicates", description=cli_find_duplicates.__doc__
+)
+cli_find_duplicates.parser.set_defaults(func=cli_find_duplicates)
+cli_find_duplicates.parser.add_argument(
+    "--threshold",
+    type=float,
+    default=0.5,
+    help="Min estimated similarity (0-1) for notes to be reported together",
+)
+cli_find_duplicates.parser.add_argument(
+    "--fields",
+    type=six.text_type,
+    default="similarity,uid,title",
+    help="The (comma-separated) fields to include in the output line, from:"
+    " uid, title, similarity.",
+)
+cli_find_duplicates.parser.add_argument(
+    "--delimiter",
+    type=six.text_type,
+    default="\t",
+    help="The delimiter between fields in the output line.",
+)
+
+
+def print_note_fields(notes, fields, delimiter):
+    for note in notes:
+        print(delimiter.join([str(note[field]) for field in fields.split(",")]))
+
+
+def add_note_fields_arguments(subparser, default, choices):
+    subparser.add_argument(
+        "--fields",
+        type=six.text_type,
+        default=default,
+        help="The (comma-separated) fields to include in the output line, from:"
+        " %s." % choices,
+    )
+    subparser.add_argument(
+        "--delimiter",
+        type=six.text_type,
+        default="\x1f",
+        help="The delimiter between fields in the output line.",
+    )
+
+
+def cli_backlinks(uid, fields, delimiter):
+    """
+    List notes linking to a note via joplin:// links
+    """
+    print_note_fields(backlinks(uid), fields, delimiter)
+
+
+cli_backlinks.parser = subparsers.add_parser(
+    "backlinks", description=cli_backlinks.__doc__
+)
+cli_backlinks.parser.set_defaults(func=cli_backlinks)
+cli_backlinks.parser.add_argument("uid", help="Note uid (docid)")
+add_note_fields_arguments(cli_backlinks.parser, "uid,title", "uid, title")
+
+
+def cli_links(uid, fields, delimiter):
+    """
+    List notes linked from a note via joplin:// links
+    Missing notes have title None
+    """
+    print_note_fields(links(uid), fields, delimiter)
+
+
+cli_links.parser = subparsers.add_parser("links", description=cli_links.__doc__)
+cli_links.parser.set_defaults(func=cli_links)
+cli_links.parser.add_argument("uid", help="Note uid (docid)")
+add_note_fields_arguments(cli_links.parser, "uid,title", "uid, title")
+
+
+def cli_outline(uid, fields, delimiter):
+    """
+    List headings of a note, indented by level in the outline field
+    The offset field gives their position for edit --offset
+    """
+    headings = [
+        dict(heading, outline="  " * (heading["level"] - 1) + heading["text"])
+        for heading in outline(uid)
+    ]
+    print_note_fields(headings, fields, delimiter)
+
+
+cli_outline.parser = subparsers.add_parser("outline", description=cli_outline.__doc__)
+cli_outline.parser.set_defaults(func=cli_outline)
+cli_outline.parser.add_argument("uid", help="Note uid (docid)")
+add_note_fields_arguments(cli_outline.parser, "outline", "outline, level, text, offset")
+
+
+def cli_orphans(fields, delimiter):
+    """
+    List notes no other note links to
+    """
+    print_note_fields(orphan_notes(), fields, delimiter)
+
+
+cli_orphans.parser = subparsers.add_parser("orphans", description=cli_orphans.__doc__)
+cli_orphans.parser.set_defaults(func=cli_orphans)
+add_note_fields_arguments(cli_orphans.parser, "uid,title", "uid, title")
+
+
+def cli_broken_links(fields, delimiter):
+    """
+    List links to notes that do not exist (anymore)
+    Prints the linking note and the missing target uid
+    """
+    print_note_fields(broken_links(), fields, delimiter)
+
+
+cli_broken_links.parser = subparsers.add_parser(
+    "broken-links", description=cli_broken_links.__doc__
+)
+cli_broken_links.parser.set_defaults(func=cli_broken_links)
+add_note_fields_arguments(
+    cli_broken_links.parser, "uid,title,target", "uid, title, target"
+)
+
+
+def cli_tags(fields, delimiter):
+    """
+    List tags with their number of notes, most used first
+    Search notes with a tag via `pyjoplin search tag:<name>`
+    """
+    print_note_fields(tag_counts(), fields, delimiter)
+
+
+cli_tags.parser = subparsers.add_parser("tags", description=cli_tags.__doc__)
+cli_tags.parser.set_defaults(func=cli_tags)
+add_note_fields_arguments(cli_tags.parser, "title,count", "title, count")
 
 imfeelinglucky.parser = subparsers.add_parser(
     "imfeelinglucky", description=imfeelinglucky.__doc__
@@ -92,10 +392,27 @@ rename_conflicting_notes.parser = subparsers.add_parser(
 rename_conflicting_notes.parser.set_defaults(func=rename_conflicting_notes)
 
 
-def cli_search(search_str, fields, delimiter):
+def cli_search(
+    search_str,
+    fields,
+    delimiter,
+    mode="auto",
+    limit=None,
+    offset=0,
+    highlight_markers=("<b>", "</b>"),
+    highlight_tokens=32,
+    ranking=None,
+    batch=False,
+    jobs=1,
+    autocorrect=True,
+):
     """
     Search input query into FTS tables in Joplin database
     Prints titles for matching notes
+    If nothing matches, searches the query with misspelled words corrected instead
+    (or only suggests it, with --no-autocorrect)
+    With --batch, reads one query per line from stdin instead
+    and prints one JSON line per query with its index and found notes
 
     :param string or list-of-strings:
     """
@@ -107,15 +424,45 @@ def cli_search(search_str, fields, delimiter):
         # e.g. `--fields=id,title`
         fields = fields.split(",")
 
+    options = dict(
+        mode=mode,
+        limit=limit,
+        offset=offset,
+        fields=fields,
+        highlight_markers=highlight_markers,
+        highlight_tokens=highlight_tokens or None,
+        ranking=ranking,
+    )
+    if batch:
+        if search_str:
+            raise Exception("Queries are read from stdin in batch mode")
+        queries = [line.rstrip("\n") for line in sys.stdin]
+        for record in batch_search(queries, jobs=jobs, **options):
+            print(json.dumps(record), flush=True)
+        return
+
     if not search_str:
         return  # no-op
 
-    found_notes = search(search_str)
-    if not found_notes:
+    def print_found_notes(query):
+        # Print matches as they arrive, so that a launcher can render them right away
+        num_found_notes = 0
+        # NOTE: Only requested fields are queried, e.g. no body nor snippet for titles
+        for note in iter_search(query, **options):
+            print(delimiter.join([str(note[field]) for field in fields]), flush=True)
+            num_found_notes += 1
+        return num_found_notes
+
+    if print_found_notes(search_str):
+        return
+    suggested_str = suggest_query(search_str)
+    if suggested_str is None:
+        raise Exception("No notes found")
+    if not autocorrect:
+        raise Exception("No notes found\nDid you mean: %s" % suggested_str)
+    print("No notes found, showing results for: %s" % suggested_str, file=sys.stderr)
+    if not print_found_notes(suggested_str):
         raise Exception("No notes found")
-    else:
-        for idx, note in enumerate(found_notes):
-            print(delimiter.join([note[field] for field in fields]))
 
 
 cli_search.parser = subparsers.add_parser("search", description=cli_search.__doc__)
@@ -126,7 +473,8 @@ cli_search.parser.add_argument(
     "--fields",
     type=six.text_type,
     default="title",
-    help="The (comma-separated) fields to include in the output line.",
+    help="The (comma-separated) fields to include in the output line,"
+    " from: %s." % ", ".join(SEARCH_FIELDS),
 )
 cli_search.parser.add_argument(
     "--delimiter",
@@ -134,6 +482,57 @@ cli_search.parser.add_argument(
     default="\x1F",
     help="The (comma-separated) fields to include in the output line.",
 )
+cli_search.parser.add_argument(
+    "--mode",
+    choices=SEARCH_MODES,
+    default="auto",
+    help="Match words, substrings (needs a trigram index), words falling back"
+    " to substrings when nothing matches, or words ranking notes by their best"
+    " passage (needs a passage index)",
+)
+cli_search.parser.add_argument(
+    "--ranking",
+    choices=SEARCH_RANKINGS,
+    default=None,
+    help="Order by plain bm25, or weighted by title, recency and hits"
+    " (default from configuration)",
+)
+cli_search.parser.add_argument(
+    "--limit", type=int, default=None, help="Max number of notes to print"
+)
+cli_search.parser.add_argument(
+    "--offset", type=int, default=0, help="Number of best matches to skip"
+)
+cli_search.parser.add_argument(
+    "--highlight-markers",
+    nargs=2,
+    metavar=("OPEN", "CLOSE"),
+    default=("<b>", "</b>"),
+    help="Marks around matches in the highlight field, e.g. ANSI escapes",
+)
+cli_search.parser.add_argument(
+    "--highlight-tokens",
+    type=int,
+    default=32,
+    help="Tokens around matches in the highlight field (0 for the whole body)",
+)
+cli_search.parser.add_argument(
+    "--no-autocorrect",
+    dest="autocorrect",
+    action="store_false",
+    help="If nothing matches, only suggest a corrected query instead of searching it",
+)
+cli_search.parser.add_argument(
+    "--batch",
+    action="store_true",
+    help="Read one query per line from stdin, print JSON Lines of results",
+)
+cli_search.parser.add_argument(
+    "--jobs",
+    type=int,
+    default=1,
+    help="Number of queries to run concurrently in batch mode",
+)
 cli_search.parser.set_defaults(func=cli_search)
 
 
@@ -164,6 +563,12 @@ find_empty_notes.parser.add_argument(
     "--delete", help="Delete found empty notes", action="store_true"
 )
 
+serve.parser = subparsers.add_parser("serve", description=serve.__doc__)
+serve.parser.set_defaults(func=serve)
+serve.parser.add_argument(
+    "--jobs", type=int, default=2, help="Number of requests run concurrently"
+)
+
 argcomplete.autocomplete(parser)
 
 
@@ -1,5 +1,7 @@
+from contextlib import contextmanager
 from io import open  # Unicode compatibility via default utf-8 encoding
 import os
+import re
 import time
 import traceback
 from datetime import datetime
@@ -7,7 +9,7 @@ from datetime import datetime
 
 from peewee import *
 from playhouse.sqlite_ext import *
-from pyjoplin import notification
+from pyjoplin import folders, notification
 from pyjoplin.configuration import config
 from pyjoplin.utils import time_joplin
 
@@ -16,6 +18,25 @@ path_database = os.path.expanduser("~/.config/joplin/database.sqlite")
 database = SqliteExtDatabase(path_database, **{})
 
 
+@contextmanager
+def write_optimized_pragmas(cache_size=-256000):
+    """
+    Temporarily trade durability for write speed, e.g. during bulk index builds
+    Previous pragma values are restored on exit
+    :param cache_size: SQLite page cache size (negative values are in KiB)
+    :return:
+    """
+    previous_synchronous = database.pragma("synchronous")
+    previous_cache_size = database.pragma("cache_size")
+    database.pragma("synchronous", "OFF")
+    database.pragma("cache_size", cache_size)
+    try:
+        yield
+    finally:
+        database.pragma("synchronous", previous_synchronous)
+        database.pragma("cache_size", previous_cache_size)
+
+
 class UnknownField(object):
     def __init__(self, *_, **__):
         pass
@@ -138,7 +159,7 @@ class Note(BaseModel):
         else:
             repr_body = None
         if self.parent:
-            repr_notebook = Folder.get(Folder.id == self.parent).title
+            repr_notebook = folders.notebook_title(self.parent)
         else:
             repr_notebook = None
         return "Note: %s, nb: %s, title: %s, body: %s" % (
@@ -149,9 +170,8 @@ class Note(BaseModel):
         )
 
     def to_string(self):
-        try:
-            notebook = Folder.get(Folder.id == self.parent)
-        except Folder.DoesNotExist:
+        notebook_title = folders.notebook_title(self.parent)
+        if notebook_title is None:
             notification.show_error(
                 "Notebook not found", message="nb id %s" % self.parent
             )
@@ -161,7 +181,7 @@ class Note(BaseModel):
             f"cdate={datetime.utcfromtimestamp(self.created_time/1000).strftime('%Y-%m-%d')}"
         )
         return (
-            f"{self.id}\n{self.title}\n#{notebook.title}\n{dates_line}\n\n{self.body}"
+            f"{self.id}\n{self.title}\n#{notebook_title}\n{dates_line}\n\n{self.body}"
         )
 
     def to_file(self, file_path):
@@ -216,23 +236,21 @@ class Note(BaseModel):
             notebook_name = notebook_name_line[1:]
 
             # React to notebook changes from text editor
-            try:
-                notebook = Folder.get(Folder.title == notebook_name)
-                if self.parent is not None and notebook.id != self.parent:
-                    previous_notebook = Folder.get(Folder.id == self.parent)
+            notebook_id = folders.notebook_id(notebook_name)
+            if notebook_id is not None:
+                if self.parent is not None and notebook_id != self.parent:
                     notification.show(
                         "Notebook changed",
                         note_title=self.title,
                         message="Changed from #%s to #%s"
-                        % (previous_notebook.title, notebook.title),
+                        % (folders.notebook_title(self.parent), notebook_name),
                     )
-                self.parent = notebook.id
-            except Folder.DoesNotExist:
-                previous_notebook = Folder.get(Folder.id == self.parent)
+                self.parent = notebook_id
+            else:
                 notification.show_error(
                     "Notebook not found",
                     message="#%s\nSaving to previous notebook #%s instead"
-                    % (notebook_name, previous_notebook.title),
+                    % (notebook_name, folders.notebook_title(self.parent)),
                 )
 
             # Strip dates line
@@ -256,6 +274,19 @@ class Note(BaseModel):
         # Store this note for full-text search
         try:
             NoteIndex.store_note(self)
+            # NOTE: Passages are split by pyjoplin, whoever maintains the index
+            NotePassageIndex.store_note(self)
+        except OperationalError as err:
+            print(traceback.format_exc())
+            print("Sol: Run pyjoplin rebuild_fts_index?")
+        # Store its outgoing links for backlinks, and its headings for sections
+        try:
+            NoteLink.store_links(self)
+        except OperationalError as err:
+            print(traceback.format_exc())
+            print("Sol: Run pyjoplin rebuild_fts_index?")
+        try:
+            NoteHeading.store_headings(self)
         except OperationalError as err:
             print(traceback.format_exc())
             print("Sol: Run pyjoplin rebuild_fts_index?")
@@ -263,6 +294,21 @@ class Note(BaseModel):
 
     def delete_instance(self, *args, **kwargs):
         NoteIndex.remove_note(self)
+        NotePassageIndex.remove_note(self)
+        # NOTE: Links to this note stay, and are reported as broken from now on
+        try:
+            NoteLink.remove_links([self.id])
+        except OperationalError as err:
+            print(traceback.format_exc())
+            print("Sol: Run pyjoplin rebuild_fts_index?")
+        # NOTE: No rowid for notes never saved, nor headings
+        rowid = Note.select(SQL("rowid")).where(Note.id == self.id).scalar()
+        if rowid is not None:
+            try:
+                NoteHeading.remove_headings([rowid])
+            except OperationalError as err:
+                print(traceback.format_exc())
+                print("Sol: Run pyjoplin rebuild_fts_index?")
         try:
             # Register item deletion to be synced
             deletion_item = DeletedItems.create(
@@ -276,43 +322,759 @@ class Note(BaseModel):
             )
         return super(Note, self).delete_instance(*args, **kwargs)
 
+    @classmethod
+    def changed_since(cls, timestamp):
+        """
+        Find notes changed or deleted since some time, by this or other clients
+        Changes are found from notes' updated_time and from Joplin's
+        item_changes and deleted_items tables (e.g. notes arriving via sync
+        keep the remote updated_time, but are registered as item changes).
+        :param timestamp: Joplin time in msec, see time_joplin
+        :return: set of uids, including those of deleted notes
+        """
+        # NOTE: item_type 1 stands for notes in Joplin
+        uids = set()
+        uids.update(
+            uid
+            for (uid,) in cls.select(cls.id)
+            .where(cls.updated_time > timestamp)
+            .tuples()
+        )
+        uids.update(
+            uid
+            for (uid,) in ItemChanges.select(ItemChanges.item)
+            .where(
+                (ItemChanges.created_time > timestamp) & (ItemChanges.item_type == 1)
+            )
+            .tuples()
+        )
+        uids.update(
+            uid
+            for (uid,) in DeletedItems.select(DeletedItems.item)
+            .where(
+                (DeletedItems.deleted_time > timestamp) & (DeletedItems.item_type == 1)
+            )
+            .tuples()
+        )
+        return uids
+
+    @classmethod
+    def changes_signature(cls):
+        """
+        Cheap summary of the notes table that changes whenever notes may have,
+        from the same sources as `changed_since`: new or deleted notes (count,
+        max rowid), notes saved by pyjoplin (max updated_time), and changes
+        registered by Joplin clients, e.g. notes synced in with an older
+        updated_time (max ids of item_changes and deleted_items)
+        NOTE: Max ids over all item types, which are rowid lookups,
+        while filtering on item_type would scan its index
+        :return: tuple
+        """
+        return tuple(
+            database.execute_sql(
+                "SELECT count(*), max(rowid), max(updated_time), "
+                "(SELECT max(id) FROM item_changes), "
+                "(SELECT max(id) FROM deleted_items) FROM notes"
+            ).fetchone()
+        )
+
     class Meta:
         table_name = "notes"
 
 
-class NoteIndex(FTSModel):
+class NoteIndex(FTS5Model):
     # Full-text search index.
+    # NOTE: Entries are keyed by the rowid of the indexed note in `notes`
     rowid = RowIDField()
-    uid = TextField()
+    # NOTE: Column named as in `notes` so the index can use it as external content
+    uid = SearchField(column_name="id")
     title = SearchField()
     body = SearchField()
 
+    @classmethod
+    def is_trigger_maintained(cls):
+        """
+        Check if the index is kept up to date by SQLite triggers on `notes`
+        (see `create_triggers`) instead of by pyjoplin on each save
+        :return:
+        """
+        return IndexMeta.get_value("fts_mode") == "triggers"
+
+    @classmethod
+    def get_prefix_lengths(cls):
+        """
+        Get lengths of prefix indexes in the current index, e.g. [1, 2, 3, 4]
+        :return:
+        """
+        prefix = IndexMeta.get_value("fts_prefix")
+        return [int(length) for length in prefix.split()] if prefix else []
+
+    @classmethod
+    def has_trigram_index(cls):
+        """
+        Check if the secondary trigram index (see NoteTrigramIndex) is enabled
+        :return:
+        """
+        return IndexMeta.get_value("fts_trigram") == "1"
+
+    @classmethod
+    def has_passage_index(cls):
+        """
+        Check if the passage index (see NotePassageIndex) is enabled
+        :return:
+        """
+        return IndexMeta.get_value("fts_passages") == "1"
+
+    @classmethod
+    def get_index_models(cls):
+        """
+        Get all index tables to keep up to date, main one first
+        :return:
+        """
+        if cls.has_trigram_index():
+            return [NoteIndex, NoteTrigramIndex]
+        return [NoteIndex]
+
+    @classmethod
+    def read_vocabulary(cls):
+        """
+        Read all terms in the index, as stemmed by its tokenizer
+        NOTE: Via an fts5vocab table in the temp schema, i.e. per connection
+        and outside the Joplin database
+        :return: cursor of (term, number of notes)
+        """
+        table = cls._meta.table_name
+        database.execute_sql(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS temp.{table}_vocab "
+            f"USING fts5vocab(main, {table}, row)"
+        )
+        return database.execute_sql(f"SELECT term, doc FROM temp.{table}_vocab")
+
+    @classmethod
+    def read_note_vocabulary(cls, uids):
+        """
+        Read the terms of some notes only, as stemmed by the index tokenizer
+        NOTE: Via a scratch FTS table in the temp schema, see `stem_words`
+        :param uids: uids of notes, missing ones are skipped
+        :return: list of (term, number of these notes)
+        """
+        table = "%s_delta" % cls._meta.table_name
+        database.execute_sql(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS temp.{table} "
+            f"USING fts5(title, body, tokenize='{cls._meta.options['tokenize']}')"
+        )
+        database.execute_sql(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS temp.{table}_vocab "
+            f"USING fts5vocab(temp, {table}, row)"
+        )
+        with database.atomic():
+            database.execute_sql(f"DELETE FROM temp.{table}")
+            for batch in chunked(list(uids), 500):
+                database.execute_sql(
+                    f"INSERT INTO temp.{table}(title, body) "
+                    f"SELECT title, body FROM notes WHERE id IN "
+                    f"({', '.join('?' * len(batch))})",
+                    batch,
+                )
+            vocabulary = database.execute_sql(
+                f"SELECT term, doc FROM temp.{table}_vocab"
+            ).fetchall()
+            database.execute_sql(f"DELETE FROM temp.{table}")
+        return vocabulary
+
+    @classmethod
+    def stem_words(cls, words):
+        """
+        Tokenize words as the index does, e.g. 'Configurations' into 'configur'
+        NOTE: Via a scratch FTS table in the temp schema with the same tokenizer
+        :param words: list of words
+        :return: list of the first term of each word, None for words without any
+        """
+        if not words:
+            return list()
+        table = "%s_stems" % cls._meta.table_name
+        database.execute_sql(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS temp.{table} "
+            f"USING fts5(word, tokenize='{cls._meta.options['tokenize']}')"
+        )
+        database.execute_sql(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS temp.{table}_vocab "
+            f"USING fts5vocab(temp, {table}, instance)"
+        )
+        with database.atomic():
+            database.execute_sql(f"DELETE FROM temp.{table}")
+            for rowid, word in enumerate(words):
+                database.execute_sql(
+                    f"INSERT INTO temp.{table}(rowid, word) VALUES (?, ?)",
+                    (rowid, word),
+                )
+            stems = dict(
+                database.execute_sql(
+                    f"SELECT doc, term FROM temp.{table}_vocab WHERE offset = 0"
+                ).fetchall()
+            )
+            database.execute_sql(f"DELETE FROM temp.{table}")
+        return [stems.get(rowid) for rowid in range(len(words))]
+
+    @classmethod
+    def insert_notes(cls, where):
+        """
+        Upsert index entries for the notes matching a condition, in a single statement
+        :param where: peewee expression on Note, e.g. Note.id == uid
+        :return:
+        """
+        return (
+            cls.insert_from(
+                Note.select(SQL("rowid"), Note.id, Note.title, Note.body).where(where),
+                fields=[cls.rowid, cls.uid, cls.title, cls.body],
+            )
+            .on_conflict_replace()
+            .execute()
+        )
+
     @classmethod
     def store_note(cls, note):
-        try:
-            NoteIndex.get(NoteIndex.uid == note.id)
-        except NoteIndex.DoesNotExist:
-            NoteIndex.create(uid=note.id, title=note.title, body=note.body)
+        if cls.is_trigger_maintained():
+            # Triggers already indexed the saved note
+            return
+        IndexMeta.bump_generation()
+        for index_model in cls.get_index_models():
+            index_model.insert_notes(Note.id == note.id)
+
+    @classmethod
+    def remove_note(cls, note):
+        if cls.is_trigger_maintained():
+            # Triggers remove the entry along with the note
+            return
+        cls.remove_notes([note.id])
+
+    @classmethod
+    def remove_notes(cls, uids):
+        IndexMeta.bump_generation()
+        for index_model in cls.get_index_models():
+            index_model.delete_entries(uids)
+
+    @classmethod
+    def delete_entries(cls, uids):
+        # NOTE:
+        #   Match on the uid column so that FTS resolves entries via its own index,
+        #   a plain `uid IN (...)` would scan the whole virtual table
+        for batch in chunked(uids, 100):
+            uids_query = " OR ".join('"%s"' % uid for uid in batch)
+            cls.delete().where(match(cls.uid, uids_query)).execute()
+
+    @classmethod
+    def create_index_table(cls, triggers=False, prefix=None, batched=False):
+        """
+        Create empty FTS table
+        :param triggers:
+            If True, create an external content table reading from `notes`
+            (so bodies are not stored twice) and install triggers on `notes`
+            so that writes from any Joplin client keep the index up to date.
+            NOTE: Rowids of `notes` may change on VACUUM, then rebuild the index.
+        :param prefix:
+            Lengths of the prefix indexes to build, e.g. [1, 2, 3, 4]
+            These answer prefix queries like `foo*` without scanning term ranges,
+            at the cost of a bigger index.
+        :param batched:
+            If True, triggers only maintain notes already indexed by `fill_batch`
+        :return:
+        """
+        options = dict()
+        if prefix:
+            options["prefix"] = " ".join(str(length) for length in prefix)
+        if triggers:
+            cls.create_table(content=Note, content_rowid="rowid", **options)
+            if batched:
+                IndexMeta.set_value(cls.get_fill_key(), 0)
+            cls.create_triggers(batched=batched)
         else:
-            (
-                NoteIndex.update(title=note.title, body=note.body)
-                .where(NoteIndex.uid == note.id)
-                .execute()
+            cls.create_table(**options)
+
+    @classmethod
+    def get_fill_key(cls):
+        # IndexMeta key of the last note rowid indexed so far, see `fill_batch`
+        return "%s_filled" % cls._meta.table_name
+
+    @classmethod
+    def fill_batch(cls, batch_size=None):
+        """
+        Index the next notes in rowid order, in one transaction,
+        for external content tables built while notes keep changing
+        NOTE: Triggers created with batched=True skip notes not indexed yet,
+        so writes to them during the build are indexed with their batch
+        :param batch_size: max number of notes, None for all left
+        :return: number of notes indexed
+        """
+        table = cls._meta.table_name
+        with database.atomic():
+            filled_rowid = int(IndexMeta.get_value(cls.get_fill_key(), 0))
+            last_rowid, num_notes = database.execute_sql(
+                "SELECT max(rowid), count(*) FROM "
+                "(SELECT rowid FROM notes WHERE rowid > ? ORDER BY rowid LIMIT ?)",
+                (filled_rowid, batch_size or -1),
+            ).fetchone()
+            if not num_notes:
+                return 0
+            database.execute_sql(
+                f"INSERT INTO {table}(rowid, id, title, body) "
+                "SELECT rowid, id, title, body FROM notes WHERE rowid > ? AND rowid <= ?",
+                (filled_rowid, last_rowid),
             )
+            IndexMeta.set_value(cls.get_fill_key(), last_rowid)
+        return num_notes
 
     @classmethod
-    def remove_note(cls, note):
-        try:
-            index_entry = NoteIndex.get(NoteIndex.uid == note.id)
-            index_entry.delete_instance()
-        except NoteIndex.DoesNotExist:
-            pass
+    def drop_index_table(cls):
+        cls.drop_triggers()
+        cls.drop_table(safe=True)
+
+    @classmethod
+    def create_triggers(cls, batched=False):
+        table = cls._meta.table_name
+        columns = "rowid, id, title, body"
+        new_values = "new.rowid, new.id, new.title, new.body"
+        old_values = "old.rowid, old.id, old.title, old.body"
+        delete_old = (
+            f"INSERT INTO {table}({table}, {columns}) VALUES ('delete', {old_values});"
+        )
+        insert_new = f"INSERT INTO {table}({columns}) VALUES ({new_values});"
+        # Invalidate cached search results, see IndexMeta.bump_generation
+        IndexMeta.create_table(safe=True)
+        bump_generation = (
+            f"UPDATE {IndexMeta._meta.table_name} SET value = value + 1 "
+            "WHERE key = 'generation';"
+        )
+        when_new, when_old = "", ""
+        if batched:
+            filled_rowid = (
+                f"(SELECT CAST(value AS INTEGER) FROM {IndexMeta._meta.table_name} "
+                f"WHERE key = '{cls.get_fill_key()}')"
+            )
+            when_new = f"WHEN new.rowid <= {filled_rowid} "
+            when_old = f"WHEN old.rowid <= {filled_rowid} "
+        database.execute_sql(
+            f"CREATE TRIGGER IF NOT EXISTS {table}_ai AFTER INSERT ON notes "
+            f"{when_new}BEGIN {insert_new} {bump_generation} END"
+        )
+        database.execute_sql(
+            f"CREATE TRIGGER IF NOT EXISTS {table}_ad AFTER DELETE ON notes "
+            f"{when_old}BEGIN {delete_old} {bump_generation} END"
+        )
+        database.execute_sql(
+            f"CREATE TRIGGER IF NOT EXISTS {table}_au AFTER UPDATE OF title, body ON notes "
+            f"{when_old}BEGIN {delete_old} {insert_new} {bump_generation} END"
+        )
+
+    @classmethod
+    def drop_triggers(cls):
+        table = cls._meta.table_name
+        for suffix in ("ai", "ad", "au"):
+            database.execute_sql(f"DROP TRIGGER IF EXISTS {table}_{suffix}")
+
+    @classmethod
+    def replace_with(cls, shadow_index, triggers=False):
+        """
+        Swap a fully built shadow index in place of this one
+        This only takes a short transaction, so searches keep working meanwhile
+        :param shadow_index: index model built alongside, e.g. NoteIndexShadow
+        :param triggers: if True, (re)install triggers for the swapped index
+        :return:
+        """
+        with database.atomic():
+            cls.drop_index_table()
+            shadow_index.drop_triggers()
+            database.execute_sql(
+                'ALTER TABLE "%s" RENAME TO "%s"'
+                % (shadow_index._meta.table_name, cls._meta.table_name)
+            )
+            if triggers:
+                cls.create_triggers()
 
     class Meta:
         table_name = "notes_pyjoplin_index"
         database = database
         # Use the porter stemming algorithm to tokenize content.
-        options = {"tokenize": "porter"}
+        options = {"tokenize": "porter unicode61"}
+
+
+class NoteIndexShadow(NoteIndex):
+    # Side table where the index is rebuilt while NoteIndex keeps serving searches
+    class Meta:
+        table_name = "notes_pyjoplin_index_new"
+
+
+class NoteTrigramIndex(NoteIndex):
+    # Optional secondary index over the same notes, tokenized into trigrams
+    # so that any substring of 3+ characters matches,
+    # e.g. `Timeout` in `ResourceTimeout` or `lib/x.py` in a path.
+    # NOTE: Maintained along with NoteIndex, see `get_index_models`
+    class Meta:
+        table_name = "notes_pyjoplin_trigram"
+        options = {"tokenize": "trigram"}
+
+
+class NoteTrigramIndexShadow(NoteTrigramIndex):
+    class Meta:
+        table_name = "notes_pyjoplin_trigram_new"
+
+
+class NotePassageIndex(NoteIndex):
+    # Optional index of note passages, i.e. sections between markdown headings
+    # split further if long, so that huge notes (e.g. logs or pasted docs)
+    # rank and get snippets by their best matching part.
+    # NOTE:
+    #   Entries are keyed by their own rowid, see note_rowid for the note's one.
+    #   Passages are split by pyjoplin, so triggers cannot maintain them,
+    #   see `store_note` and `sync_fts_index`
+    note_rowid = SearchField(unindexed=True)
+    # Character offset of the passage in the note body
+    offset = SearchField(unindexed=True)
+
+    @classmethod
+    def split_passages(cls, body, max_length=None):
+        """
+        Split a note body into passages at headings,
+        and sections longer than max_length at paragraph or line breaks
+        :param max_length: max characters per passage, None for config.PASSAGE_MAX_LENGTH
+        :return: list of (offset in body, passage text), skipping blank passages
+        """
+        max_length = max_length or config.PASSAGE_MAX_LENGTH
+        section_starts = [0] + [
+            offset for _, _, offset in NoteHeading.extract_headings(body) if offset
+        ]
+
+        passages = list()
+        for start, end in zip(section_starts, section_starts[1:] + [len(body)]):
+            while start < end:
+                cut = end
+                if end - start > max_length:
+                    # Prefer breaks in the second half, or passages get too short
+                    limit = start + max_length
+                    cut = body.rfind("\n\n", start + max_length // 2, limit) + 2
+                    if cut < 2:
+                        cut = body.rfind("\n", start + max_length // 2, limit) + 1
+                    if cut < 1:
+                        cut = limit
+                if body[start:cut].strip():
+                    passages.append((start, body[start:cut]))
+                start = cut
+        return passages
+
+    @classmethod
+    def insert_passages(cls, notes):
+        """
+        Add the passages of some notes
+        :param notes: iterable of (rowid, uid, title, body)
+        :return: number of passages added
+        """
+        rows = [
+            (uid, title, passage, rowid, offset)
+            for rowid, uid, title, body in notes
+            for offset, passage in cls.split_passages(body)
+        ]
+        # NOTE: 5 columns x 150 rows stays below the 999 variables limit of older SQLite
+        for batch in chunked(rows, 150):
+            cls.insert_many(
+                batch,
+                fields=[cls.uid, cls.title, cls.body, cls.note_rowid, cls.offset],
+            ).execute()
+        return len(rows)
+
+    @classmethod
+    def insert_notes(cls, where):
+        return cls.insert_passages(
+            Note.select(SQL("rowid"), Note.id, Note.title, Note.body)
+            .where(where)
+            .tuples()
+        )
+
+    @classmethod
+    def store_note(cls, note):
+        if not cls.has_passage_index():
+            return
+        with database.atomic():
+            cls.delete_entries([note.id])
+            cls.insert_notes(Note.id == note.id)
+
+    @classmethod
+    def remove_note(cls, note):
+        if cls.has_passage_index():
+            cls.delete_entries([note.id])
+
+    class Meta:
+        table_name = "notes_pyjoplin_passages"
+
+
+class NotePassageIndexShadow(NotePassageIndex):
+    class Meta:
+        table_name = "notes_pyjoplin_passages_new"
+
+
+class IndexMeta(BaseModel):
+    # Key-value bookkeeping for pyjoplin's own index tables
+    # e.g. the watermark of the last FTS index sync
+    key = TextField(primary_key=True)
+    value = TextField(null=True)
+
+    @classmethod
+    def get_value(cls, key, default=None):
+        try:
+            return IndexMeta.get(IndexMeta.key == key).value
+        except (IndexMeta.DoesNotExist, OperationalError):
+            # NOTE: OperationalError if table was not created yet
+            return default
+
+    @classmethod
+    def set_value(cls, key, value):
+        IndexMeta.create_table(safe=True)
+        IndexMeta.replace(key=key, value=value).execute()
+
+    @classmethod
+    def get_generation(cls):
+        return int(IndexMeta.get_value("generation", 0))
+
+    @classmethod
+    def bump_generation(cls):
+        """
+        Increase counter of index changes
+        e.g. to invalidate cached search results
+        :return:
+        """
+        rows = (
+            IndexMeta.update(value=SQL("value + 1"))
+            .where(IndexMeta.key == "generation")
+            .execute()
+        )
+        if not rows:
+            IndexMeta.set_value("generation", 1)
+
+    class Meta:
+        table_name = "notes_pyjoplin_meta"
+
+
+class NoteRowid(BaseModel):
+    # Read-only view of `notes` keyed by rowid
+    # so ranking and filters can join it with index tables through an integer key
+    rowid = RowIDField()
+    created_time = IntegerField()
+    updated_time = IntegerField()
+    is_conflict = IntegerField()
+    is_todo = IntegerField()
+    todo_completed = IntegerField()
+
+    class Meta:
+        table_name = "notes"
+
+
+class NoteHits(BaseModel):
+    # How often and how recently notes were opened from pyjoplin, for ranking
+    # NOTE: Keyed by the rowid of the note in `notes`, like the index tables
+    note_rowid = IntegerField(primary_key=True)
+    num_hits = IntegerField(default=0)
+    last_hit_time = IntegerField(default=0)
+
+    @classmethod
+    def record_hit(cls, uid):
+        note_rowid = Note.select(SQL("rowid")).where(Note.id == uid).scalar()
+        if note_rowid is None:
+            return
+        NoteHits.create_table(safe=True)
+        (
+            NoteHits.insert(
+                note_rowid=note_rowid, num_hits=1, last_hit_time=time_joplin()
+            )
+            .on_conflict(
+                conflict_target=[NoteHits.note_rowid],
+                preserve=[NoteHits.last_hit_time],
+                update={NoteHits.num_hits: NoteHits.num_hits + 1},
+            )
+            .execute()
+        )
+        # Hits change the ranking of cached search results
+        IndexMeta.bump_generation()
+
+    class Meta:
+        table_name = "notes_pyjoplin_hits"
+
+
+class NoteLink(BaseModel):
+    # Links between notes, e.g. [title](joplin://<uid>), i.e. edges of the link graph
+    # NOTE: Targets may not exist (anymore), i.e. broken links
+    source = TextField(column_name="source_id")
+    target = TextField(column_name="target_id", index=True)
+
+    PATTERN_LINK = re.compile(r"joplin://([0-9a-fA-F]{32})")
+
+    @classmethod
+    def extract_links(cls, uid, body):
+        """
+        Find notes linked from a note body
+        :return: list of (uid, target uid), once per target, in order of appearance
+        """
+        targets = dict.fromkeys(
+            target.lower() for target in cls.PATTERN_LINK.findall(body)
+        )
+        return [(uid, target) for target in targets if target != uid]
+
+    @classmethod
+    def insert_links(cls, notes):
+        """
+        Add links found in note bodies
+        :param notes: iterable of (uid, body)
+        :return: number of links added
+        """
+        links = [link for uid, body in notes for link in cls.extract_links(uid, body)]
+        # NOTE: 2 columns x 400 rows stays below the 999 variables limit of older SQLite
+        for batch in chunked(links, 400):
+            NoteLink.insert_many(
+                batch, fields=[NoteLink.source, NoteLink.target]
+            ).execute()
+        return len(links)
+
+    @classmethod
+    def store_links(cls, note):
+        # NOTE: Table created by rebuild_fts_index or sync_fts_index, see commands
+        with database.atomic():
+            NoteLink.delete().where(NoteLink.source == note.id).execute()
+            cls.insert_links([(note.id, note.body)])
+
+    @classmethod
+    def remove_links(cls, uids):
+        # Remove links from these notes
+        for batch in chunked(uids, 500):
+            NoteLink.delete().where(NoteLink.source << batch).execute()
+
+    class Meta:
+        table_name = "notes_pyjoplin_links"
+        primary_key = CompositeKey("source", "target")
+
+
+class NoteHeading(BaseModel):
+    # Markdown headings of notes, e.g. for sections like `# Solution`
+    # NOTE: Keyed by the rowid of the note in `notes`, like the index tables
+    note_rowid = IntegerField()
+    # Character offset of the heading line in the note body
+    offset = IntegerField()
+    level = IntegerField()
+    text = TextField()
+
+    # NOTE: Lines starting with `#` inside fenced code blocks are no headings
+    PATTERN_HEADING = re.compile(r" {0,3}(#{1,6})[ \t]+(.*?)(?:[ \t]+#+)?[ \t]*")
+    PATTERN_FENCE = re.compile(r" {0,3}(```|~~~)")
+
+    @classmethod
+    def extract_headings(cls, body):
+        """
+        Find (ATX) headings in a note body, e.g. `## Solution`
+        :return: list of (level, text, offset), in order of appearance
+        """
+        headings = list()
+        line_start = 0
+        in_fence = False
+        for line in body.splitlines(keepends=True):
+            if cls.PATTERN_FENCE.match(line):
+                in_fence = not in_fence
+            elif not in_fence:
+                match = cls.PATTERN_HEADING.fullmatch(line.rstrip("\r\n"))
+                if match and match.group(2):
+                    headings.append((len(match.group(1)), match.group(2), line_start))
+            line_start += len(line)
+        return headings
+
+    @classmethod
+    def is_heading_at(cls, body, offset, level, text):
+        """
+        Check that a heading is still at its offset in a note body,
+        i.e. that the body did not change since its headings were indexed
+        :return:
+        """
+        if offset > 0 and body[offset - 1 : offset] != "\n":
+            return False
+        line_end = body.find("\n", offset)
+        line = body[offset : line_end if line_end >= 0 else len(body)]
+        match = cls.PATTERN_HEADING.fullmatch(line.rstrip("\r"))
+        return bool(match) and (len(match.group(1)), match.group(2)) == (level, text)
+
+    @classmethod
+    def insert_headings(cls, notes):
+        """
+        Add headings found in note bodies
+        :param notes: iterable of (rowid, body)
+        :return: number of headings added
+        """
+        rows = [
+            (rowid, offset, level, text)
+            for rowid, body in notes
+            for level, text, offset in cls.extract_headings(body)
+        ]
+        # NOTE: 4 columns x 200 rows stays below the 999 variables limit of older SQLite
+        for batch in chunked(rows, 200):
+            NoteHeading.insert_many(
+                batch,
+                fields=[
+                    NoteHeading.note_rowid,
+                    NoteHeading.offset,
+                    NoteHeading.level,
+                    NoteHeading.text,
+                ],
+            ).execute()
+        return len(rows)
+
+    @classmethod
+    def store_headings(cls, note):
+        # NOTE: Table created by rebuild_fts_index or sync_fts_index, see commands
+        notes = (
+            Note.select(SQL("rowid"), Note.body).where(Note.id == note.id).tuples()[:]
+        )
+        with database.atomic():
+            cls.remove_headings([rowid for rowid, _ in notes])
+            cls.insert_headings(notes)
+
+    @classmethod
+    def remove_headings(cls, rowids):
+        for batch in chunked(rowids, 500):
+            NoteHeading.delete().where(NoteHeading.note_rowid << batch).execute()
+
+    @classmethod
+    def get_section(cls, note_rowid, body, text):
+        """
+        Find the section under the first heading starting with some text,
+        up to the next heading of the same or upper level
+        :param body: body of the note, as indexed
+        :param text: start of the heading text, case insensitive, e.g. 'solution'
+        :return: section text without its heading line, or None if no heading matches
+        """
+        headings = (
+            NoteHeading.select(NoteHeading.offset, NoteHeading.level, NoteHeading.text)
+            .where(NoteHeading.note_rowid == note_rowid)
+            .order_by(NoteHeading.offset)
+            .tuples()[:]
+        )
+        # NOTE: Offsets go stale when the body changed since indexing,
+        # e.g. edited by another client before a sync, then parse it again
+        if not all(
+            cls.is_heading_at(body, offset, level, heading_text)
+            for offset, level, heading_text in headings
+        ):
+            headings = [
+                (offset, level, heading_text)
+                for level, heading_text, offset in cls.extract_headings(body)
+            ]
+        start, section_level = None, None
+        for offset, level, heading_text in headings:
+            if start is None:
+                if heading_text.lower().startswith(text.lower()):
+                    start, section_level = offset, level
+            elif level <= section_level:
+                return body[start:offset].partition("\n")[2]
+        if start is None:
+            return None
+        return body[start:].partition("\n")[2]
+
+    class Meta:
+        table_name = "notes_pyjoplin_headings"
+        primary_key = CompositeKey("note_rowid", "offset")
 
 
 class Resources(BaseModel):
@@ -0,0 +1,454 @@
+# coding=utf-8
+"""
+Compiler of search queries into FTS5 MATCH expressions
+
+Queries are tokenized and parsed into a small syntax tree of terms, phrases,
+prefix terms, column scopes (e.g. `t:foo`), NEAR groups and AND/OR/NOT,
+with synonyms expanded into OR groups and filter operators (e.g. `tag:python`)
+set apart. The tree is then rendered as a single FTS5 expression, which is
+passed to SQLite as one parameter of the search statement.
+
+Unlike raw FTS5 syntax, any input compiles, e.g. stray quotes or parentheses
+are closed or dropped, and punctuated words like `d3.js` become phrases.
+Compiled queries are cached by query string.
+"""
+
+import collections
+import re
+
+from pyjoplin.utils import LRUCache
+
+# Operators restricting search to some notes, e.g. `tag:python -tag:archive`
+# NOTE:
+#   `nb:` includes sub-notebooks, `nb=:` does not
+#   `mdate` and `cdate` compare update and creation dates, e.g. `mdate>2024-01`
+#   `h:` keeps notes with a heading containing its value, e.g. `h:install`
+#   Filters apply to the whole query, wherever they appear in it
+SEARCH_FILTERS = (
+    "tag:",
+    "nb:",
+    "nb=:",
+    "is:",
+    "mdate:",
+    "mdate>",
+    "mdate>=",
+    "mdate<",
+    "mdate<=",
+    "cdate:",
+    "cdate>",
+    "cdate>=",
+    "cdate<",
+    "cdate<=",
+    "h:",
+)
+
+# Column scopes, e.g. `t:foo` or `title:(foo OR bar)`
+COLUMN_ALIASES = dict(t="title", b="body", title="title", body="body")
+
+KEYWORDS = ("AND", "OR", "NOT", "NEAR")
+
+# NOTE:
+#   Filters and columns only count at the start of a word, e.g. not in `notag:x`
+#   Longest filters first, e.g. so that `mdate>=` is not read as `mdate>`
+#   Commas only split words at their edges, as in `NEAR(a b, 5)`
+#   A leading minus negates, e.g. `-foo` or `-"foo bar"`, but not in `web-app`
+PATTERN_TOKEN = re.compile(
+    r"(?P<space>\s+)"
+    r'|(?<![^\s(])(?P<filter>-?(?:%s)(?:"[^"]*"?|[^\s()"]+))'
+    r"|(?<![^\s(])(?P<column>(?:%s):)"
+    r"|(?<![^\s(])(?P<minus>-)(?=[^\s)-])"
+    r"|(?P<open>\()"
+    r"|(?P<close>\))"
+    r"|(?P<comma>,)"
+    r'|(?P<phrase>"(?:[^"]|"")*"?\*?)'
+    r'|(?P<word>[^\s()",]+(?:,[^\s()",]+)*)'
+    % (
+        "|".join(
+            re.escape(operator)
+            for operator in sorted(SEARCH_FILTERS, key=len, reverse=True)
+        ),
+        "|".join(sorted(COLUMN_ALIASES, key=len, reverse=True)),
+    )
+)
+PATTERN_FILTER = re.compile(
+    r"(-?)(%s)(.*)"
+    % "|".join(
+        re.escape(operator)
+        for operator in sorted(SEARCH_FILTERS, key=len, reverse=True)
+    ),
+    re.DOTALL,
+)
+# FTS5 barewords, anything else is quoted as a phrase
+PATTERN_BAREWORD = re.compile(r"\w+")
+
+# Syntax tree
+# NOTE: prefix for `foo*`, initial for `^foo` (at the start of a column)
+Term = collections.namedtuple("Term", "text quoted prefix initial")
+Near = collections.namedtuple("Near", "terms distance")
+Column = collections.namedtuple("Column", "name child")
+And = collections.namedtuple("And", "children")
+Or = collections.namedtuple("Or", "children")
+Not = collections.namedtuple("Not", "left right")
+# All notes but those matching child, as FTS5 has no unary NOT, e.g. for `-foo`
+Complement = collections.namedtuple("Complement", "child")
+Filter = collections.namedtuple("Filter", "negated operator value")
+
+CompiledQuery = collections.namedtuple("CompiledQuery", "tree match filters excluded")
+
+
+def tokenize(search_str):
+    """
+    Split a query into tokens, whitespace aside
+    :return: list of (kind, text) with kind in PATTERN_TOKEN groups
+    """
+    return [
+        (match.lastgroup, match.group())
+        for match in PATTERN_TOKEN.finditer(search_str)
+        if match.lastgroup != "space"
+    ]
+
+
+def is_plain_word(match):
+    # Bare word token, i.e. not a phrase, prefix term, keyword nor filter
+    return (
+        match.lastgroup == "word"
+        and match.group() not in KEYWORDS
+        and PATTERN_BAREWORD.fullmatch(match.group()) is not None
+        and not match.group().isdigit()
+    )
+
+
+def plain_words(search_str):
+    """
+    Find the plain words of a query, e.g. to correct misspelled ones
+    :return: list of words, in query order
+    """
+    return [
+        match.group()
+        for match in PATTERN_TOKEN.finditer(search_str)
+        if is_plain_word(match)
+    ]
+
+
+def replace_words(search_str, replacements):
+    """
+    Replace plain words of a query, keeping everything else as is
+    :param replacements: dict of word to its replacement
+    :return: query string
+    """
+    parts, end = list(), 0
+    for match in PATTERN_TOKEN.finditer(search_str):
+        if is_plain_word(match) and match.group() in replacements:
+            parts.append(search_str[end : match.start()])
+            parts.append(replacements[match.group()])
+            end = match.end()
+    parts.append(search_str[end:])
+    return "".join(parts)
+
+
+def parse_filter(text):
+    """
+    :param text: e.g. '-tag:"old stuff"'
+    :return: Filter, with operators losing their trailing colon, e.g. 'tag' or 'mdate>'
+    """
+    negated, operator, value = PATTERN_FILTER.fullmatch(text).groups()
+    return Filter(negated == "-", operator.rstrip(":"), value.strip('"'))
+
+
+def make_term(word):
+    # Bare word, with optional ^ and * marks
+    # NOTE: Words without letters nor digits, e.g. a stray `-`, would match nothing
+    initial = word.startswith("^")
+    prefix = word.endswith("*")
+    text = word.lstrip("^").rstrip("*")
+    if not PATTERN_BAREWORD.search(text):
+        return None
+    return Term(text, False, prefix, initial)
+
+
+def make_phrase(phrase):
+    # Quoted phrase, possibly unterminated, with optional trailing *
+    prefix = phrase.endswith("*") and len(phrase) > 1
+    text = phrase[1:-1] if prefix else phrase[1:]
+    if text.endswith('"') and not text.endswith('""'):
+        text = text[:-1]
+    text = text.replace('""', '"')
+    return Term(text, True, prefix, False) if text.strip() else None
+
+
+def combine(node_type, children):
+    # Flatten nested nodes of the same type, None if nothing left
+    # NOTE: Repeated operands are dropped, e.g. synonyms of synonyms
+    flat = list()
+    for child in children:
+        for operand in child.children if isinstance(child, node_type) else [child]:
+            if operand is not None and operand not in flat:
+                flat.append(operand)
+    if not flat:
+        return None
+    return flat[0] if len(flat) == 1 else node_type(tuple(flat))
+
+
+def split_complements(children):
+    # Operands as (positive ones, what complements leave out)
+    positive = [child for child in children if not isinstance(child, Complement)]
+    negated = [child.child for child in children if isinstance(child, Complement)]
+    return positive, negated
+
+
+def intersect(children):
+    """
+    Combine operands with AND, e.g. `foo -bar` as `foo NOT bar`
+    :return: node, a Complement if only negations are left, or None
+    """
+    positive, negated = split_complements(children)
+    tree, negated = combine(And, positive), combine(Or, negated)
+    if negated is None:
+        return tree
+    if tree is None:
+        return Complement(negated)
+    return Not(tree, negated)
+
+
+def unite(children):
+    """
+    Combine operands with OR, e.g. `foo OR -bar` as all notes but `bar NOT foo`
+    :return: node, a Complement if any operand is one, or None
+    """
+    positive, negated = split_complements(children)
+    tree, negated = combine(Or, positive), combine(And, negated)
+    if negated is None:
+        return tree
+    if tree is None:
+        return Complement(negated)
+    return Complement(Not(negated, tree))
+
+
+class Parser:
+    """
+    Recursive descent parser of queries, by increasing precedence:
+    OR, AND (explicit or implicit), NOT, then groups, columns and terms
+    Never fails, operators missing an operand are dropped
+    """
+
+    def __init__(self, tokens, synonym_table=None):
+        """
+        :param tokens: see `tokenize`
+        :param synonym_table: synonyms.SynonymTable, None for no synonyms
+        """
+        self.tokens = tokens
+        self.position = 0
+        self.synonym_table = synonym_table
+        self.filters = list()
+
+    def peek(self, offset=0):
+        if self.position + offset < len(self.tokens):
+            return self.tokens[self.position + offset]
+        return None, None
+
+    def accept(self, kind, text=None):
+        # Consume next token if it is of this kind (and text)
+        next_kind, next_text = self.peek()
+        if next_kind == kind and (text is None or next_text == text):
+            self.position += 1
+            return True
+        return False
+
+    def is_operand_next(self):
+        kind, text = self.peek()
+        if kind in (None, "close"):
+            return False
+        return not (kind == "word" and text in ("AND", "OR", "NOT"))
+
+    def parse(self):
+        """
+        :return: (tree, a Complement if it only leaves out notes,
+            or None if no text to match, list of Filter)
+        """
+        children = [self.parse_or()]
+        # NOTE: Stray closing parentheses just split the query
+        while self.accept("close"):
+            children.append(self.parse_or())
+        return intersect(children), self.filters
+
+    def parse_or(self):
+        children = [self.parse_and()]
+        while self.accept("word", "OR"):
+            children.append(self.parse_and())
+        return unite(children)
+
+    def parse_and(self):
+        children = list()
+        while True:
+            kind, text = self.peek()
+            if kind in (None, "close") or (kind, text) == ("word", "OR"):
+                break
+            if self.accept("word", "AND"):
+                continue
+            if self.accept("word", "NOT") or self.accept("minus"):
+                right = self.parse_primary()
+                if isinstance(right, Complement):
+                    # Double negation, e.g. `-(-foo)`
+                    children.append(right.child)
+                elif right is not None:
+                    if children and not isinstance(children[-1], Complement):
+                        children[-1] = Not(children[-1], right)
+                    else:
+                        children.append(Complement(right))
+                continue
+            child = self.parse_primary()
+            if child is not None:
+                children.append(child)
+        # NOTE: Leading negations apply to the whole group, e.g. `-a b` as `b NOT a`
+        return intersect(children)
+
+    def parse_primary(self):
+        """
+        Parse a group, column scope, NEAR group, phrase or term
+        :return: node, or None for tokens matching nothing (e.g. filters)
+        """
+        if not self.is_operand_next():
+            return None
+        kind, text = self.peek()
+        self.position += 1
+        if kind == "open":
+            child = self.parse_or()
+            # NOTE: Unclosed groups end with the query
+            self.accept("close")
+            return child
+        if kind == "column":
+            child = self.parse_primary()
+            if isinstance(child, Complement):
+                # Notes without matches in that column, e.g. `t:(-foo)`
+                column = self.parse_column(text, child.child)
+                return Complement(column) if column else None
+            return self.parse_column(text, child)
+        if kind == "filter":
+            self.filters.append(parse_filter(text))
+            return None
+        if kind == "phrase":
+            return make_phrase(text)
+        if kind == "word":
+            if text == "NEAR" and self.accept("open"):
+                return self.parse_near()
+            return self.parse_synonyms(text) or make_term(text)
+        # Stray commas and minus signs
+        return None
+
+    def parse_column(self, text, child):
+        # Innermost column wins, e.g. in `t:b:foo`
+        while isinstance(child, Column):
+            child = child.child
+        return Column(COLUMN_ALIASES[text[:-1]], child) if child else None
+
+    def parse_synonyms(self, text):
+        # Longest synonym starting at this word, as an OR group of its alternatives
+        if self.synonym_table is None:
+            return None
+        words = [text]
+        while len(words) < self.synonym_table.max_num_tokens:
+            kind, next_text = self.peek(len(words) - 1)
+            if kind != "word" or next_text in KEYWORDS:
+                break
+            words.append(next_text)
+        num_words, or_set = self.synonym_table.lookup(words)
+        if not num_words:
+            return None
+        self.position += num_words - 1
+        # NOTE: Alternatives are parsed as queries too, without further synonyms
+        return Parser(tokenize(or_set)).parse()[0]
+
+    def parse_near(self):
+        # Terms up to the closing parenthesis, with optional `, distance`
+        terms, distance = list(), None
+        while True:
+            kind, text = self.peek()
+            if kind in (None, "close"):
+                self.accept("close")
+                break
+            self.position += 1
+            if kind == "comma":
+                if self.peek()[0] == "word" and self.peek()[1].isdigit():
+                    distance = int(self.peek()[1])
+                    self.position += 1
+            elif kind == "phrase":
+                terms.append(make_phrase(text))
+            elif kind == "word":
+                terms.append(make_term(text))
+        terms = tuple(term for term in terms if term is not None)
+        return Near(terms, distance) if terms else None
+
+
+def render(node):
+    """
+    Render a syntax tree as an FTS5 expression
+    Compound operands are parenthesized, so precedence never matters
+    """
+
+    def render_operand(child):
+        if isinstance(child, (And, Or, Not)):
+            return "(%s)" % render(child)
+        return render(child)
+
+    if isinstance(node, Term):
+        text = node.text
+        if node.quoted or text in KEYWORDS or not PATTERN_BAREWORD.fullmatch(text):
+            text = '"%s"' % text.replace('"', '""')
+        return "%s%s%s" % (
+            "^" if node.initial else "",
+            text,
+            "*" if node.prefix else "",
+        )
+    if isinstance(node, Near):
+        terms = " ".join(render(term) for term in node.terms)
+        if node.distance is None:
+            return "NEAR(%s)" % terms
+        return "NEAR(%s, %d)" % (terms, node.distance)
+    if isinstance(node, Column):
+        if isinstance(node.child, (Term, Near)):
+            return "%s:%s" % (node.name, render(node.child))
+        return "%s:(%s)" % (node.name, render(node.child))
+    if isinstance(node, And):
+        return " AND ".join(render_operand(child) for child in node.children)
+    if isinstance(node, Or):
+        return " OR ".join(render_operand(child) for child in node.children)
+    if isinstance(node, Not):
+        return "%s NOT %s" % (render_operand(node.left), render_operand(node.right))
+    raise TypeError("Unknown query node %r" % (node,))
+
+
+# Compiled queries, e.g. for repeated queries while typing into a launcher
+_compiled_queries = LRUCache(maxsize=1024)
+
+
+def compile_query(search_str, synonym_table=None):
+    """
+    Compile a user query, cached by query string
+    :param search_str: query with aliases (t:, b:), synonyms and filters
+    :param synonym_table: synonyms.SynonymTable, None for no synonyms
+    :return: CompiledQuery, with
+        the syntax tree and its FTS5 expression, both None if no text to match,
+        the tuple of Filter, e.g. (negated, 'tag', 'python'),
+        and the FTS5 expression of notes to leave out when the query matches
+        all notes but those, e.g. `foo` for `-foo tag:python`
+        or `bar NOT foo` for `foo OR -bar`, else None
+    """
+    # Normalize whitespace so that equivalent queries share cache entries
+    search_str = " ".join(search_str.split())
+    # NOTE: The table object changes whenever synonym files do
+    key = (search_str, synonym_table)
+    compiled_query = _compiled_queries.get(key)
+    if compiled_query is None:
+        parser = Parser(tokenize(search_str), synonym_table)
+        tree, filters = parser.parse()
+        excluded = None
+        if isinstance(tree, Complement):
+            tree, excluded = None, tree.child
+        compiled_query = CompiledQuery(
+            tree,
+            render(tree) if tree is not None else None,
+            tuple(filters),
+            render(excluded) if excluded is not None else None,
+        )
+        _compiled_queries.put(key, compiled_query)
+    return compiled_query
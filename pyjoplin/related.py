@@ -0,0 +1,295 @@
+# coding=utf-8
+"""
+Related notes by TF-IDF cosine similarity of their title and body
+
+Term counts of all notes are kept as a sparse matrix (one row per note)
+in a .npz snapshot under config.PATH_CONFIG, and refreshed incrementally:
+only notes added, changed or deleted since the snapshot are re-tokenized
+and re-weighted, with the IDF of the last full computation (see MAX_STALE_FRACTION).
+Similarities are a single sparse matrix-vector product.
+
+NOTE: Needs numpy and scipy (`pip install pyjoplin[related]`),
+imported lazily so that other commands do not pay for them.
+"""
+
+import collections
+import os
+import re
+import threading
+
+from pyjoplin.configuration import config
+from pyjoplin.utils import save_snapshot
+
+PATH_RELATED_CACHE = os.path.join(config.PATH_CONFIG, "related.npz")
+
+# Tokens as words of 2+ characters, lowercased
+PATTERN_TOKEN = re.compile(r"\w\w+")
+
+# Notes changed since IDF was last computed, as a fraction of all notes,
+# before computing it and all vectors again
+# NOTE: Until then changed notes are weighted with the previous IDF,
+# which drifts from the current one as notes change
+MAX_STALE_FRACTION = 0.05
+MIN_STALE_NOTES = 50
+
+
+def import_numeric():
+    try:
+        import numpy
+        import scipy.sparse
+    except ImportError:
+        raise ImportError(
+            "Related notes need numpy and scipy\nSol: pip install numpy scipy"
+        )
+    return numpy, scipy.sparse
+
+
+def count_terms(title, body):
+    # NOTE: Title terms count twice, as titles summarize notes
+    tokens = PATTERN_TOKEN.findall(("%s %s %s" % (title, title, body)).lower())
+    return collections.Counter(token for token in tokens if not token.isdigit())
+
+
+class RelatedIndex:
+    """
+    Sparse term counts of all notes, plus their TF-IDF vectors for similarity
+    """
+
+    def __init__(self, counts, terms, rowids, uids, updated_times):
+        """
+        :param counts: scipy.sparse CSR matrix of term counts, notes x terms
+        :param terms: list of terms, i.e. matrix columns
+        :param rowids: rowids of notes, i.e. matrix rows
+        :param uids: uids of notes
+        :param updated_times: updated_time of notes when counted
+        """
+        self.counts = counts
+        self.terms = list(terms)
+        self.term_columns = {term: column for column, term in enumerate(self.terms)}
+        self.rowids = list(rowids)
+        self.uids = list(uids)
+        self.updated_times = list(updated_times)
+        self.compute_vectors()
+
+    @classmethod
+    def from_notes(cls, notes):
+        """
+        :param notes: iterable of (rowid, uid, title, body, updated_time)
+        """
+        index = cls.empty()
+        index.update(notes)
+        return index
+
+    @classmethod
+    def empty(cls):
+        _, sparse = import_numeric()
+        return cls(sparse.csr_matrix((0, 0)), [], [], [], [])
+
+    @staticmethod
+    def compute_idf(counts, num_notes):
+        numpy, _ = import_numeric()
+        document_frequency = numpy.bincount(counts.indices, minlength=counts.shape[1])
+        idf = numpy.log((1.0 + num_notes) / (1.0 + document_frequency)) + 1.0
+        return idf.astype(numpy.float32)
+
+    def weigh(self, counts):
+        # TF-IDF with sublinear term frequency, rows normalized to unit length
+        # so that dot products are cosine similarities
+        numpy, sparse = import_numeric()
+        vectors = counts.astype(numpy.float32)
+        vectors.data = 1.0 + numpy.log(vectors.data)
+        vectors = vectors @ sparse.diags(self.idf)
+        norms = numpy.sqrt(vectors.multiply(vectors).sum(axis=1)).A1
+        norms[norms == 0] = 1.0
+        return (sparse.diags(1.0 / norms) @ vectors).tocsr()
+
+    def compute_vectors(self):
+        self.idf = self.compute_idf(self.counts, self.counts.shape[0])
+        self.vectors = self.weigh(self.counts)
+        self.row_of_uid = {uid: row for row, uid in enumerate(self.uids)}
+        self.num_stale = 0
+
+    def update(self, notes, deleted_rowids=()):
+        """
+        Replace rows of changed notes, append new ones and drop deleted ones
+        Only these rows are weighted again, unless too many notes changed
+        since IDF was computed (see MAX_STALE_FRACTION)
+        :param notes: iterable of (rowid, uid, title, body, updated_time) to (re)count
+        :param deleted_rowids: rowids of notes to drop
+        :return:
+        """
+        numpy, sparse = import_numeric()
+        notes = list(notes)
+        dropped_rowids = set(deleted_rowids) | {note[0] for note in notes}
+        kept_rows = [
+            row for row, rowid in enumerate(self.rowids) if rowid not in dropped_rowids
+        ]
+
+        # Count terms of new rows, growing the vocabulary as needed
+        data, columns, indptr = list(), list(), [0]
+        for _, _, title, body, _ in notes:
+            for term, count in count_terms(title, body).items():
+                if term not in self.term_columns:
+                    self.term_columns[term] = len(self.terms)
+                    self.terms.append(term)
+                columns.append(self.term_columns[term])
+                data.append(count)
+            indptr.append(len(data))
+        num_terms = len(self.terms)
+        new_counts = sparse.csr_matrix(
+            (numpy.array(data, dtype=numpy.int32), columns, indptr),
+            shape=(len(notes), num_terms),
+        )
+        kept_counts = self.counts[kept_rows]
+        kept_counts.resize((len(kept_rows), num_terms))
+        self.counts = sparse.vstack([kept_counts, new_counts], format="csr")
+
+        self.rowids = [self.rowids[row] for row in kept_rows] + [n[0] for n in notes]
+        self.uids = [self.uids[row] for row in kept_rows] + [n[1] for n in notes]
+        self.updated_times = [self.updated_times[row] for row in kept_rows] + [
+            n[4] for n in notes
+        ]
+
+        num_stale = self.num_stale + len(dropped_rowids)
+        if num_stale > max(MIN_STALE_NOTES, MAX_STALE_FRACTION * len(self.rowids)):
+            self.compute_vectors()
+            return
+        # Terms new to the index only weigh in the new rows so far
+        new_idf = self.compute_idf(new_counts[:, len(self.idf) :], len(self.rowids))
+        self.idf = numpy.concatenate([self.idf, new_idf])
+        kept_vectors = self.vectors[kept_rows]
+        kept_vectors.resize((len(kept_rows), num_terms))
+        self.vectors = sparse.vstack(
+            [kept_vectors, self.weigh(new_counts)], format="csr"
+        )
+        self.row_of_uid = {uid: row for row, uid in enumerate(self.uids)}
+        self.num_stale = num_stale
+
+    def related(self, uid, limit=10):
+        """
+        Find notes most similar to a given one
+        :param uid: note id
+        :param limit: max number of notes
+        :return: list of (similarity, uid), most similar first
+        """
+        numpy, _ = import_numeric()
+        row = self.row_of_uid[uid]
+        similarities = (self.vectors @ self.vectors[row].T).toarray().ravel()
+        similarities[row] = -1.0  # not related to itself
+        limit = min(limit, len(similarities) - 1)
+        if limit <= 0:
+            return list()
+        # Top matches without sorting all notes
+        best_rows = numpy.argpartition(-similarities, limit - 1)[:limit]
+        best_rows = best_rows[numpy.argsort(-similarities[best_rows])]
+        return [
+            (float(similarities[row]), self.uids[row])
+            for row in best_rows
+            if similarities[row] > 0
+        ]
+
+    def save(self, path):
+        numpy, _ = import_numeric()
+        arrays = dict(
+            data=self.counts.data,
+            indices=self.counts.indices,
+            indptr=self.counts.indptr,
+            shape=numpy.array(self.counts.shape),
+            terms=numpy.array(self.terms, dtype=str),
+            rowids=numpy.array(self.rowids, dtype=numpy.int64),
+            uids=numpy.array(self.uids, dtype=str),
+            updated_times=numpy.array(self.updated_times, dtype=numpy.int64),
+        )
+        save_snapshot(path, arrays, dump=lambda arrays, f: numpy.savez(f, **arrays))
+
+    @classmethod
+    def load(cls, path):
+        numpy, sparse = import_numeric()
+        with numpy.load(path) as arrays:
+            counts = sparse.csr_matrix(
+                (arrays["data"], arrays["indices"], arrays["indptr"]),
+                shape=tuple(arrays["shape"]),
+            )
+            return cls(
+                counts,
+                arrays["terms"].tolist(),
+                arrays["rowids"].tolist(),
+                arrays["uids"].tolist(),
+                arrays["updated_times"].tolist(),
+            )
+
+    def refresh(self):
+        """
+        Re-count notes added or changed since last refresh, drop deleted ones
+        :return: True if anything changed
+        """
+        changed_notes, deleted_rowids = read_changed_notes(
+            self.rowids, self.updated_times
+        )
+        if not changed_notes and not deleted_rowids:
+            return False
+        self.update(changed_notes, deleted_rowids)
+        return True
+
+
+def read_changed_notes(rowids, updated_times):
+    """
+    Find notes added, changed or deleted since some snapshot of the notes table
+    :param rowids: rowids of notes in the snapshot
+    :param updated_times: their updated_time in the snapshot
+    :return: (list of (rowid, uid, title, body, updated_time) to (re)read, deleted rowids)
+    """
+    from peewee import SQL, chunked
+
+    from pyjoplin.models import Note
+
+    current_times = dict(Note.select(SQL("rowid"), Note.updated_time).tuples())
+    indexed_times = dict(zip(rowids, updated_times))
+    changed_rowids = [
+        rowid
+        for rowid, updated_time in current_times.items()
+        if indexed_times.get(rowid) != updated_time
+    ]
+    deleted_rowids = [rowid for rowid in indexed_times if rowid not in current_times]
+    changed_notes = list()
+    for batch in chunked(changed_rowids, 500):
+        changed_notes.extend(
+            Note.select(SQL("rowid"), Note.id, Note.title, Note.body, Note.updated_time)
+            .where(SQL("rowid").in_(batch))
+            .tuples()
+        )
+    return changed_notes, deleted_rowids
+
+
+# In-process cache, e.g. for the lifetime of a search daemon
+_cached_signature = None
+_cached_index = None
+_lock = threading.Lock()
+
+
+def get_related_index():
+    """
+    Get term counts of all notes, cached in-process and on disk
+    and refreshed with changes in the notes table
+    :return: RelatedIndex
+    """
+    global _cached_signature, _cached_index
+
+    from pyjoplin.models import Note
+
+    # NOTE: Saves by pyjoplin and changes synced in by Joplin alike
+    signature = Note.changes_signature()
+    if _cached_index is not None and signature == _cached_signature:
+        return _cached_index
+    with _lock:
+        if _cached_index is None:
+            try:
+                _cached_index = RelatedIndex.load(PATH_RELATED_CACHE)
+            except (OSError, KeyError, ValueError):
+                # Missing or unreadable snapshot, count all notes
+                _cached_index = RelatedIndex.empty()
+        if _cached_index.refresh():
+            _cached_index.save(PATH_RELATED_CACHE)
+        _cached_signature = signature
+        return _cached_index
+
@@ -0,0 +1,375 @@
+# coding=utf-8
+"""
+Search daemon answering CLI commands over a local Unix socket
+
+Keeps the database connections, compiled synonyms and other caches warm,
+so that per-keystroke queries from a launcher cost query time only.
+A new query from a client cancels the one it still has in flight,
+as a launcher discards results of earlier keystrokes anyway.
+See pyjoplin.client for the other end.
+"""
+
+import asyncio
+import contextlib
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from peewee import OperationalError
+
+from pyjoplin.configuration import config
+from pyjoplin.models import database as db
+
+
+class Cancelled(Exception):
+    pass
+
+
+class Request:
+    # Unit of work for SearchService, cancellable from any thread
+    def __init__(self):
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+# Request run by each worker thread
+_worker = threading.local()
+
+
+def is_cancelled():
+    """
+    Check if the request running in this thread was superseded
+    NOTE: Also installed as SQLite progress handler, where non-zero interrupts
+    :return:
+    """
+    request = getattr(_worker, "request", None)
+    return int(request is not None and request.cancelled)
+
+
+class SearchService:
+    """
+    Run searches (or any database call) on a pool of worker threads,
+    where a new request from a client cancels its previous one
+
+    Cancellation is checked by a SQLite progress handler on each worker
+    connection, so a stale query is aborted within a few thousand
+    virtual machine instructions and its worker is free right away.
+    Stale requests still queued are skipped without touching the database.
+
+    Usage, from a running event loop:
+        service = SearchService()
+        found_index_notes = await service.search("launcher", "foo*")
+    """
+
+    # Virtual machine instructions between checks for cancellation
+    PROGRESS_STEPS = 1000
+
+    def __init__(self, jobs=2):
+        # NOTE: peewee keeps one connection per thread, so one per worker
+        self.executor = ThreadPoolExecutor(max_workers=jobs)
+        # In-flight request of each client
+        self.requests = dict()
+
+    def _run_in_worker(self, request, func, args, kwargs):
+        if request.cancelled:
+            # Superseded while queued
+            raise Cancelled()
+        if not getattr(_worker, "has_progress_handler", False):
+            db.connection().set_progress_handler(is_cancelled, self.PROGRESS_STEPS)
+            _worker.has_progress_handler = True
+        _worker.request = request
+        try:
+            result = func(*args, **kwargs)
+        except OperationalError:
+            if request.cancelled:
+                # e.g. 'interrupted' raised by the progress handler
+                raise Cancelled()
+            raise
+        finally:
+            _worker.request = None
+        if request.cancelled:
+            # Results of a superseded request are of no use anymore
+            raise Cancelled()
+        return result
+
+    async def run(self, client_id, func, *args, **kwargs):
+        """
+        Run func in a worker thread, cancelling the previous request of this client
+        :param client_id: any hashable, e.g. a launcher session name
+        :return: result of func
+        :raise Cancelled: if a newer request of the same client superseded this one
+        """
+        previous_request = self.requests.get(client_id)
+        if previous_request is not None:
+            previous_request.cancel()
+        request = Request()
+        self.requests[client_id] = request
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, self._run_in_worker, request, func, args, kwargs
+            )
+        finally:
+            if self.requests.get(client_id) is request:
+                del self.requests[client_id]
+
+    def cancel(self, client_id):
+        request = self.requests.get(client_id)
+        if request is not None:
+            request.cancel()
+
+    async def search(self, client_id, search_str, **kwargs):
+        """
+        Search notes, see `commands.search` for options
+        :return: list of dicts with the requested fields
+        """
+        from pyjoplin import commands
+
+        return await self.run(client_id, commands.search, search_str, **kwargs)
+
+    def close(self):
+        for request in self.requests.values():
+            request.cancel()
+        self.executor.shutdown(wait=True)
+
+
+class ThreadLocalStream:
+    """
+    Stand-in for sys.stdout/sys.stderr writing to a per-thread target
+    so that concurrent CLI commands do not mix their outputs
+    """
+
+    def __init__(self, default):
+        self.default = default
+        self.local = threading.local()
+
+    @property
+    def target(self):
+        return getattr(self.local, "target", None) or self.default
+
+    def write(self, text):
+        return self.target.write(text)
+
+    def flush(self):
+        self.target.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.target, name)
+
+
+@contextlib.contextmanager
+def redirect_thread_output(stdout, stderr):
+    # NOTE: Unlike contextlib.redirect_stdout, only affects the current thread
+    for name in ("stdout", "stderr"):
+        if not isinstance(getattr(sys, name), ThreadLocalStream):
+            setattr(sys, name, ThreadLocalStream(getattr(sys, name)))
+    sys.stdout.local.target = stdout
+    sys.stderr.local.target = stderr
+    try:
+        yield
+    finally:
+        sys.stdout.local.target = None
+        sys.stderr.local.target = None
+
+
+class SocketWriter:
+    """
+    File-like object relaying writes to the client as JSON messages
+    :param send: thread-safe callable sending a message dict to the client
+    """
+
+    def __init__(self, send, key, buffer_size=4096):
+        self.send = send
+        self.key = key
+        self.buffer_size = buffer_size
+        self.chunks = list()
+        self.size = 0
+
+    def write(self, text):
+        self.chunks.append(text)
+        self.size += len(text)
+        if self.size >= self.buffer_size:
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        if self.chunks:
+            self.send({self.key: "".join(self.chunks)})
+            self.chunks = list()
+            self.size = 0
+
+
+def encode_message(message):
+    return (json.dumps(message) + "\n").encode("utf-8")
+
+
+def run_cli(argv, stdout, stderr):
+    """
+    Run CLI arguments in this process as `pyjoplin <argv>` would
+    :return: returncode
+    """
+    from pyjoplin.main import parser
+
+    with redirect_thread_output(stdout, stderr):
+        try:
+            kwargs = vars(parser.parse_args(argv))
+            func = kwargs.pop("func")
+            returncode = func(**kwargs)
+        except SystemExit as e:
+            # e.g. argparse errors
+            returncode = e.code
+        except Exception:
+            if is_cancelled():
+                # Interrupted on purpose, see SearchService
+                raise Cancelled()
+            traceback.print_exc()
+            returncode = 1
+    return returncode or 0
+
+
+class SearchServer:
+    """
+    Serve CLI commands to pyjoplin.client over a Unix socket
+
+    Each request is a JSON line {"argv": [...], "client": <id or null>}
+    answered with JSON lines of {"stdout": ...}, {"stderr": ...}
+    and finally {"returncode": ...}.
+    Requests of the same client id cancel each other, newest wins.
+    Closing the connection cancels its request too.
+    """
+
+    def __init__(self, path_socket, served_commands, jobs=2):
+        self.path_socket = path_socket
+        self.served_commands = served_commands
+        self.service = SearchService(jobs=jobs)
+
+    async def handle(self, reader, writer):
+        loop = asyncio.get_running_loop()
+
+        def send(message):
+            # NOTE: Called from worker threads, the stream belongs to the event loop
+            loop.call_soon_threadsafe(writer.write, encode_message(message))
+
+        try:
+            message = json.loads(await reader.readline())
+            argv = message["argv"]
+            # Without client id, requests cancel nothing but themselves
+            client_id = message.get("client") or id(writer)
+            stdout = SocketWriter(send, "stdout")
+            stderr = SocketWriter(send, "stderr")
+            if argv and argv[0] in self.served_commands:
+                returncode = await self.run_until_disconnect(
+                    reader, client_id, argv, stdout, stderr
+                )
+            else:
+                stderr.write("Command not served by daemon: %s\n" % argv[:1])
+                returncode = 2
+            stdout.flush()
+            stderr.flush()
+            send({"returncode": returncode})
+            # Let the messages scheduled from workers go out first
+            await asyncio.sleep(0)
+            await writer.drain()
+        except (ConnectionError, ValueError):
+            # Client went away or sent garbage
+            pass
+        finally:
+            writer.close()
+
+    async def run_until_disconnect(self, reader, client_id, argv, stdout, stderr):
+        # Run command, cancelling it if the client closes the connection meanwhile
+        # e.g. a launcher killing the process of a superseded keystroke
+        command = asyncio.ensure_future(
+            self.service.run(client_id, run_cli, argv, stdout, stderr)
+        )
+        disconnect = asyncio.ensure_future(reader.read())
+        await asyncio.wait({command, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+        if not command.done():
+            self.service.cancel(client_id)
+        disconnect.cancel()
+        try:
+            return await command
+        except Cancelled:
+            stderr.write("Cancelled by a newer request\n")
+            return 130
+
+    async def serve_forever(self):
+        # NOTE: Socket created private to the user, rather than restricted
+        # after bind, when other users could already connect
+        umask = os.umask(0o177)
+        try:
+            server = await asyncio.start_unix_server(self.handle, path=self.path_socket)
+        finally:
+            os.umask(umask)
+        # Stop gracefully on `kill`, e.g. to remove the socket file
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGTERM, asyncio.current_task().cancel
+        )
+        try:
+            await server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    def close(self):
+        self.service.close()
+
+
+def remove_stale_socket(path_socket):
+    if not os.path.exists(path_socket):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path_socket)
+    except OSError:
+        # Nobody listening, left behind by a dead daemon
+        os.remove(path_socket)
+    else:
+        raise RuntimeError("pyjoplin serve is already running at %s" % path_socket)
+    finally:
+        probe.close()
+
+
+def serve(jobs=2):
+    """
+    Run daemon answering search, get and other read-only commands
+    (see client.SERVED_COMMANDS) over a local Unix socket,
+    with database and caches kept warm
+    Those CLI commands use it transparently while it runs
+    NOTE: Tables built on first use (links, headings) are built before serving,
+    so that served commands never write to the database
+    """
+    from pyjoplin import commands, titles, vocabulary
+    from pyjoplin.client import SERVED_COMMANDS
+
+    path_socket = config.PATH_SOCKET
+    remove_stale_socket(path_socket)
+
+    # Warm up caches before accepting queries
+    # NOTE: Lazy table builds would hold the write lock from a worker,
+    # and could be cancelled halfway by a newer request
+    commands.get_link_index()
+    commands.get_heading_index()
+    commands.replace_synonyms("")
+    titles.get_title_index()
+    vocabulary.get_vocabulary_index()
+
+    server = SearchServer(path_socket, SERVED_COMMANDS, jobs=jobs)
+    print("pyjoplin serve listening at %s" % path_socket)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("Search cache: %s" % commands.search_cache.info())
+        server.close()
+        if os.path.exists(path_socket):
+            os.remove(path_socket)
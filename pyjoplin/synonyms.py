@@ -0,0 +1,127 @@
+# coding=utf-8
+"""
+Synonyms expansion for search queries
+
+Synonym files list one set of synonyms per line, e.g.
+'python' 'py'
+The packaged synonyms.txt is extended (or overridden) by user files
+synonyms*.txt under config.PATH_CONFIG.
+"""
+
+import glob
+import os
+import re
+
+from pyjoplin.configuration import config
+from pyjoplin.utils import load_snapshot
+
+PATH_SYNONYMS = os.path.join(os.path.dirname(__file__), "synonyms.txt")
+PATTERN_USER_SYNONYMS = os.path.join(config.PATH_CONFIG, "synonyms*.txt")
+PATH_SYNONYMS_CACHE = os.path.join(config.PATH_CONFIG, "synonyms.cache")
+
+
+class SynonymTable:
+    """
+    Synonyms compiled into a lookup from token sequences to their OR-set
+    Expansion is linear in the query length, whatever the number of synonyms
+    """
+
+    def __init__(self, sets_of_synonyms):
+        # Map each synonym (as a tuple of whitespace tokens) to its OR-set
+        # NOTE: As in a dictionary, later sets override earlier ones
+        self.dict_of_synonyms = {
+            tuple(the_word.split()): r"(%s)" % (r" OR ".join(the_set))
+            for the_set in sets_of_synonyms
+            for the_word in the_set
+        }
+        # Longest synonym in tokens, e.g. 3 for 'Visual Studio Code'
+        self.max_num_tokens = max(map(len, self.dict_of_synonyms), default=0)
+
+    @classmethod
+    def from_files(cls, paths):
+        sets_of_synonyms = list()
+        for path in paths:
+            with open(path, "r") as f:
+                sets_of_synonyms.extend(
+                    the_line.strip()[1:-1].split(r"' '")
+                    for the_line in f
+                    if the_line.strip()
+                )
+        # NOTE: These are not sets but lists, but anyway keeping some name
+        return cls(sets_of_synonyms)
+
+    def lookup(self, tokens):
+        """
+        Find the synonym at the start of a sequence of tokens
+        Greedy longest match, e.g. 'Marvin vim' before 'Marvin'
+        :param tokens: list of whitespace tokens
+        :return: (number of tokens matched, OR-set) or (0, None) if no synonym
+        """
+        for num_tokens in range(min(self.max_num_tokens, len(tokens)), 0, -1):
+            or_set = self.dict_of_synonyms.get(tuple(tokens[:num_tokens]))
+            if or_set is not None:
+                return num_tokens, or_set
+        return 0, None
+
+    def expand(self, search_str):
+        """
+        Replace any registered synonym into OR-set for SQLite query
+        e.g. py turns into (python OR py)
+        :param search_str:
+        :return:
+        """
+        # Alternate tokens and the whitespace between them, to keep the latter as is
+        parts = re.split(r"(\s+)", search_str)
+        tokens = parts[::2]
+        output = list()
+        idx = 0
+        while idx < len(tokens):
+            num_tokens, or_set = self.lookup(tokens[idx:])
+            if num_tokens:
+                output.append(or_set)
+            else:
+                num_tokens = 1
+                output.append(tokens[idx])
+            idx += num_tokens
+            if idx < len(tokens):
+                output.append(parts[2 * idx - 1])
+        return "".join(output)
+
+
+def list_synonym_files():
+    return [PATH_SYNONYMS] + sorted(glob.glob(PATTERN_USER_SYNONYMS))
+
+
+def files_signature(paths):
+    # Changes whenever any synonym file is added, removed or modified
+    return tuple((path, os.stat(path).st_mtime_ns) for path in paths)
+
+
+# In-process cache, e.g. for the lifetime of a search daemon
+_cached_signature = None
+_cached_table = None
+
+
+def get_synonym_table():
+    """
+    Get compiled synonym table, cached in-process and on disk
+    Cache is invalidated by the modification time of the synonym files
+    :return: SynonymTable
+    """
+    global _cached_signature, _cached_table
+
+    paths = list_synonym_files()
+    signature = files_signature(paths)
+    if signature == _cached_signature:
+        return _cached_table
+
+    table = load_snapshot(
+        PATH_SYNONYMS_CACHE, signature, lambda: SynonymTable.from_files(paths)
+    )
+    _cached_signature = signature
+    _cached_table = table
+    return table
+
+
+def replace_synonyms(search_str):
+    return get_synonym_table().expand(search_str)
@@ -0,0 +1,126 @@
+# coding=utf-8
+"""
+In-memory map from tags to the rowids of their notes
+
+Tag filters in search (e.g. `tag:python -tag:archive`) resolve to sorted
+arrays of note rowids, which restrict the FTS query inside SQLite,
+rather than joining note_tags and tags for every match.
+The map is cached in-process and in a snapshot file under config.PATH_CONFIG,
+and rebuilt whenever note_tags or tags change.
+"""
+
+import array
+import collections
+import fnmatch
+import os
+import threading
+
+from pyjoplin.configuration import config
+from pyjoplin.utils import load_snapshot
+
+PATH_TAGS_CACHE = os.path.join(config.PATH_CONFIG, "tags.cache")
+
+
+class TagMap:
+    """
+    Rowids of tagged notes per tag, with tags matched case-insensitively
+    """
+
+    def __init__(self, rows):
+        """
+        :param rows: iterable of (tag title, note rowid)
+        """
+        rowids_by_key = collections.defaultdict(set)
+        self.titles = dict()
+        for title, rowid in rows:
+            key = title.lower()
+            self.titles.setdefault(key, title)
+            rowids_by_key[key].add(rowid)
+        # NOTE: Compact arrays of 8-byte integers rather than sets of Python ints
+        self.rowids_by_key = {
+            key: array.array("q", sorted(rowids))
+            for key, rowids in rowids_by_key.items()
+        }
+
+    def __len__(self):
+        return len(self.rowids_by_key)
+
+    def rowids(self, pattern):
+        """
+        Find notes with a tag
+        :param pattern: tag name, case-insensitive, with optional * wildcards
+        :return: set of note rowids, with any matching tag
+        """
+        key = pattern.lower()
+        if "*" not in key:
+            return set(self.rowids_by_key.get(key, ()))
+        rowids = set()
+        for matching_key in fnmatch.filter(self.rowids_by_key, key):
+            rowids.update(self.rowids_by_key[matching_key])
+        return rowids
+
+    def counts(self):
+        """
+        :return: list of (tag title, number of notes), most used first
+        """
+        return sorted(
+            (
+                (self.titles[key], len(rowids))
+                for key, rowids in self.rowids_by_key.items()
+            ),
+            key=lambda count: (-count[1], count[0].lower()),
+        )
+
+
+def tags_signature():
+    """
+    Cheap summary of the tag tables that changes whenever tags may have
+    e.g. on tagged or untagged notes (count, max updated_time) or renamed tags
+    """
+    from pyjoplin.models import database
+
+    return tuple(
+        database.execute_sql(
+            "SELECT (SELECT count(*) FROM note_tags),"
+            " (SELECT max(updated_time) FROM note_tags),"
+            " (SELECT count(*) FROM tags),"
+            " (SELECT max(updated_time) FROM tags)"
+        ).fetchone()
+    )
+
+
+def read_tags():
+    from pyjoplin.models import database
+
+    return database.execute_sql(
+        "SELECT tags.title, notes.rowid FROM note_tags"
+        " JOIN tags ON tags.id = note_tags.tag_id"
+        " JOIN notes ON notes.id = note_tags.note_id"
+    ).fetchall()
+
+
+# In-process cache, e.g. for the lifetime of a search daemon
+_cached_signature = None
+_cached_map = None
+_lock = threading.Lock()
+
+
+def get_tag_map():
+    """
+    Get rowids of notes per tag, cached in-process and on disk
+    Cache is invalidated by any change in the note_tags or tags tables
+    :return: (signature, TagMap)
+    """
+    global _cached_signature, _cached_map
+
+    signature = tags_signature()
+    if signature == _cached_signature:
+        return _cached_signature, _cached_map
+    with _lock:
+        if signature != _cached_signature:
+            _cached_map = load_snapshot(
+                PATH_TAGS_CACHE, signature, lambda: TagMap(read_tags())
+            )
+            _cached_signature = signature
+        return _cached_signature, _cached_map
+
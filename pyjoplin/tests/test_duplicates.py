@@ -0,0 +1,57 @@
+# coding=utf-8
+import importlib.util
+import unittest
+
+from pyjoplin import duplicates
+from pyjoplin.duplicates import MinHashIndex
+
+HAS_NUMPY = importlib.util.find_spec("numpy") is not None
+
+BODY = (
+    "To profile a python script run cProfile from the command line"
+    " and sort the stats by cumulative time to find the slowest calls"
+)
+
+
+@unittest.skipUnless(HAS_NUMPY, "numpy not installed")
+class TestMinHashIndex(unittest.TestCase):
+    def setUp(self):
+        self.minhash_index = MinHashIndex.empty()
+        self.minhash_index.update(
+            [
+                (1, "uid1", "Profiling python", BODY, 1),
+                (2, "uid2", "Profiling python (copy)", BODY + " or snakeviz", 1),
+                (3, "uid3", "Vim plugins", "plugin managers for vim like vim-plug", 1),
+                (4, "uid4", "", "", 1),
+            ]
+        )
+
+    def test_near_duplicates_clustered(self):
+        clusters = self.minhash_index.clusters(threshold=0.5)
+        self.assertEqual(len(clusters), 1)
+        self.assertEqual(sorted(uid for _, uid in clusters[0]), ["uid1", "uid2"])
+        self.assertGreater(clusters[0][0][0], 0.7)
+
+    def test_update_replaces_signatures(self):
+        self.minhash_index.update([(2, "uid2", "Snakeviz", "browser viewer", 2)])
+        self.assertEqual(self.minhash_index.clusters(threshold=0.5), [])
+        # Notes without words are remembered, but never clustered
+        self.assertEqual(self.minhash_index.unsigned_times, {4: 1})
+
+    def test_signature_of_long_note_in_chunks(self):
+        body = " ".join("word%d" % n for n in range(3 * duplicates.SHINGLE_CHUNK_SIZE))
+        signature = self.minhash_index.signature("Long note", body)
+        # Same as permuting all shingles at once
+        chunk_size = duplicates.SHINGLE_CHUNK_SIZE
+        duplicates.SHINGLE_CHUNK_SIZE = 10**6
+        try:
+            self.assertEqual(
+                signature.tolist(),
+                self.minhash_index.signature("Long note", body).tolist(),
+            )
+        finally:
+            duplicates.SHINGLE_CHUNK_SIZE = chunk_size
+
+
+if __name__ == "__main__":
+    unittest.main()
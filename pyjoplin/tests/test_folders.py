@@ -0,0 +1,72 @@
+# coding=utf-8
+import unittest
+import uuid
+
+from pyjoplin.folders import FolderTree, get_folder_tree
+from pyjoplin.models import Folder
+from pyjoplin.tests.test_search import FilterTestCase, generate_random_word
+from pyjoplin.utils import time_joplin
+
+
+class TestFolderTree(unittest.TestCase):
+    def setUp(self):
+        self.folder_tree = FolderTree(
+            [
+                ("id1", "Work", ""),
+                ("id2", "projects", "id1"),
+                ("id3", "pyjoplin", "id2"),
+                ("id4", "personal", ""),
+                # Corrupt data must not hang the closure
+                ("id5", "loop", "id6"),
+                ("id6", "pool", "id5"),
+            ]
+        )
+
+    def test_titles(self):
+        self.assertEqual(self.folder_tree.title("id2"), "projects")
+        self.assertIsNone(self.folder_tree.title("missing"))
+        self.assertEqual(self.folder_tree.find("Work"), "id1")
+        self.assertIsNone(self.folder_tree.find("work"))
+
+    def test_match_subtree(self):
+        self.assertEqual(self.folder_tree.match("work"), {"id1", "id2", "id3"})
+        self.assertEqual(self.folder_tree.match("work", recursive=False), {"id1"})
+        self.assertEqual(
+            self.folder_tree.match("p*", recursive=False), {"id2", "id3", "id4", "id6"}
+        )
+        self.assertEqual(self.folder_tree.match("loop"), {"id5", "id6"})
+
+
+class TestNotebookFilters(FilterTestCase):
+    def test_search_restricted_to_notebooks(self):
+        now = time_joplin()
+        parent = Folder.create(
+            id=uuid.uuid4().hex,
+            title="pyjoplin-test-%s" % generate_random_word(10),
+            parent="",
+            created_time=now,
+            updated_time=now,
+        )
+        self.addCleanup(parent.delete_instance)
+        child = Folder.create(
+            id=uuid.uuid4().hex,
+            title="pyjoplin-test-%s" % generate_random_word(10),
+            parent=parent.id,
+            created_time=now,
+            updated_time=now + 1,
+        )
+        self.addCleanup(child.delete_instance)
+        # Folders created within the cache max age
+        get_folder_tree(max_age=0)
+        word, note_ids = self.create_notes([parent.title, child.title])
+        self.assert_search_uids(
+            [
+                ("%s nb:%s" % (word, parent.title), note_ids),
+                ("%s nb=:%s" % (word, parent.title), note_ids[:1]),
+                ("%s -nb:%s" % (word, child.title), note_ids[:1]),
+            ]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,186 @@
+# coding=utf-8
+import unittest
+
+from pyjoplin import commands
+from pyjoplin.models import (
+    IndexMeta,
+    ItemChanges,
+    Note,
+    NoteIndex,
+    NoteIndexShadow,
+    NotePassageIndex,
+    SQL,
+    database as db,
+)
+from pyjoplin.tests.test_search import generate_random_word
+from pyjoplin.utils import time_joplin
+
+
+class TestSyncFtsIndex(unittest.TestCase):
+    def setUp(self):
+        # List of testnote ids that need to be cleaned up at the end of test
+        self.testnote_ids = list()
+
+    def test_sync_picks_external_edit(self):
+        test_query = generate_random_word(30)
+        note_id = commands.new("pyjoplin-test test_sync_picks_external_edit", "test")
+        self.testnote_ids.append(note_id)
+        commands.sync_fts_index()
+
+        # Change the note bypassing Note.save(), as another Joplin client would
+        Note.update(body=test_query, updated_time=time_joplin() + 1).where(
+            Note.id == note_id
+        ).execute()
+        if not NoteIndex.is_trigger_maintained():
+            self.assertEqual(len(commands.search(test_query)), 0)
+
+        commands.sync_fts_index()
+        found_index_notes = commands.search(test_query)
+        self.assertEqual(len(found_index_notes), 1)
+
+    def test_sync_removes_external_deletion(self):
+        test_query = generate_random_word(30)
+        note_id = commands.new(
+            "pyjoplin-test test_sync_removes_external_deletion", "test", body=test_query
+        )
+        commands.sync_fts_index()
+
+        # Delete the note as another Joplin client would
+        # NOTE: Joplin registers item changes of type 3 for deletions
+        Note.delete().where(Note.id == note_id).execute()
+        ItemChanges.create(
+            created_time=time_joplin() + 1, item=note_id, item_type=1, type=3
+        )
+        commands.sync_fts_index()
+        self.assertEqual(len(commands.search(test_query)), 0)
+
+    def tearDown(self):
+        for note_id in self.testnote_ids:
+            commands.delete(note_id)
+
+
+class TestBatchedTriggerBuild(unittest.TestCase):
+    def setUp(self):
+        NoteIndexShadow.drop_index_table()
+        NoteIndexShadow.create_index_table(triggers=True, batched=True)
+        self.testnote_ids = list()
+
+    def tearDown(self):
+        NoteIndexShadow.drop_index_table()
+        IndexMeta.delete().where(
+            IndexMeta.key == NoteIndexShadow.get_fill_key()
+        ).execute()
+        for note_id in self.testnote_ids:
+            commands.delete(note_id)
+
+    def test_writes_during_build_indexed_once(self):
+        words = [generate_random_word(30) for _ in range(3)]
+        for title in ("pyjoplin-test batched 1", "pyjoplin-test batched 2"):
+            self.testnote_ids.append(commands.new(title, "test", body=words[2]))
+        first_rowid = (
+            Note.select(SQL("rowid")).where(Note.id == self.testnote_ids[0]).scalar()
+        )
+        NoteIndexShadow.fill_batch(
+            Note.select().where(SQL("rowid") <= first_rowid).count()
+        )
+        # Edit of an indexed note follows triggers, the other one waits for its batch
+        for note_id, word in zip(self.testnote_ids, words):
+            note = Note.get(Note.id == note_id)
+            note.body = word
+            note.save()
+        self.assertEqual(NoteIndexShadow.fill_batch(), 1)
+
+        # NOTE: Fails on entries out of sync with the external content
+        table = NoteIndexShadow._meta.table_name
+        db.execute_sql(f"INSERT INTO {table}({table}) VALUES ('integrity-check')")
+        self.assertEqual(
+            [
+                NoteIndexShadow.select().where(NoteIndexShadow.match(word)).count()
+                for word in words
+            ],
+            [1, 1, 0],
+        )
+
+
+class TestTrigramIndex(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.had_trigram_index = NoteIndex.has_trigram_index()
+        if not cls.had_trigram_index:
+            commands.rebuild_fts_index(trigram=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        if not cls.had_trigram_index:
+            commands.rebuild_fts_index(trigram=False)
+
+    def test_substring_search(self):
+        test_word = generate_random_word(20)
+        note_id = commands.new(
+            "pyjoplin-test test_substring_search", "test", body="Resource%s" % test_word
+        )
+        try:
+            # Words index only knows the whole identifier
+            self.assertEqual(len(commands.search(test_word, mode="words")), 0)
+            self.assertEqual(len(commands.search(test_word, mode="substring")), 1)
+            # Falls back to substrings since no word matched
+            self.assertEqual(len(commands.search(test_word)), 1)
+        finally:
+            commands.delete(note_id)
+
+
+class TestSplitPassages(unittest.TestCase):
+    def test_split_at_headings_outside_code(self):
+        body = "intro\n# One\ntext\n```\n# comment\n```\n## Two\nmore"
+        passages = NotePassageIndex.split_passages(body)
+        self.assertEqual(
+            [offset for offset, _ in passages],
+            [0, body.index("# One"), body.index("## Two")],
+        )
+        self.assertEqual("".join(passage for _, passage in passages), body)
+
+    def test_split_long_sections_at_breaks(self):
+        body = "\n\n".join(["word " * 30] * 10)
+        passages = NotePassageIndex.split_passages(body, max_length=400)
+        self.assertTrue(all(len(passage) <= 400 for _, passage in passages))
+        for offset, passage in passages:
+            self.assertEqual(body[offset : offset + len(passage)], passage)
+            self.assertTrue(offset == 0 or body[offset - 2 : offset] == "\n\n")
+
+
+class TestPassageIndex(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.had_passage_index = NoteIndex.has_passage_index()
+        if not cls.had_passage_index:
+            commands.rebuild_fts_index(passages=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        if not cls.had_passage_index:
+            commands.rebuild_fts_index(passages=False)
+
+    def test_best_passage_offset(self):
+        test_word = generate_random_word(20)
+        body = "# Log\n%s\n# Solution\n%s fixed it" % ("noise\n" * 1000, test_word)
+        note_id = commands.new("pyjoplin-test test_best_passage_offset", "test", body)
+        try:
+            found_index_notes = commands.search(
+                test_word, mode="passages", fields=("uid", "offset", "snippet")
+            )
+            self.assertEqual(len(found_index_notes), 1)
+            self.assertEqual(found_index_notes[0]["uid"], note_id)
+            self.assertEqual(found_index_notes[0]["offset"], body.index("# Solution"))
+            self.assertNotIn("noise", found_index_notes[0]["snippet"])
+
+            # Passages follow saved changes
+            note = Note.get(Note.id == note_id)
+            note.body = "# Solution\nnothing"
+            note.save()
+            self.assertEqual(len(commands.search(test_word, mode="passages")), 0)
+        finally:
+            commands.delete(note_id)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+# coding=utf-8
+import unittest
+
+from pyjoplin import commands
+from pyjoplin.models import SQL, Note, NoteHeading
+from pyjoplin.tests.test_search import generate_random_word
+
+TEST_BODY = """intro
+# Setup
+## Install on %s ##
+```
+# comment, not a heading
+```
+# Solution: working
+blah
+```sh
+run me
+```
+# Other
+"""
+
+
+class TestExtractHeadings(unittest.TestCase):
+    def test_headings_outside_code(self):
+        body = TEST_BODY % "Ubuntu"
+        self.assertEqual(
+            NoteHeading.extract_headings(body),
+            [
+                (1, "Setup", body.index("# Setup")),
+                (2, "Install on Ubuntu", body.index("## Install")),
+                (1, "Solution: working", body.index("# Solution")),
+                (1, "Other", body.index("# Other")),
+            ],
+        )
+
+
+class TestHeadingIndex(unittest.TestCase):
+    def setUp(self):
+        self.test_word = generate_random_word(20)
+        self.note_id = commands.new(
+            "pyjoplin-test %s" % generate_random_word(30),
+            "test",
+            body=TEST_BODY % self.test_word,
+        )
+
+    def tearDown(self):
+        note = Note.get_or_none(Note.id == self.note_id)
+        if note is not None:
+            note.delete_instance()
+
+    def test_outline(self):
+        self.assertEqual(
+            [
+                (heading["level"], heading["text"])
+                for heading in commands.outline(self.note_id)
+            ],
+            [
+                (1, "Setup"),
+                (2, "Install on %s" % self.test_word),
+                (1, "Solution: working"),
+                (1, "Other"),
+            ],
+        )
+
+    def test_heading_filter(self):
+        found_index_notes = commands.search("h:%s" % self.test_word, fields=("uid",))
+        self.assertEqual(found_index_notes, [dict(uid=self.note_id)])
+        found_index_notes = commands.search(
+            "h:%s -h:solution" % self.test_word, fields=("uid",)
+        )
+        self.assertEqual(found_index_notes, [])
+
+    def test_section(self):
+        note = Note.get(Note.id == self.note_id)
+        note_rowid = Note.select(SQL("rowid")).where(Note.id == self.note_id).scalar()
+        self.assertEqual(
+            NoteHeading.get_section(note_rowid, note.body, "solution"),
+            "blah\n```sh\nrun me\n```\n",
+        )
+        self.assertIsNone(NoteHeading.get_section(note_rowid, note.body, "missing"))
+        # Body changed since its headings were indexed
+        self.assertEqual(
+            NoteHeading.get_section(note_rowid, "# Moved\n" + note.body, "solution"),
+            "blah\n```sh\nrun me\n```\n",
+        )
+
+    def test_headings_follow_saves(self):
+        note = Note.get(Note.id == self.note_id)
+        note.body = "# Renamed"
+        note.save()
+        self.assertEqual(
+            [heading["text"] for heading in commands.outline(self.note_id)],
+            ["Renamed"],
+        )
+
+    def test_delete_without_heading_index(self):
+        # As for databases indexed before headings were
+        NoteHeading.drop_table()
+        try:
+            commands.delete(self.note_id)
+            self.assertIsNone(Note.get_or_none(Note.id == self.note_id))
+            # NOTE: Left to rebuild_fts_index and sync_fts_index
+            self.assertFalse(NoteHeading.table_exists())
+        finally:
+            commands.rebuild_heading_index()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+# coding=utf-8
+import unittest
+
+from pyjoplin import commands
+from pyjoplin.models import Note, NoteLink
+from pyjoplin.tests.test_search import generate_random_word
+
+MISSING_UID = "0" * 32
+
+
+class TestExtractLinks(unittest.TestCase):
+    def test_links_once_per_target_without_self_links(self):
+        uid = "a" * 32
+        body = (
+            "See [one](joplin://%s), [again](joplin://%s),"
+            " [itself](joplin://%s) and [upper](joplin://%s)"
+            % ("b" * 32, "b" * 32, uid, "C" * 32)
+        )
+        self.assertEqual(
+            NoteLink.extract_links(uid, body), [(uid, "b" * 32), (uid, "c" * 32)]
+        )
+
+
+class TestLinkIndex(unittest.TestCase):
+    def setUp(self):
+        self.target_id = commands.new(
+            "pyjoplin-test %s" % generate_random_word(30), "test"
+        )
+        self.source_id = commands.new(
+            "pyjoplin-test %s" % generate_random_word(30),
+            "test",
+            body="[target](joplin://%s) [gone](joplin://%s)"
+            % (self.target_id, MISSING_UID),
+        )
+
+    def tearDown(self):
+        for uid in (self.source_id, self.target_id):
+            note = Note.get_or_none(Note.id == uid)
+            if note is not None:
+                note.delete_instance()
+
+    def test_links_indexed_on_save(self):
+        self.assertEqual(
+            [note["uid"] for note in commands.backlinks(self.target_id)],
+            [self.source_id],
+        )
+        self.assertEqual(
+            {note["uid"] for note in commands.links(self.source_id)},
+            {self.target_id, MISSING_UID},
+        )
+
+        # Editing the body replaces the links
+        note = Note.get(Note.id == self.source_id)
+        note.body = "no links anymore"
+        note.save()
+        self.assertEqual(commands.backlinks(self.target_id), [])
+
+    def test_deleted_target_reported_as_broken(self):
+        Note.get(Note.id == self.target_id).delete_instance()
+        self.assertEqual(
+            {
+                link["target"]
+                for link in commands.broken_links()
+                if link["uid"] == self.source_id
+            },
+            {self.target_id, MISSING_UID},
+        )
+
+    def test_save_without_link_index(self):
+        # As for databases indexed before links were
+        NoteLink.drop_table()
+        try:
+            note = Note.get(Note.id == self.source_id)
+            note.body = "no links anymore"
+            note.save()
+            self.assertEqual(
+                Note.get(Note.id == self.source_id).body, "no links anymore"
+            )
+            # NOTE: Left to rebuild_fts_index and sync_fts_index
+            self.assertFalse(NoteLink.table_exists())
+        finally:
+            commands.rebuild_link_index()
+        self.assertEqual(commands.backlinks(self.target_id), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
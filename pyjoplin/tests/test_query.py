@@ -0,0 +1,100 @@
+# coding=utf-8
+import unittest
+
+from pyjoplin import commands
+from pyjoplin.query import compile_query
+from pyjoplin.synonyms import SynonymTable
+from pyjoplin.tests.test_search import generate_random_word
+
+
+class TestCompileQuery(unittest.TestCase):
+    def test_malformed_queries_compile(self):
+        for search_str, expected_match in (
+            ('foo "bar', 'foo AND "bar"'),
+            ("((foo OR bar", "foo OR bar"),
+            ("foo ) bar )", "foo AND bar"),
+            ("foo OR", "foo"),
+            ("t:", None),
+            ("()", None),
+            ("OR *", None),
+            ("foo -", "foo"),
+        ):
+            self.assertEqual(
+                compile_query(search_str).match, expected_match, msg=search_str
+            )
+
+    def test_special_terms_quoted(self):
+        self.assertEqual(
+            compile_query('d3.js* web-app "a ""quoted"" word" AND').match,
+            '"d3.js"* AND "web-app" AND "a ""quoted"" word"',
+        )
+        self.assertEqual(compile_query("NEAR(a ^b, 5)").match, "NEAR(a ^b, 5)")
+
+    def test_leading_minus_negates(self):
+        for search_str, expected_match in (
+            ("foo -bar", "foo NOT bar"),
+            ('-"a b" c web-app', '(c AND "web-app") NOT "a b"'),
+            ("NOT bar foo", "foo NOT bar"),
+        ):
+            self.assertEqual(
+                compile_query(search_str).match, expected_match, msg=search_str
+            )
+        compiled_query = compile_query("-bar tag:x")
+        self.assertIsNone(compiled_query.match)
+        self.assertEqual(compiled_query.excluded, "bar")
+
+    def test_negation_in_or_kept(self):
+        # `foo OR -bar` matches all notes but `bar NOT foo`
+        for search_str, expected_match, expected_excluded in (
+            ("foo OR -bar", None, "bar NOT foo"),
+            ("-bar OR -baz", None, "bar AND baz"),
+            ("baz (foo OR -bar)", "baz NOT (bar NOT foo)", None),
+            ("-(-foo) bar", "foo AND bar", None),
+        ):
+            with self.subTest(search_str=search_str):
+                compiled_query = compile_query(search_str)
+                self.assertEqual(compiled_query.match, expected_match)
+                self.assertEqual(compiled_query.excluded, expected_excluded)
+
+    def test_synonyms_within_columns(self):
+        table = SynonymTable([["mvim", "Marvin vim"], ["py", "python"]])
+        compiled_query = compile_query("t:py Marvin vim mdate>1w", table)
+        self.assertEqual(
+            compiled_query.match,
+            "title:(py OR python) AND (mvim OR (Marvin AND vim))",
+        )
+        self.assertEqual(compiled_query.filters, ((False, "mdate>", "1w"),))
+
+    def test_search_with_stray_quote(self):
+        # Raw FTS5 syntax errors on these
+        for search_str in ('"pyjoplin', "pyjoplin)", "NOT pyjoplin AND"):
+            self.assertIsInstance(commands.search(search_str, limit=1), list)
+
+    def test_search_of_negations_only(self):
+        word = generate_random_word(20)
+        note_ids = [
+            commands.new(
+                "pyjoplin-test %s %s" % (word, body),
+                "test",
+                body="# %s\n%s" % (word, body),
+            )
+            for body in ("keep", "drop")
+        ]
+        try:
+            self.assertEqual(commands.search("NOT %s" % word), [])
+            self.assertEqual(commands.search("-%s" % word), [])
+            self.assertEqual(
+                commands.search("h:%s -drop" % word, fields=("uid",)),
+                [dict(uid=note_ids[0])],
+            )
+            self.assertEqual(
+                commands.search("h:%s nowhere OR -drop" % word, fields=("uid",)),
+                [dict(uid=note_ids[0])],
+            )
+        finally:
+            for note_id in note_ids:
+                commands.delete(note_id)
+
+
+if __name__ == "__main__":
+    unittest.main()
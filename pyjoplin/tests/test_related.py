@@ -0,0 +1,51 @@
+# coding=utf-8
+import importlib.util
+import unittest
+
+from pyjoplin import related
+from pyjoplin.related import RelatedIndex
+
+HAS_NUMERIC = all(
+    importlib.util.find_spec(name) is not None for name in ("numpy", "scipy")
+)
+
+
+@unittest.skipUnless(HAS_NUMERIC, "numpy and scipy not installed")
+class TestRelatedIndex(unittest.TestCase):
+    def setUp(self):
+        self.related_index = RelatedIndex.from_notes(
+            [
+                (1, "uid1", "Python logging", "configure logging handlers", 1),
+                (2, "uid2", "Logging in python", "handlers and formatters", 1),
+                (3, "uid3", "Vim plugins", "plugin managers for vim", 1),
+                (4, "uid4", "Vim colorschemes", "colors in the terminal", 1),
+            ]
+        )
+
+    def test_most_similar_first(self):
+        related = self.related_index.related("uid1", limit=3)
+        self.assertEqual(related[0][1], "uid2")
+        self.assertNotIn("uid1", [uid for _, uid in related])
+
+    def test_update_replaces_and_drops_notes(self):
+        self.related_index.update(
+            [(4, "uid4", "Python handlers", "logging handlers", 2)],
+            deleted_rowids=[2],
+        )
+        self.assertEqual(self.related_index.counts.shape[0], 3)
+        self.assertEqual(self.related_index.related("uid1", limit=1)[0][1], "uid4")
+
+    def test_update_weighs_changed_rows_only(self):
+        vectors = self.related_index.vectors.copy()
+        self.related_index.update([(5, "uid5", "Vim plugins", "plugin managers", 2)])
+        # Other rows keep their vectors until IDF is computed again
+        self.assertEqual((self.related_index.vectors[:4] != vectors).nnz, 0)
+        self.assertEqual(self.related_index.related("uid3", limit=1)[0][1], "uid5")
+        self.related_index.update(
+            [], deleted_rowids=range(100, 100 + related.MIN_STALE_NOTES)
+        )
+        self.assertEqual(self.related_index.num_stale, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
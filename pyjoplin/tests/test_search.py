@@ -2,7 +2,8 @@
 import unittest
 
 from pyjoplin import commands
-from pyjoplin.models import Note, NoteIndex, Folder
+from pyjoplin.models import Note, NoteHits, NoteIndex, Folder
+from pyjoplin.query import compile_query
 
 
 def generate_random_word(N):
@@ -13,15 +14,70 @@ def generate_random_word(N):
     return "".join(random.choices(string.ascii_lowercase, k=N))
 
 
+class FilterTestCase(unittest.TestCase):
+    """
+    Base of search filter tests, on notes sharing a random word
+    """
+
+    def create_notes(self, notebooks):
+        """
+        Create notes with the same word in their title and body, deleted after the test
+        :param notebooks: titles of the notebooks to create one note in each
+        :return: (word, list of note uids)
+        """
+        word = generate_random_word(30)
+        note_ids = list()
+        for idx, notebook in enumerate(notebooks):
+            note_id = commands.new(
+                "pyjoplin-test %s %d" % (word, idx), notebook, body=word
+            )
+            self.addCleanup(self.delete_note, note_id)
+            note_ids.append(note_id)
+        return word, note_ids
+
+    @staticmethod
+    def delete_note(uid):
+        note = Note.get_or_none(Note.id == uid)
+        if note is not None:
+            note.delete_instance()
+
+    def assert_search_uids(self, queries):
+        """
+        :param queries: iterable of (query, expected uids of found notes, in any order)
+        """
+        for query, expected_ids in queries:
+            with self.subTest(query=query):
+                self.assertEqual(
+                    {note["uid"] for note in commands.search(query)}, set(expected_ids)
+                )
+
+
 class TestSearchAliases(unittest.TestCase):
     def test_alias_only_found_after_space(self):
-        reference_str = "at: foo"
-        modified_str = commands.substitute_search_column_aliases(reference_str)
-        self.assertEqual(
-            reference_str,
+        modified_str = compile_query("at: foo").match
+        self.assertNotIn(
+            "title:",
             modified_str,
             msg="'t:' should be substituted ONLY after '^' (BOL) or ' ' (space)",
         )
+        self.assertEqual(
+            compile_query("t:foo b:(a OR b)").match, "title:foo AND body:(a OR b)"
+        )
+
+
+class TestExplicitAnd(unittest.TestCase):
+    def test_and_inserted_next_to_groups(self):
+        self.assertEqual(
+            compile_query("(python OR py) foo* title:(a OR b)").match,
+            "(python OR py) AND foo* AND title:(a OR b)",
+        )
+
+    def test_near_and_operators_kept(self):
+        # NOTE: NOT binds tighter than AND in FTS5
+        self.assertEqual(
+            compile_query("foo NEAR(a b) NOT (c OR d)").match,
+            "foo AND (NEAR(a b) NOT (c OR d))",
+        )
 
 
 class TestNoteSearch(unittest.TestCase):
@@ -74,10 +130,156 @@ class TestNoteSearch(unittest.TestCase):
         found_index_notes = commands.search(search_str)
         self.assertEqual(len(found_index_notes), 1)
 
+    def test_note_search_cache_invalidated_by_new_note(self):
+        test_query = generate_random_word(30)
+        found_index_notes = commands.search(test_query)
+        self.assertEqual(len(found_index_notes), 0)
+
+        # Repeated query, with different whitespace, is served from cache
+        num_hits = commands.search_cache.hits
+        found_index_notes = commands.search("  %s " % test_query)
+        self.assertEqual(commands.search_cache.hits, num_hits + 1)
+        self.assertEqual(len(found_index_notes), 0)
+
+        # Indexing a new note invalidates cached results
+        note_id = commands.new(
+            "pyjoplin-test test_note_search_cache_invalidated_by_new_note",
+            "test",
+            body=test_query,
+        )
+        self.testnote_ids.append(note_id)
+        found_index_notes = commands.search(test_query)
+        self.assertEqual(len(found_index_notes), 1)
+
+    def test_note_search_pagination(self):
+        test_query = generate_random_word(30)
+        for idx in range(3):
+            note_id = commands.new(
+                "pyjoplin-test test_note_search_pagination %d" % idx,
+                "test",
+                body=test_query,
+            )
+            self.testnote_ids.append(note_id)
+
+        all_ids = [note["uid"] for note in commands.search(test_query)]
+        self.assertEqual(len(all_ids), 3)
+        paged_ids = [
+            note["uid"]
+            for offset in range(0, 3, 2)
+            for note in commands.search(test_query, limit=2, offset=offset)
+        ]
+        self.assertEqual(paged_ids, all_ids)
+
+        # Stopping a stream early leaves the remaining rows unread
+        stream = commands.iter_search(test_query)
+        self.assertEqual(next(stream)["uid"], all_ids[0])
+        stream.close()
+
+    def test_note_search_fields(self):
+        test_query = generate_random_word(30)
+        note_id = commands.new(
+            "pyjoplin-test test_note_search_fields", "test", body="foo %s" % test_query
+        )
+        self.testnote_ids.append(note_id)
+
+        found_index_notes = commands.search(
+            test_query, fields=["uid", "highlight"], highlight_markers=("[", "]")
+        )
+        self.assertEqual(
+            found_index_notes, [{"uid": note_id, "highlight": "foo [%s]" % test_query}]
+        )
+
+    def test_note_search_ranking_boosts_hits(self):
+        test_query = generate_random_word(30)
+        for idx in range(2):
+            note_id = commands.new(
+                "pyjoplin-test test_note_search_ranking_boosts_hits %d" % idx,
+                "test",
+                body=test_query,
+            )
+            self.testnote_ids.append(note_id)
+
+        # The note opened most often comes first
+        for _ in range(3):
+            NoteHits.record_hit(self.testnote_ids[1])
+        found_index_notes = commands.search(test_query, ranking="weighted")
+        self.assertEqual(found_index_notes[0]["uid"], self.testnote_ids[1])
+
+    def test_note_batch_search(self):
+        test_query = generate_random_word(30)
+        note_id = commands.new(
+            "pyjoplin-test test_note_batch_search", "test", body=test_query
+        )
+        self.testnote_ids.append(note_id)
+
+        queries = [test_query, "bad mdate>yesterday", generate_random_word(30)] * 3
+        records = list(commands.batch_search(queries, jobs=2, fields=["uid"]))
+        self.assertEqual([record["index"] for record in records], list(range(9)))
+        self.assertEqual(records[0]["notes"], [{"uid": note_id}])
+        # A broken query reports its error without stopping the others
+        self.assertIn("error", records[1])
+        self.assertEqual(records[5]["notes"], [])
+
     def tearDown(self):
         for note_id in self.testnote_ids:
             commands.delete(note_id)
 
 
+class TestDateAndStatusFilters(FilterTestCase):
+    def test_split_comparison_operators(self):
+        compiled_query = compile_query("log mdate>=2024-01 -is:todo cdate<2w")
+        self.assertEqual(compiled_query.match, "log")
+        self.assertEqual(
+            compiled_query.filters,
+            (
+                (False, "mdate>=", "2024-01"),
+                (True, "is", "todo"),
+                (False, "cdate<", "2w"),
+            ),
+        )
+
+    def test_parse_search_date_periods(self):
+        from datetime import datetime
+
+        def timestamp(*args):
+            return int(datetime(*args).timestamp() * 1000)
+
+        self.assertEqual(
+            commands.parse_search_date("2024"),
+            (timestamp(2024, 1, 1), timestamp(2025, 1, 1)),
+        )
+        self.assertEqual(
+            commands.parse_search_date("2024-12"),
+            (timestamp(2024, 12, 1), timestamp(2025, 1, 1)),
+        )
+        self.assertEqual(
+            commands.parse_search_date("2024-02-29"),
+            (timestamp(2024, 2, 29), timestamp(2024, 3, 1)),
+        )
+        start, end = commands.parse_search_date("2w")
+        self.assertEqual(start, end)
+        with self.assertRaises(ValueError):
+            commands.parse_search_date("last week")
+
+    def test_search_restricted_by_date_and_status(self):
+        word, note_ids = self.create_notes(["test", "test"])
+        old_todo, recent_note = note_ids
+        # NOTE: Status and dates change no indexed column, so no reindexing needed
+        Note.update(
+            is_todo=1, updated_time=commands.parse_search_date("2001")[0]
+        ).where(Note.id == old_todo).execute()
+        self.assert_search_uids(
+            [
+                ("%s is:todo" % word, [old_todo]),
+                ("%s -is:todo" % word, [recent_note]),
+                ("%s is:done" % word, []),
+                ("%s mdate:2001" % word, [old_todo]),
+                ("%s mdate>2001" % word, [recent_note]),
+                ("%s mdate<=2001 is:todo" % word, [old_todo]),
+                ("%s mdate>1w" % word, [recent_note]),
+            ]
+        )
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,40 @@
+# coding=utf-8
+import asyncio
+import unittest
+
+from pyjoplin.models import database as db
+from pyjoplin.server import Cancelled, SearchService
+from pyjoplin.tests.test_search import generate_random_word
+
+
+def query_forever():
+    # Never finishes unless interrupted
+    return db.execute_sql(
+        "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) "
+        "SELECT count(*) FROM c"
+    ).fetchone()
+
+
+class TestSearchService(unittest.TestCase):
+    def test_new_request_cancels_previous_one(self):
+        async def scenario():
+            # A single worker, so the new search needs the stale query interrupted
+            service = SearchService(jobs=1)
+            try:
+                stale = asyncio.ensure_future(service.run("launcher", query_forever))
+                await asyncio.sleep(0.1)
+                found_index_notes = await service.search(
+                    "launcher", generate_random_word(30)
+                )
+                with self.assertRaises(Cancelled):
+                    await stale
+                return found_index_notes
+            finally:
+                service.close()
+
+        found_index_notes = asyncio.run(asyncio.wait_for(scenario(), timeout=10))
+        self.assertEqual(found_index_notes, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
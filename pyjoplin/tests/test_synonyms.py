@@ -3,6 +3,7 @@ import unittest
 
 from pyjoplin import commands
 from pyjoplin.models import Folder, Note, NoteIndex
+from pyjoplin.synonyms import SynonymTable
 
 
 class TestSynonyms(unittest.TestCase):
@@ -44,5 +45,22 @@ class TestSynonyms(unittest.TestCase):
         self.assertEqual(the_output, expected_output)
 
 
+class TestSynonymTable(unittest.TestCase):
+    def setUp(self):
+        self.table = SynonymTable(
+            [["m", "Marvin"], ["mvim", "MarvinVim", "Marvin vim"], ["py", "python"]]
+        )
+
+    def test_multiword_kw_longest_match(self):
+        the_output = self.table.expand("Marvin vim py")
+        expected_output = "(mvim OR MarvinVim OR Marvin vim) (py OR python)"
+        self.assertEqual(the_output, expected_output)
+
+    def test_whitespace_is_kept(self):
+        the_output = self.table.expand(" foo  Marvin\tpy* ")
+        expected_output = " foo  (m OR Marvin)\tpy* "
+        self.assertEqual(the_output, expected_output)
+
+
 if __name__ == "__main__":
     unittest.main()
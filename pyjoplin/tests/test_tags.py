@@ -0,0 +1,70 @@
+# coding=utf-8
+import unittest
+import uuid
+
+from pyjoplin.models import NoteTags, Tags
+from pyjoplin.query import compile_query
+from pyjoplin.tags import TagMap
+from pyjoplin.tests.test_search import FilterTestCase, generate_random_word
+from pyjoplin.utils import time_joplin
+
+
+class TestTagMap(unittest.TestCase):
+    def setUp(self):
+        self.tag_map = TagMap(
+            [("Python", 1), ("python", 2), ("pyjoplin", 2), ("vim", 3), ("vim", 1)]
+        )
+
+    def test_tags_case_insensitive_and_wildcards(self):
+        self.assertEqual(self.tag_map.rowids("PYTHON"), {1, 2})
+        self.assertEqual(self.tag_map.rowids("py*"), {1, 2})
+        self.assertEqual(self.tag_map.rowids("missing"), set())
+
+    def test_counts_most_used_first(self):
+        self.assertEqual(
+            self.tag_map.counts(), [("Python", 2), ("vim", 2), ("pyjoplin", 1)]
+        )
+
+
+class TestSearchFilters(FilterTestCase):
+    def test_split_filters_from_text(self):
+        compiled_query = compile_query('log* tag:python -tag:"old stuff" b:x')
+        self.assertEqual(compiled_query.match, "log* AND body:x")
+        self.assertEqual(
+            compiled_query.filters,
+            ((False, "tag", "python"), (True, "tag", "old stuff")),
+        )
+        # Only whole terms are filters
+        compiled_query = compile_query("notag:x")
+        self.assertEqual(
+            (compiled_query.match, compiled_query.filters), ('"notag:x"', ())
+        )
+
+    def test_search_restricted_to_tagged_notes(self):
+        word, note_ids = self.create_notes(["test", "test"])
+        tag_title = "pyjoplin-test-%s" % generate_random_word(10)
+        now = time_joplin()
+        tag = Tags.create(
+            id=uuid.uuid4().hex, title=tag_title, created_time=now, updated_time=now
+        )
+        self.addCleanup(tag.delete_instance)
+        note_tag = NoteTags.create(
+            id=uuid.uuid4().hex,
+            note=note_ids[0],
+            tag=tag.id,
+            created_time=now,
+            updated_time=now,
+        )
+        self.addCleanup(note_tag.delete_instance)
+        self.assert_search_uids(
+            [
+                (word, note_ids),
+                ("%s tag:%s" % (word, tag_title), note_ids[:1]),
+                ("%s -tag:%s" % (word, tag_title), note_ids[1:]),
+                ("tag:%s" % tag_title, note_ids[:1]),
+            ]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+# coding=utf-8
+import unittest
+
+from pyjoplin import commands
+from pyjoplin.models import ItemChanges, Note
+from pyjoplin.tests.test_search import generate_random_word
+from pyjoplin.titles import TitleIndex
+from pyjoplin.utils import time_joplin
+
+class TestTitleIndex(unittest.TestCase):
+    def setUp(self):
+        self.title_index = TitleIndex(
+            [
+                ("uid1", "Python logging", 1),
+                ("uid2", "python packaging", 2),
+                ("uid3", "Vim plugins for python", 3),
+                ("uid4", "Profiling in the terminal", 4),
+            ]
+        )
+
+    def test_find_exact_title(self):
+        self.assertEqual(self.title_index.find("python packaging"), "uid2")
+        self.assertIsNone(self.title_index.find("Python packaging"))
+
+    def test_prefix_completion_is_case_insensitive(self):
+        completions = self.title_index.complete("pyth", fuzzy=False)
+        # Shorter titles first, as closer to the query
+        self.assertEqual([uid for _, uid, _ in completions], ["uid1", "uid2"])
+
+    def test_fuzzy_completion_ranks_prefix_substring_subsequence(self):
+        completions = self.title_index.complete("pyt")
+        self.assertEqual(
+            [uid for _, uid, _ in completions][-1],
+            "uid3",
+            msg="Substring matches come after prefix matches",
+        )
+        # Closest characters first, e.g. 'plg' in 'plugins' over 'python logging'
+        completions = self.title_index.complete("plg")
+        self.assertEqual([uid for _, uid, _ in completions], ["uid3", "uid4", "uid1"])
+
+    def test_fuzzy_completion_of_repeated_characters(self):
+        # NOTE: Backtracking patterns took seconds on such titles
+        title_index = TitleIndex([("uid1", "a" * 60 + " note", 1)])
+        self.assertEqual(title_index.complete("a" * 8 + "z"), [])
+        self.assertEqual(
+            [uid for _, uid, _ in title_index.complete("a" * 8 + "e")], ["uid1"]
+        )
+
+
+class TestFindTitle(unittest.TestCase):
+    def test_new_note_found_by_title(self):
+        test_title = "pyjoplin-test %s" % generate_random_word(30)
+        note_id = commands.new(test_title, "test")
+        try:
+            self.assertEqual(commands.find_title(test_title), note_id)
+            self.assertEqual(commands.find_title(test_title[:-3], fuzzy=True), note_id)
+        finally:
+            commands.delete(note_id)
+        self.assertIsNone(commands.find_title(test_title))
+
+    def test_synced_rename_with_older_time_found(self):
+        test_title = "pyjoplin-test %s" % generate_random_word(30)
+        note_id = commands.new(test_title, "test")
+        newer_note_id = commands.new(test_title + " newer", "test")
+        try:
+            self.assertEqual(commands.find_title(test_title), note_id)
+            # Rename as a sync would, keeping the remote (older) updated_time
+            Note.update(title=test_title + " renamed", updated_time=1).where(
+                Note.id == note_id
+            ).execute()
+            ItemChanges.create(
+                created_time=time_joplin(), item=note_id, item_type=1, type=2
+            )
+            self.assertEqual(commands.find_title(test_title + " renamed"), note_id)
+        finally:
+            commands.delete(note_id)
+            commands.delete(newer_note_id)
+
+
+if __name__ == "__main__":
+    unittest.main()
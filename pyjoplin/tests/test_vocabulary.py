@@ -0,0 +1,73 @@
+# coding=utf-8
+import unittest
+
+from pyjoplin import commands, vocabulary
+from pyjoplin.tests.test_search import generate_random_word
+from pyjoplin.utils import save_snapshot
+from pyjoplin.vocabulary import VocabularyIndex, edit_distance
+
+
+class TestVocabularyIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = VocabularyIndex()
+        self.index.update(
+            [("python", 10), ("pylon", 1), ("docker", 5), ("dock", 7), ("x1f", 3)]
+        )
+
+    def test_edit_distance_counts_transpositions_once(self):
+        self.assertEqual(edit_distance("pyhton", "python", 2), 1)
+        self.assertEqual(edit_distance("pyton", "python", 2), 1)
+        self.assertEqual(edit_distance("docker", "dock", 1), 2)
+
+    def test_correct_closest_then_most_frequent(self):
+        self.assertEqual(self.index.correct("pyhton"), "python")
+        # As close to pylon, but python is in more notes
+        self.assertEqual(self.index.correct("pyton"), "python")
+        self.assertEqual(self.index.correct("dokcer"), "docker")
+        self.assertIsNone(self.index.correct("kubernetes"))
+
+    def test_update_masks_removed_terms(self):
+        self.index.update([("pylon", 1), ("docker", 5)])
+        self.assertNotIn("python", self.index)
+        self.assertEqual(self.index.correct("pyton"), "pylon")
+        self.assertEqual(len(self.index), 2)
+
+    def test_partial_update_keeps_other_terms(self):
+        self.index.update(
+            [("pylon", 4), ("python", 2), ("kubernetes", 1)], partial=True
+        )
+        self.assertIn("docker", self.index)
+        self.assertIn("kubernetes", self.index)
+        # Counts of other notes are unknown, so they never decrease
+        self.assertEqual(self.index.correct("pyton"), "python")
+        self.assertEqual(self.index.correct("kubernetis"), "kubernetes")
+
+
+class TestSuggestQuery(unittest.TestCase):
+    def test_misspelled_word_corrected(self):
+        # NOTE: Ending in x so that the stemmer keeps the word as is
+        word = generate_random_word(5) + "qz" + generate_random_word(4) + "x"
+        note_id = commands.new("pyjoplin-test %s" % word, "test", body=word)
+        try:
+            misspelled = word[:5] + "zq" + word[7:]
+            self.assertEqual(
+                commands.suggest_query("%s tag:x" % misspelled.upper()),
+                "%s tag:x" % word,
+            )
+            self.assertIsNone(commands.suggest_query(word))
+        finally:
+            commands.delete(note_id)
+
+    def test_snapshot_of_other_database_ignored(self):
+        # As for a snapshot left by a database since restored from backup
+        word = generate_random_word(8) + "x"
+        index = VocabularyIndex()
+        index.update([(word, 1)])
+        state = dict(identity=("other.sqlite", "0"), generation=1, num_stale=0)
+        save_snapshot(vocabulary.PATH_VOCABULARY_CACHE, (state, index))
+        vocabulary._cached_index = None
+        self.assertNotIn(word, vocabulary.get_vocabulary_index())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,174 @@
+# coding=utf-8
+"""
+In-memory index of note titles for exact, prefix and fuzzy lookups
+
+Titles are kept as sorted arrays, so exact and prefix lookups are binary
+searches, and fuzzy (subsequence) matching is a linear scan of each title.
+The index is cached in-process and in a snapshot file under config.PATH_CONFIG,
+so title completion never touches FTS.
+"""
+
+import bisect
+import os
+import threading
+
+from pyjoplin.configuration import config
+from pyjoplin.utils import load_snapshot
+
+PATH_TITLES_CACHE = os.path.join(config.PATH_CONFIG, "titles.cache")
+
+
+def find_subsequence(key, title_key, start=0):
+    """
+    Find the characters of a query in order in a title, each as early as possible
+    NOTE: Linear in the title length, unlike backtracking regex patterns
+    :param start: position in title_key to search from
+    :return: list of positions in title_key, or None if some character is missing
+    """
+    positions = list()
+    position = start
+    for char in key:
+        position = title_key.find(char, position)
+        if position < 0:
+            return None
+        positions.append(position)
+        position += 1
+    return positions
+
+
+class TitleIndex:
+    """
+    Note titles sorted case-insensitively, with their uids and update times
+    """
+
+    def __init__(self, rows):
+        """
+        :param rows: iterable of (uid, title, updated_time)
+        """
+        rows = sorted(rows, key=lambda row: (row[1].lower(), row[1]))
+        self.uids = [uid for uid, _, _ in rows]
+        self.titles = [title for _, title, _ in rows]
+        self.updated_times = [updated_time for _, _, updated_time in rows]
+        self.keys = [title.lower() for title in self.titles]
+
+    def __len__(self):
+        return len(self.titles)
+
+    def find(self, title):
+        """
+        Find note with exactly this title
+        :return: uid or None
+        """
+        key = title.lower()
+        idx = bisect.bisect_left(self.keys, key)
+        while idx < len(self.keys) and self.keys[idx] == key:
+            if self.titles[idx] == title:
+                return self.uids[idx]
+            idx += 1
+        return None
+
+    def prefix_range(self, prefix):
+        # Indices of titles starting with prefix (case-insensitive)
+        key = prefix.lower()
+        start = bisect.bisect_left(self.keys, key)
+        # NOTE: Highest code point sorts after any continuation of the prefix
+        end = bisect.bisect_left(self.keys, key + "\U0010ffff", lo=start)
+        return range(start, end)
+
+    def fuzzy_matches(self, query):
+        # Indices of titles containing the query characters in order
+        key = query.lower()
+        return [
+            idx
+            for idx, title_key in enumerate(self.keys)
+            if find_subsequence(key, title_key) is not None
+        ]
+
+    def score(self, query, idx):
+        """
+        Score how well a title matches a query, higher is better
+        3+ for prefixes, 2+ for substrings, up to 1 for subsequences
+        depending on how spread the matched characters are
+        """
+        key = query.lower()
+        title_key = self.keys[idx]
+        # Slightly prefer shorter titles, i.e. closer to the query
+        tie_break = 1.0 / (1 + len(title_key))
+        position = title_key.find(key)
+        if position == 0:
+            return 3.0 + tie_break
+        if position > 0:
+            at_word_start = not title_key[position - 1].isalnum()
+            return 2.0 + 0.5 * at_word_start + tie_break
+        # Shortest span containing the subsequence, trying each possible start
+        # NOTE: Earliest positions give the shortest span from a given start
+        shortest_span = None
+        start = title_key.find(key[0])
+        while start >= 0:
+            positions = find_subsequence(key, title_key, start)
+            if positions is None:
+                break
+            span = positions[-1] + 1 - start
+            shortest_span = min(span, shortest_span or span)
+            start = title_key.find(key[0], start + 1)
+        if shortest_span is None:
+            return 0.0
+        return len(key) / shortest_span + tie_break
+
+    def complete(self, query, limit=20, fuzzy=True):
+        """
+        Find titles matching a partial query, best first
+        :param query: beginning of the title, or some of its characters in order
+        :param limit: max number of matches
+        :param fuzzy: if False, prefix matches only
+        :return: list of (score, uid, title)
+        """
+        if not query:
+            return list()
+        if fuzzy:
+            candidates = self.fuzzy_matches(query)
+        else:
+            candidates = self.prefix_range(query)
+        matches = [(self.score(query, idx), idx) for idx in candidates]
+        # Ties go to the most recently updated notes
+        matches.sort(key=lambda match: (-match[0], -self.updated_times[match[1]]))
+        return [
+            (score, self.uids[idx], self.titles[idx]) for score, idx in matches[:limit]
+        ]
+
+
+def read_titles():
+    from pyjoplin.models import Note
+
+    return Note.select(Note.id, Note.title, Note.updated_time).tuples()
+
+
+# In-process cache, e.g. for the lifetime of a search daemon
+_cached_signature = None
+_cached_index = None
+# NOTE: Daemon workers may ask for the index at once, only one builds it
+_lock = threading.Lock()
+
+
+def get_title_index():
+    """
+    Get index of all note titles, cached in-process and on disk
+    Cache is invalidated by any change of notes, see Note.changes_signature
+    :return: TitleIndex
+    """
+    global _cached_signature, _cached_index
+
+    from pyjoplin.models import Note
+
+    signature = Note.changes_signature()
+    if signature == _cached_signature:
+        return _cached_index
+    with _lock:
+        if signature == _cached_signature:
+            return _cached_index
+        _cached_index = load_snapshot(
+            PATH_TITLES_CACHE, signature, lambda: TitleIndex(read_titles())
+        )
+        _cached_signature = signature
+        return _cached_index
+
@@ -2,7 +2,10 @@
 """
 Various miscellanea utils kept here for clarity
 """
+import pickle
+import threading
 import time
+from collections import OrderedDict
 from datetime import datetime
 import os
 
@@ -19,4 +22,117 @@ def generate_tempfile_name(prefix, suffix):
 def time_joplin():
     current_timestamp_sec = time.time()
     uint_current_timestamp_msec = int(current_timestamp_sec * 1000)
-    return uint_current_timestamp_msec
\ No newline at end of file
+    return uint_current_timestamp_msec
+
+
+def read_snapshot(path):
+    """
+    Read an object pickled by `save_snapshot`
+    :param path: snapshot file
+    :return: object, or None if missing or unreadable
+    """
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except Exception:
+        return None
+
+
+def save_snapshot(path, obj, dump=None):
+    """
+    Save an object to a snapshot file, replacing it atomically
+    :param path: snapshot file
+    :param obj: object to save
+    :param dump: function writing obj to an open binary file, pickle by default
+    :return:
+    """
+    # Write to temporary file first so concurrent readers never see it half-written
+    path_temp = "%s.%d" % (path, os.getpid())
+    with open(path_temp, "wb") as f:
+        if dump is None:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        else:
+            dump(obj, f)
+    os.replace(path_temp, path)
+
+
+def load_snapshot(path, signature, build):
+    """
+    Load an object from its snapshot if up to date, otherwise build and save it
+    :param path: snapshot file
+    :param signature: signature of the data the object is built from
+    :param build: function building the object from scratch
+    :return: object
+    """
+    snapshot = read_snapshot(path)
+    if snapshot is not None:
+        cached_signature, obj = snapshot
+        if cached_signature == signature:
+            return obj
+    obj = build()
+    save_snapshot(path, (signature, obj))
+    return obj
+
+
+class LRUCache:
+    """
+    Least-recently-used cache bounded by number of entries and total weight
+    e.g. weight as the number of rows in cached results
+    Safe to share between threads
+    """
+
+    def __init__(self, maxsize=128, maxweight=None, weigh=len):
+        self.maxsize = maxsize
+        self.maxweight = maxweight
+        self.weigh = weigh
+        self.entries = OrderedDict()
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value, _ = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        weight = self.weigh(value)
+        with self.lock:
+            self.pop(key)
+            if self.maxweight is not None and weight > self.maxweight:
+                # Would evict everything else, not worth caching
+                return
+            self.entries[key] = (value, weight)
+            self.weight += weight
+            # Evict least recently used entries
+            while len(self.entries) > self.maxsize or (
+                self.maxweight is not None and self.weight > self.maxweight
+            ):
+                _, (_, evicted_weight) = self.entries.popitem(last=False)
+                self.weight -= evicted_weight
+
+    def pop(self, key):
+        with self.lock:
+            if key in self.entries:
+                _, weight = self.entries.pop(key)
+                self.weight -= weight
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.weight = 0
+
+    def info(self):
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            size=len(self.entries),
+            weight=self.weight,
+        )
@@ -0,0 +1,306 @@
+# coding=utf-8
+"""
+Vocabulary of the search index, to suggest corrections of misspelled words
+
+Terms are read from an fts5vocab table over NoteIndex, i.e. porter stems,
+so query words are stemmed by SQLite the same way before lookup
+(see NoteIndex.stem_words).
+Close terms are found by symmetric deletes: terms are indexed under their
+variants with up to one character deleted, and words are looked up under
+their variants with up to two deleted, which finds all terms one edit away
+and most of those two edits away, then checked by edit distance.
+Variants are hashed into a sorted array of 64-bit keys (hash, term id),
+compact enough for hundreds of thousands of terms and searched by bisection.
+
+The index is cached in-process and in a snapshot file under config.PATH_CONFIG,
+for the database and index build it was read from (see IndexMeta fts_id).
+When the search index changes (see IndexMeta generation) only the terms of
+notes changed since are read and added; the whole vocabulary is read again
+once too many notes changed, which also masks terms no longer in the index.
+"""
+
+import array
+import bisect
+import os
+import threading
+import zlib
+
+from pyjoplin.configuration import config
+from pyjoplin.utils import read_snapshot, save_snapshot, time_joplin
+
+PATH_VOCABULARY_CACHE = os.path.join(config.PATH_CONFIG, "vocabulary.cache")
+
+# Terms worth correcting to, e.g. not uids, numbers nor single letters
+MIN_TERM_LENGTH = 3
+MAX_TERM_LENGTH = 24
+# NOTE: Only variants of the first characters are indexed, as in SymSpell,
+# since typos anywhere still leave most of these characters in place
+PREFIX_LENGTH = 7
+# Keys of added terms kept aside before merging them into the sorted array
+MAX_RECENT_KEYS = 4096
+# Notes changed since the last full read, as a fraction of all notes,
+# before reading all terms again rather than those of changed notes
+# NOTE: Terms of edited or deleted notes linger until then, as partial reads
+# cannot tell whether other notes still have them
+MAX_STALE_FRACTION = 0.05
+MIN_STALE_NOTES = 100
+
+
+def is_term(term):
+    return MIN_TERM_LENGTH <= len(term) <= MAX_TERM_LENGTH and term.isalpha()
+
+
+def max_distance(word):
+    # Short words have few close misspellings
+    return 1 if len(word) <= 4 else 2
+
+
+def delete_variants(word, num_deletes):
+    """
+    :return: set of strings with up to num_deletes characters deleted from word
+    """
+    variants = {word}
+    edge = {word}
+    for _ in range(num_deletes):
+        edge = {
+            variant[:idx] + variant[idx + 1 :]
+            for variant in edge
+            for idx in range(len(variant))
+        }
+        variants |= edge
+    return variants
+
+
+def hash_variant(variant):
+    # NOTE: crc32 rather than hash(), which is salted per process
+    return zlib.crc32(variant.encode("utf-8"))
+
+
+def edit_distance(word, other_word, limit):
+    """
+    Damerau-Levenshtein distance (optimal string alignment)
+    :return: distance, or limit + 1 if larger than limit
+    """
+    if abs(len(word) - len(other_word)) > limit:
+        return limit + 1
+    before_previous_row, previous_row = None, None
+    row = list(range(len(other_word) + 1))
+    for i in range(1, len(word) + 1):
+        previous_row, row = row, [i] + [0] * len(other_word)
+        for j in range(1, len(other_word) + 1):
+            cost = 0 if word[i - 1] == other_word[j - 1] else 1
+            row[j] = min(
+                previous_row[j] + 1, row[j - 1] + 1, previous_row[j - 1] + cost
+            )
+            if (
+                i > 1
+                and j > 1
+                and word[i - 1] == other_word[j - 2]
+                and word[i - 2] == other_word[j - 1]
+            ):
+                row[j] = min(row[j], before_previous_row[j - 2] + 1)
+        if min(row) > limit:
+            return limit + 1
+        before_previous_row = previous_row
+    return min(row[-1], limit + 1)
+
+
+class VocabularyIndex:
+    """
+    Terms of the search index with their number of notes,
+    plus symmetric delete variants of terms for lookup of close terms
+    """
+
+    def __init__(self):
+        self.terms = list()
+        self.term_ids = dict()
+        # NOTE: 0 for terms no longer in the index
+        self.doc_counts = array.array("q")
+        # Sorted keys (hash of variant << 32 | term id)
+        self.keys = array.array("Q")
+        # Term ids by variant hash, for terms added since the last merge
+        self.recent_term_ids = dict()
+        self.num_recent_keys = 0
+
+    def __len__(self):
+        return sum(1 for doc_count in self.doc_counts if doc_count)
+
+    def __contains__(self, term):
+        term_id = self.term_ids.get(term)
+        return term_id is not None and self.doc_counts[term_id] > 0
+
+    def update(self, vocabulary, partial=False):
+        """
+        Add new terms and refresh counts of known ones
+        :param vocabulary: iterable of (term, number of notes) for ALL terms in the index
+        :param partial: vocabulary is that of some notes only, e.g. changed ones,
+            so missing terms are kept and counts only grow
+        :return:
+        """
+        if partial:
+            current_counts = array.array("q", self.doc_counts)
+        else:
+            current_counts = array.array("q", bytes(8 * len(self.terms)))
+        new_keys = array.array("Q")
+        for term, doc_count in vocabulary:
+            if not is_term(term):
+                continue
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                term_id = len(self.terms)
+                self.terms.append(term)
+                self.term_ids[term] = term_id
+                current_counts.append(doc_count)
+                new_keys.extend(
+                    hash_variant(variant) << 32 | term_id
+                    for variant in delete_variants(term[:PREFIX_LENGTH], 1)
+                )
+            elif partial:
+                current_counts[term_id] = max(current_counts[term_id], doc_count)
+            else:
+                current_counts[term_id] = doc_count
+        self.doc_counts = current_counts
+
+        # NOTE:
+        #   A few new keys go to a dict rather than re-sorting all keys each time
+        #   but many are merged at once, as dicts take ~10x the memory of arrays
+        if len(new_keys) + self.num_recent_keys <= MAX_RECENT_KEYS:
+            for key in new_keys:
+                self.recent_term_ids.setdefault(key >> 32, []).append(key & 0xFFFFFFFF)
+            self.num_recent_keys += len(new_keys)
+            return
+        new_keys.extend(
+            variant_hash << 32 | term_id
+            for variant_hash, term_ids in self.recent_term_ids.items()
+            for term_id in term_ids
+        )
+        # NOTE: Sorting is close to linear, as existing keys are one sorted run
+        self.keys = array.array("Q", sorted(self.keys + new_keys))
+        self.recent_term_ids = dict()
+        self.num_recent_keys = 0
+
+    def candidates(self, word):
+        """
+        Find terms sharing some delete variant with a word
+        :return: set of term ids
+        """
+        term_ids = set()
+        hashes = {
+            hash_variant(variant)
+            for variant in delete_variants(word[:PREFIX_LENGTH], max_distance(word))
+        }
+        for variant_hash in hashes:
+            position = bisect.bisect_left(self.keys, variant_hash << 32)
+            while (
+                position < len(self.keys) and self.keys[position] >> 32 == variant_hash
+            ):
+                term_ids.add(self.keys[position] & 0xFFFFFFFF)
+                position += 1
+            term_ids.update(self.recent_term_ids.get(variant_hash, ()))
+        return term_ids
+
+    def correct(self, word):
+        """
+        Find the closest term to a word, most frequent first among equally close
+        :param word: term as tokenized by the index, e.g. a stem
+        :return: term, or None if none is close enough
+        """
+        limit = max_distance(word)
+        best = None
+        for term_id in self.candidates(word):
+            doc_count = self.doc_counts[term_id]
+            term = self.terms[term_id]
+            if not doc_count or term == word:
+                continue
+            distance = edit_distance(word, term, limit)
+            if distance <= limit:
+                rank = (distance, -doc_count, term)
+                best = min(best, rank) if best else rank
+        return best[2] if best else None
+
+
+# In-process cache, e.g. for the lifetime of a search daemon
+_cached_state = None
+_cached_index = None
+_lock = threading.Lock()
+
+
+def get_vocabulary_index():
+    """
+    Get vocabulary of the search index, cached in-process and on disk
+    and refreshed whenever the index changes
+    :return: VocabularyIndex
+    """
+    global _cached_state, _cached_index
+
+    from pyjoplin.models import IndexMeta, path_database
+
+    # NOTE: The build id tells apart rebuilt or restored databases at the same path
+    identity = (path_database, IndexMeta.get_value("fts_id"))
+    generation = IndexMeta.get_generation()
+    if (
+        _cached_index is not None
+        and _cached_state.get("identity") == identity
+        and _cached_state.get("generation") == generation
+    ):
+        return _cached_index
+    with _lock:
+        if _cached_index is None or _cached_state.get("identity") != identity:
+            _cached_state, _cached_index = load_vocabulary_index()
+        if (
+            _cached_state.get("identity") != identity
+            or _cached_state.get("generation") != generation
+        ):
+            _cached_state, _cached_index = refresh_vocabulary_index(
+                _cached_state, _cached_index, identity, generation
+            )
+            save_snapshot(PATH_VOCABULARY_CACHE, (_cached_state, _cached_index))
+        return _cached_index
+
+
+def refresh_vocabulary_index(state, index, identity, generation):
+    """
+    Bring a vocabulary up to date with the search index,
+    reading only terms of notes changed since the last refresh if few did
+    :param state: dict of the cached vocabulary, empty if none
+    :param index: cached VocabularyIndex
+    :param identity: (database path, index build id) of the search index
+    :param generation: current generation of the search index
+    :return: (state, index) refreshed
+    """
+    from pyjoplin.models import Note, NoteIndex
+
+    # NOTE: Taken before reading, so notes saved meanwhile are read again next time
+    refresh_time = time_joplin()
+    num_stale = None
+    if identity[1] is not None and state.get("identity") == identity:
+        changed_uids = Note.changed_since(state["refresh_time"])
+        num_stale = state["num_stale"] + len(changed_uids)
+        if num_stale > max(MIN_STALE_NOTES, MAX_STALE_FRACTION * Note.select().count()):
+            num_stale = None
+        elif changed_uids:
+            index.update(NoteIndex.read_note_vocabulary(changed_uids), partial=True)
+    if num_stale is None:
+        if state.get("identity") != identity:
+            # Term ids of another database are of no use
+            index = VocabularyIndex()
+        index.update(NoteIndex.read_vocabulary())
+        num_stale = 0
+    state = dict(
+        identity=identity,
+        generation=generation,
+        refresh_time=refresh_time,
+        num_stale=num_stale,
+    )
+    return state, index
+
+
+def load_vocabulary_index():
+    try:
+        state, index = read_snapshot(PATH_VOCABULARY_CACHE)
+        if isinstance(state, dict) and isinstance(index, VocabularyIndex):
+            return state, index
+    except (TypeError, ValueError):
+        pass
+    # Missing, unreadable or outdated snapshot, read all terms again
+    return dict(), VocabularyIndex()
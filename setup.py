@@ -14,9 +14,13 @@ setup(
     author_email='jesusbriales@gmail.com',
     packages=['pyjoplin', ],
     install_requires=open('requirements.txt').readlines(),
+    extras_require={
+        # For pyjoplin related
+        'related': ['numpy', 'scipy'],
+    },
     entry_points={
         'console_scripts': [
-            'pyjoplin = pyjoplin.main:main'
+            'pyjoplin = pyjoplin.client:main'
         ],
     },
 )